@@ -0,0 +1,270 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+# ---------------------------------------------------------------------------------------------------------------------
+# BENCHMARKS ----------------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Times every device function of components.py over representative parameters, and a full populate_gds run with the
+# GDS write timed separately, and the same layout written as GDSII and as OASIS to compare write time and file size.
+# Results are saved as JSON so two runs (e.g. before and after a gdshelpers upgrade) can be compared:
+#
+#   python benchmarks.py run -o before.json
+#   python benchmarks.py run -o after.json
+#   python benchmarks.py compare before.json after.json --threshold 0.1
+
+BENCHMARK_REPEATS = 5
+BENCHMARK_THRESHOLD = 0.1   # Slow down (fraction of the baseline time) reported as a regression
+
+
+# Function which returns the benchmark cases: name -> (device function, keyword arguments). The parameters span the
+# ranges the device sweeps in device_sweeps.py use.
+def benchmark_cases():
+
+    import components
+    from parameters import coupler_params
+
+    mzi_kwargs = dict(coupler_params=coupler_params, coupling_length=1.27, gap=0.25, path_length_difference=0)
+    mmi_kwargs = dict(coupler_params=coupler_params, mmi_width=6, mmi_taper_width=1.5, mmi_taper_length=20)
+
+    cases = {}
+    for taper_route in (10, 130, 250):
+        cases['grating_loopback route={}'.format(taper_route)] = (
+            components.grating_loopback, dict(coupler_params=coupler_params, taper_route=taper_route))
+    for coupling_length in (1.27, 5):
+        cases['directional_coupler L={}'.format(coupling_length)] = (
+            components.directional_coupler, dict(coupler_params=coupler_params, coupling_length=coupling_length,
+                                                 gap=0.25))
+    cases['mmi_1x2'] = (components.mmi_1x2, dict(mmi_kwargs, mmi_length=32.7))
+    cases['mmi_2x2'] = (components.mmi_2x2, dict(mmi_kwargs, mmi_length=44.8))
+    for radius in (70, 120):
+        for gap in (0.25, 0.75):
+            cases['ring_resonator r={} gap={}'.format(radius, gap)] = (
+                components.ring_resonator, dict(coupler_params=coupler_params, radius=radius, gap=gap))
+    for number in (2, 14, 26):
+        cases['spiral_loopback loops={}'.format(number)] = (
+            components.spiral_loopback, dict(coupler_params=coupler_params, number=number, gap_size=10,
+                                             inner_gap_size=15))
+    cases['mzi_dc'] = (components.mzi_dc, dict(mzi_kwargs, mzi_centre_spacing=75))
+    cases['mzi_dc2'] = (components.mzi_dc2, dict(mzi_kwargs, mzi_centre_spacing=75))
+    cases['cascaded_mzi_dc'] = (components.cascaded_mzi_dc, dict(mzi_kwargs, mzi_center_spacing=75))
+
+    return cases
+
+
+# Function which fractures every polygon of a cell and its sub cells within the vertex budget, the geometry work
+# save_layout does
+def fracture_cell(cell, done=None):
+
+    from vertex_budget import budgeted_fracturing
+
+    done = set() if done is None else done
+    if cell.name in done:
+        return
+    done.add(cell.name)
+
+    with budgeted_fracturing():
+        for polygons in cell.get_fractured_layer_dict().values():
+            for polygon in polygons:
+                pass
+    for sub_cell in cell.cells:
+        fracture_cell(sub_cell['cell'], done)
+
+
+def summarize(times):
+
+    return dict(min=min(times), median=statistics.median(times), mean=statistics.mean(times), repeats=len(times))
+
+
+# Function which times one device: 'build' is the device function call, 'geometry' the polygons of the device
+def benchmark_device(device_function, device_kwargs, repeats=BENCHMARK_REPEATS):
+
+    # One untimed call first, so the grating coupler library and geometry caches are warm like in a real build
+    fracture_cell(device_function(**device_kwargs))
+
+    build_times = []
+    geometry_times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        device_cell = device_function(**device_kwargs)
+        build_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        fracture_cell(device_cell)
+        geometry_times.append(time.perf_counter() - start)
+
+    return dict(build=summarize(build_times), geometry=summarize(geometry_times),
+                total=summarize([b + g for b, g in zip(build_times, geometry_times)]))
+
+
+# Function which times a full populate_gds run, serially and without the device cache, splitting the time into the
+# profiler phases (build devices, plan layout, save GDS, ...). The layout is saved with Cell.save, the streaming writer
+# would copy the records of the devices from the fragment cache and write them while they are built.
+def benchmark_populate_gds(repeats=1, workers=1):
+
+    import design_space
+    import device_sweeps
+    from build_profiler import PROFILE
+    from device_cache import CachedDevice
+
+    devices = [device for device in vars(device_sweeps).values() if isinstance(device, CachedDevice)]
+    cache_paths = [device.cache_path for device in devices]
+
+    phase_times = {}
+    total_times = []
+    for _ in range(repeats):
+        with tempfile.TemporaryDirectory() as temp_path:
+            # An empty cache folder for every run, so every device is generated. The cache folders are restored
+            # afterwards, later builds in this process use the device cache again.
+            try:
+                for device in devices:
+                    device.cache_path = temp_path
+
+                design_space.sweep_workers = workers
+                PROFILE.enabled = True
+                PROFILE.reset()
+
+                start = time.perf_counter()
+                layout_cell, polygon = design_space.generate_blank_gds()
+                design_space.populate_gds(layout_cell, polygon, filename=os.path.join(temp_path, 'benchmark.gds'),
+                                          stream=False)
+                total_times.append(time.perf_counter() - start)
+            finally:
+                for device, cache_path in zip(devices, cache_paths):
+                    device.cache_path = cache_path
+
+        for row in PROFILE.rows():
+            if row['category'] == 'phase':
+                phase_times.setdefault(row['name'], []).append(row['seconds'])
+
+    results = {'populate_gds': summarize(total_times)}
+    for name, times in phase_times.items():
+        results['populate_gds: ' + name] = summarize(times)
+
+    return results
+
+
+# Function which times writing the same layout as GDSII and as OASIS (see oasis_export.py), the results also hold the
+# file sizes in bytes
+def benchmark_output_formats(repeats=BENCHMARK_REPEATS, workers=1):
+
+    import design_space
+
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_path:
+        design_space.sweep_workers = workers
+        layout_cell, polygon = design_space.generate_blank_gds()
+        top_cell = design_space.populate_gds(layout_cell, polygon, filename=os.path.join(temp_path, 'layout.gds'),
+                                             stream=False, probe_map=False, write_table=False)
+
+        for output_format in ('gds', 'oas'):
+            filename = os.path.join(temp_path, 'benchmark.' + output_format)
+            times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                design_space.save_layout(top_cell, filename, output_format)
+                times.append(time.perf_counter() - start)
+            results['write ' + output_format] = dict(summarize(times), bytes=os.path.getsize(filename))
+
+    return results
+
+
+# Function which records the versions the benchmark ran with, so results from different setups can be told apart
+def benchmark_environment():
+
+    import gdshelpers
+    import numpy
+    import shapely
+
+    return dict(python=platform.python_version(), platform=platform.platform(), gdshelpers=gdshelpers.__version__,
+                shapely=shapely.__version__, numpy=numpy.__version__, time=time.strftime('%Y-%m-%d %H:%M:%S'))
+
+
+def run_benchmarks(devices=None, repeats=BENCHMARK_REPEATS, full_build=True, workers=1):
+
+    results = {}
+    for name, (device_function, device_kwargs) in benchmark_cases().items():
+        if devices and device_function.__name__ not in devices:
+            continue
+        timing = benchmark_device(device_function, device_kwargs, repeats)
+        for part, summary in timing.items():
+            results['{0} [{1}]'.format(name, part)] = summary
+        print('{0:<45} {1:>10.2f} ms'.format(name, 1000 * timing['total']['median']))
+
+    if full_build:
+        results.update(benchmark_populate_gds(workers=workers))
+        print('{0:<45} {1:>10.2f} s'.format('populate_gds', results['populate_gds']['median']))
+
+        results.update(benchmark_output_formats(repeats, workers))
+        for output_format in ('gds', 'oas'):
+            summary = results['write ' + output_format]
+            print('{0:<45} {1:>10.2f} s {2:>9.2f} MB'.format('write ' + output_format, summary['median'],
+                                                             summary['bytes'] / 1024 ** 2))
+
+    return dict(environment=benchmark_environment(), results=results)
+
+
+# Function which compares two benchmark runs, returns the names of the benchmarks which slowed down by more than
+# threshold (a fraction of the baseline median)
+def compare_benchmarks(baseline, current, threshold=BENCHMARK_THRESHOLD):
+
+    regressions = []
+    print('{0:<60} {1:>11} {2:>11} {3:>8}'.format('Benchmark', 'Baseline ms', 'Current ms', 'Change'))
+    for name, summary in current['results'].items():
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name]['median']
+        after = summary['median']
+        change = (after - before) / before if before > 0 else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('{0:<60} {1:>11.2f} {2:>11.2f} {3:>+8.1%}{4}'.format(name, 1000 * before, 1000 * after, change, flag))
+
+    return regressions
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark the device generators and populate_gds')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the benchmarks and save the results as JSON')
+    run_parser.add_argument('-o', '--output', default='benchmark_results.json', help='default: %(default)s')
+    run_parser.add_argument('-r', '--repeats', type=int, default=BENCHMARK_REPEATS, help='default: %(default)s')
+    run_parser.add_argument('-d', '--devices', nargs='+', metavar='DEVICE', help='only benchmark these functions')
+    run_parser.add_argument('--skip-full', action='store_true', help="don't benchmark a full populate_gds run")
+    run_parser.add_argument('-j', '--workers', type=int, default=1,
+                            help='processes for the populate_gds run (default: %(default)s, serial)')
+
+    compare_parser = commands.add_parser('compare', help='compare two benchmark results')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('-t', '--threshold', type=float, default=BENCHMARK_THRESHOLD,
+                                help='slow down reported as a regression (default: %(default)s = 10%%)')
+
+    arguments = parser.parse_args()
+
+    if arguments.command == 'run':
+        benchmark_results = run_benchmarks(arguments.devices, arguments.repeats, not arguments.skip_full,
+                                           arguments.workers)
+        with open(arguments.output, 'w') as f:
+            json.dump(benchmark_results, f, indent=2)
+
+    else:
+        with open(arguments.baseline) as f:
+            baseline_results = json.load(f)
+        with open(arguments.current) as f:
+            current_results = json.load(f)
+
+        slower = compare_benchmarks(baseline_results, current_results, arguments.threshold)
+        if slower:
+            print('{0} benchmarks slowed down by more than {1:.0%}'.format(len(slower), arguments.threshold))
+            sys.exit(1)
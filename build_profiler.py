@@ -0,0 +1,144 @@
+import functools
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows, only the timings are recorded there
+    resource = None
+
+# ---------------------------------------------------------------------------------------------------------------------
+# BUILD PROFILER ------------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Records how long every device function and every phase of the chip build takes, and how much each raises the peak
+# memory (RSS) of the process. Recording an entry costs a couple of microseconds, so it is on by default.
+# Entries nest: the time of a Text label rendered inside a device function is included in the device's time too.
+
+PROFILE_BUILD = True
+
+# Order the categories are reported in
+PROFILE_CATEGORIES = ['phase', 'device', 'part']
+
+
+# Function which returns the peak memory of this process in MB (0 if it can't be measured)
+def peak_memory():
+
+    if resource is None:
+        return 0.0
+
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+class BuildProfile:
+
+    def __init__(self, enabled=PROFILE_BUILD):
+
+        self.enabled = enabled
+        self.records = {}   # (category, name): [calls, seconds, peak memory increase in MB]
+
+    def reset(self):
+
+        self.records = {}
+
+    def add(self, category, name, seconds, memory=0.0, calls=1):
+
+        record = self.records.setdefault((category, name), [0, 0.0, 0.0])
+        record[0] += calls
+        record[1] += seconds
+        record[2] += memory
+
+    # Function which adds the records of another profile, e.g. the one of a sweep worker process
+    def merge(self, records):
+
+        for (category, name), (calls, seconds, memory) in records.items():
+            self.add(category, name, seconds, memory, calls)
+
+    @contextmanager
+    def phase(self, name, category='phase'):
+
+        if not self.enabled:
+            yield
+            return
+
+        start_memory = peak_memory()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(category, name, time.perf_counter() - start, peak_memory() - start_memory)
+
+    def rows(self):
+
+        order = {category: i for i, category in enumerate(PROFILE_CATEGORIES)}
+        keys = sorted(self.records, key=lambda key: (order.get(key[0], len(order)), -self.records[key][1]))
+
+        return [dict(category=category, name=name, calls=self.records[(category, name)][0],
+                     seconds=self.records[(category, name)][1], peak_memory_mb=self.records[(category, name)][2])
+                for category, name in keys]
+
+    # Function which formats the records as a table, phases first, then device functions, then gdshelpers parts
+    def report(self):
+
+        lines = ['{0:<8} {1:<28} {2:>7} {3:>10} {4:>10} {5:>12}'.format('', 'Name', 'Calls', 'Total s', 'Mean ms',
+                                                                       'Peak MB +')]
+        for row in self.rows():
+            lines.append('{category:<8} {name:<28} {calls:>7} {seconds:>10.3f} {0:>10.2f} {peak_memory_mb:>12.1f}'
+                         .format(1000 * row['seconds'] / max(row['calls'], 1), **row))
+
+        return '\n'.join(lines)
+
+    def save_json(self, filename):
+
+        with open(filename, 'w') as f:
+            json.dump(self.rows(), f, indent=2)
+
+
+# The profile of this process, the device functions and populate_gds record into it
+PROFILE = BuildProfile()
+
+
+# Decorator which records every call of a device function in PROFILE, used as @profiled or @profiled(category='part')
+def profiled(function=None, category='device', name=None):
+
+    if function is None:
+        return functools.partial(profiled, category=category, name=name)
+
+    name = name or function.__name__
+
+    @functools.wraps(function)
+    def profiled_function(*args, **kwargs):
+        with PROFILE.phase(name, category):
+            return function(*args, **kwargs)
+
+    return profiled_function
+
+
+# Function which wraps a method of a library class (e.g. gdshelpers' Text) so its calls are recorded in PROFILE too
+def profile_method(cls, method_name, name, category='part'):
+
+    method = getattr(cls, method_name)
+    if getattr(method, '__wrapped__', None) is not None:
+        return  # Already profiled
+
+    setattr(cls, method_name, profiled(method, category=category, name=name))
+
+
+# Function which profiles the gdshelpers steps the chip build spends most of its time in
+def profile_gdshelpers():
+
+    import vertex_budget
+    from gdshelpers.geometry.chip import Cell
+    from gdshelpers.parts.coupler import GratingCoupler
+    from gdshelpers.parts.text import Text
+
+    profile_method(Text, 'get_shapely_object', 'Text labels')
+    profile_method(GratingCoupler, 'get_shapely_object', 'GratingCoupler')
+    profile_method(Cell, 'get_fractured_layer_dict', 'fracture cells (save)')
+    # The writers fracture with the vertex budget instead (see vertex_budget.budgeted_fracturing)
+    profile_method(vertex_budget, 'budgeted_fractured_layer_dict', 'fracture cells (save)')
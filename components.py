@@ -1,4 +1,9 @@
+import hashlib
+from collections import namedtuple
+from functools import lru_cache
+
 import numpy as np
+import scipy.interpolate
 from math import pi
 
 import shapely.geometry.multipolygon
@@ -10,12 +15,15 @@ from gdshelpers.parts.spiral import Spiral
 from gdshelpers.parts.splitter import MMI
 from gdshelpers.parts.resonator import RingResonator
 from gdshelpers.parts.splitter import DirectionalCoupler
-from gdshelpers.parts.text import Text
 from gdshelpers.parts.image import GdsImage
-from shapely.geometry import Polygon, Point
+from shapely.geometry import LineString, MultiPolygon, Polygon, Point
+from shapely.affinity import rotate, translate
 from gdshelpers.geometry.shapely_adapter import geometric_union
 
 from parameters import *
+from build_profiler import profiled
+from grating_alignment import coupler_ports
+from labels import Label
 
 # ---------------------------------------------------------------------------------------------------------------------
 # GRATING COUPLER -----------------------------------------------------------------------------------------------------
@@ -25,8 +33,160 @@ from parameters import *
 # GRATING COUPLER DEFINITION
 ############################
 
-# Do not delete or change!
-CORNERSTONE_GRATING_IDENTIFIER = 0
+# Library of Cornerstone grating coupler cells, keyed by the coupler parameters and the grating angle.
+# Each distinct coupler is generated once at the origin and then placed by reference wherever it is used.
+CORNERSTONE_GRATING_LIBRARY = {}
+
+# The same library cells indexed by cell name, used to re-share couplers of devices loaded from disk or other processes
+CORNERSTONE_GRATING_CELL_PREFIX = "GC_period_"
+CORNERSTONE_GRATING_CELLS = {}
+
+
+# Function which turns a coupler parameter dictionary and a grating angle into a hashable library key
+def coupler_library_key(coupler_params, grating_angle):
+
+    params_key = tuple(sorted((key, float(np.around(value, 9))) for key, value in coupler_params.items()))
+
+    return params_key, float(np.around(grating_angle, 9))
+
+
+# Function which reduces a coupler parameter dictionary to the normalized values the coupler geometry depends on
+def normalize_coupler_params(coupler_params):
+
+    return (float(np.around(coupler_params['width'], 9)),
+            float(np.around(coupler_params['full_opening_angle'], 9)),
+            float(np.around(coupler_params['grating_period'], 9)),
+            float(np.around(coupler_params['grating_ff'], 9)),
+            int(coupler_params['n_gratings']),
+            float(np.around(coupler_params['taper_length'], 9)))
+
+
+# Function which returns the vertices of a traditional gdshelpers grating coupler at the origin as numpy arrays: the taper
+# triangle, shape (points, 2), and the teeth, shape (n_gratings, 2 * n_points, 2). It follows GratingCoupler._generate
+# but evaluates the arcs of all teeth in one broadcast operation instead of one tooth at a time.
+def coupler_vertices(width, full_opening_angle, grating_period, grating_ff, n_gratings, taper_length, angle=-np.pi/2,
+                     n_points=197):
+    opening_angle = full_opening_angle / 2
+    alpha = np.pi / 2 - opening_angle
+    c_radius = -np.sin(alpha) * width / 2 / (np.sin(alpha) - 1)
+
+    # Taper triangle: two quarter circles from the waveguide out to the opening angle, closed by the inner circle
+    phi = np.linspace(0, opening_angle, 90) - np.pi / 2
+    upper_half = np.column_stack((np.cos(phi) * c_radius, np.sin(phi) * c_radius + c_radius + width / 2))
+    phi = np.linspace(-opening_angle, 0, 90) + np.pi / 2
+    lower_half = np.column_stack((np.cos(phi) * c_radius, np.sin(phi) * c_radius - c_radius - width / 2))
+    phi = np.linspace(opening_angle, -opening_angle, n_points)
+    inner_circle = taper_length * np.column_stack((np.cos(phi), np.sin(phi)))
+
+    rotation_matrix = np.array(((np.cos(angle), np.sin(angle)), (-np.sin(angle), np.cos(angle))))
+    triangle = np.vstack((upper_half, inner_circle, lower_half)) @ rotation_matrix
+
+    # Teeth: every grating edge is an arc, pair the inner edge of each tooth with its reversed outer edge
+    edges = np.cumsum([taper_length] + [grating_period * (1 - grating_ff), grating_period * grating_ff] * n_gratings)
+    phi = np.linspace(-opening_angle + angle, opening_angle + angle, n_points)
+    arcs = edges[1:, None, None] * np.stack((np.cos(phi), np.sin(phi)), axis=-1)
+    teeth = np.concatenate((arcs[0::2], arcs[1::2, ::-1]), axis=1)
+
+    return triangle, teeth
+
+
+# Function which generates the Cornerstone coupler geometry (see cornerstone_coupler_geometry) from coupler_vertices.
+# The triangle doesn't touch the teeth, so the coupler is their MultiPolygon. Its outline is the hull of the triangle and
+# the outermost tooth, which spans all the teeth inside it.
+def numpy_coupler_geometry(width, full_opening_angle, grating_period, grating_ff, n_gratings, taper_length):
+    triangle, teeth = coupler_vertices(width, full_opening_angle, grating_period, grating_ff, n_gratings,
+                                       taper_length)
+    gc_proto_shape_obj = MultiPolygon([Polygon(triangle)] + [Polygon(tooth) for tooth in teeth])
+    gc_outline = LineString(np.vstack((triangle, teeth[-1]))).convex_hull
+
+    _, teeth = coupler_vertices(width, full_opening_angle + np.deg2rad(0.35), grating_period, grating_ff, n_gratings,
+                                taper_length)
+    gc_teeth = MultiPolygon([Polygon(tooth) for tooth in teeth])
+
+    proto_port = Port((0, 0), -np.pi/2, width).inverted_direction
+
+    return gc_outline, gc_teeth, gc_proto_shape_obj, (tuple(proto_port.origin), proto_port.angle, proto_port.width)
+
+
+# Function which generates the outline, teeth and port of a Cornerstone grating coupler at the origin, pointing down.
+# The geometry is origin and angle independent, so it is cached and rotated/translated into place by the callers.
+# Use cornerstone_coupler_geometry.cache_info() after a build to see the hit/miss counters.
+# With GEOMETRY_BACKEND = 'numpy' the geometry comes from numpy_coupler_geometry, otherwise from the gdshelpers coupler.
+@lru_cache(maxsize=GRATING_GEOMETRY_CACHE_SIZE)
+def cornerstone_coupler_geometry(width, full_opening_angle, grating_period, grating_ff, n_gratings, taper_length):
+    if GEOMETRY_BACKEND == 'numpy':
+        return numpy_coupler_geometry(width, full_opening_angle, grating_period, grating_ff, n_gratings, taper_length)
+
+    gc_proto = GratingCoupler.make_traditional_coupler(origin=(0, 0),
+                                                       extra_triangle_layer=False,
+                                                       width=width,
+                                                       full_opening_angle=full_opening_angle,
+                                                       grating_period=grating_period,
+                                                       grating_ff=grating_ff,
+                                                       n_gratings=n_gratings,
+                                                       taper_length=taper_length)
+    gc_proto_shape_obj = gc_proto.get_shapely_object()
+    gc_outline = gc_proto_shape_obj.convex_hull
+
+    gc_teeth = GratingCoupler.make_traditional_coupler(origin=(0, 0),
+                                                       extra_triangle_layer=True,
+                                                       width=width,
+                                                       full_opening_angle=full_opening_angle + np.deg2rad(0.35),
+                                                       grating_period=grating_period,
+                                                       grating_ff=grating_ff,
+                                                       n_gratings=n_gratings,
+                                                       taper_length=taper_length)
+
+    # Return the port as a plain tuple so the cached value can't be modified by a caller
+    proto_port = (tuple(gc_proto.port.origin), gc_proto.port.angle, gc_proto.port.width)
+
+    return gc_outline, gc_teeth.get_shapely_object(), gc_proto_shape_obj, proto_port
+
+
+# Function which builds the library cell for a Cornerstone grating coupler from the cached coupler geometry
+@profiled(category='part', name='Cornerstone coupler cell')
+def make_cornerstone_coupler_cell(coupler_params, grating_angle=-np.pi/2):
+    gc_outline, gc_teeth, gc_proto_shape_obj, proto_port = cornerstone_coupler_geometry(
+        *normalize_coupler_params(coupler_params))
+
+    # The cached geometry points down (-pi/2), rotate the outline to the coupler angle and the teeth to the grating angle
+    outline_rotation = coupler_params.get('angle', -np.pi/2) + np.pi/2
+    teeth_rotation = grating_angle + np.pi/2
+    gc_outline = rotate(gc_outline, outline_rotation, origin=(0, 0), use_radians=True)
+    gc_proto_shape_obj = rotate(gc_proto_shape_obj, outline_rotation, origin=(0, 0), use_radians=True)
+    gc_teeth = rotate(gc_teeth, teeth_rotation, origin=(0, 0), use_radians=True)
+    port_origin = rotate(Point(proto_port[0]), outline_rotation, origin=(0, 0), use_radians=True)
+    port = Port(origin=(port_origin.x, port_origin.y), angle=proto_port[1] + outline_rotation, width=proto_port[2])
+
+    # Name the cell after its content so identical couplers always share one cell, whichever process builds them
+    key_hash = hashlib.md5(repr(coupler_library_key(coupler_params, grating_angle)).encode()).hexdigest()[:10]
+    cell_name = "{}{}_{}".format(CORNERSTONE_GRATING_CELL_PREFIX, coupler_params['grating_period'], key_hash)
+
+    # Reuse a cell of the same name if one was already loaded with a cached device
+    if cell_name not in CORNERSTONE_GRATING_CELLS:
+        cell = Cell(cell_name)
+
+        # Add outline to draw layer
+        cell.add_to_layer(WAVEGUIDE_LAYER, gc_outline)
+        cell.add_to_layer(GRATING_LAYER, gc_teeth)
+
+        CORNERSTONE_GRATING_CELLS[cell_name] = cell
+
+    return CORNERSTONE_GRATING_CELLS[cell_name], port, gc_proto_shape_obj
+
+
+# Function which makes a device cell built elsewhere (unpickled from disk or returned by another process) reference the
+# grating coupler cells of this process, so each coupler cell name is only used by one cell when the GDS is written
+def intern_coupler_cells(device_cell):
+
+    for sub_cell in device_cell.cells:
+        name = sub_cell['cell'].name
+        if name.startswith(CORNERSTONE_GRATING_CELL_PREFIX):
+            sub_cell['cell'] = CORNERSTONE_GRATING_CELLS.setdefault(name, sub_cell['cell'])
+        else:
+            intern_coupler_cells(sub_cell['cell'])
+
+    return device_cell
 
 
 # Class for linear grating coupler design compliant with Cornerstone fab
@@ -38,48 +198,35 @@ class CornerstoneGratingCoupler:
         self.origin = None
         self.port = None
         self.cell = None
-        self.object = None
-
-    # Function to create the Cornerstone compliant grating cell
-    def create_coupler(self, origin, coupler_params, grating_angle=-np.pi/2):  # , name=None):
-        gc_proto = GratingCoupler.make_traditional_coupler(origin=origin,
-                                                           extra_triangle_layer=False,
-                                                           **coupler_params)
-        gc_proto_shape_obj = gc_proto.get_shapely_object()
-        gc_outline = gc_proto_shape_obj.convex_hull
-        coupler_params_modified = {
-            'width': coupler_params['width'],
-            'full_opening_angle': coupler_params['full_opening_angle'] + np.deg2rad(0.35),
-            'grating_period': coupler_params['grating_period'],
-            'grating_ff': coupler_params['grating_ff'],
-            'n_gratings': coupler_params['n_gratings'],
-            'taper_length': coupler_params['taper_length']
-        }
-
-        gc_teeth = GratingCoupler.make_traditional_coupler(origin=origin,
-                                                           extra_triangle_layer=True,
-                                                           angle=grating_angle,
-                                                           # **teeth_coupler_params)
-                                                            **coupler_params_modified)
-
-        global CORNERSTONE_GRATING_IDENTIFIER
-        cell = Cell("GC_period_{}_coords_{}_{}_{}".format(coupler_params['grating_period'],
-                                                          origin[0],
-                                                          origin[1], CORNERSTONE_GRATING_IDENTIFIER))
-        CORNERSTONE_GRATING_IDENTIFIER += 1
+        self._proto_shape_obj = None
+        self._object = None
 
-        # Add outline to draw layer
-        cell.add_to_layer(WAVEGUIDE_LAYER, gc_outline)
-        cell.add_to_layer(GRATING_LAYER, gc_teeth)
+    # Shapely object of the placed coupler, only translated from the library coupler when it is asked for
+    @property
+    def object(self):
+        if self._object is None and self._proto_shape_obj is not None:
+            self._object = translate(self._proto_shape_obj, xoff=self.origin[0], yoff=self.origin[1])
+        return self._object
 
+    # Function to place a Cornerstone compliant grating, reusing the library cell if this coupler was already made
+    def create_coupler(self, origin, coupler_params, grating_angle=-np.pi/2):  # , name=None):
+        key = coupler_library_key(coupler_params, grating_angle)
+        if key not in CORNERSTONE_GRATING_LIBRARY:
+            CORNERSTONE_GRATING_LIBRARY[key] = make_cornerstone_coupler_cell(coupler_params, grating_angle)
+        cell, proto_port, proto_shape_obj = CORNERSTONE_GRATING_LIBRARY[key]
+
+        # The library cell sits at the origin, so translate the port and outline to where this coupler is placed
+        self.coupler_params = coupler_params
+        self.origin = (origin[0], origin[1])
         self.cell = cell
-        self.port = gc_proto.port
-        self.object = gc_proto_shape_obj
+        self.port = Port(origin=np.array(origin) + proto_port.origin, angle=proto_port.angle, width=proto_port.width)
+        self._proto_shape_obj = proto_shape_obj
+        self._object = None
 
         return self
 
     @classmethod    # Function to make a grating coupler at a port
-    def create_cornerstone_coupler_at_port(self, port, angle, **kwargs):
+    def create_cornerstone_coupler_at_port(cls, port, angle, **kwargs):
 
         if 'width' not in kwargs:
             kwargs['width'] = port.width
@@ -89,28 +236,185 @@ class CornerstoneGratingCoupler:
 
         coup_params = kwargs
 
-        return self.create_coupler(self,
-                                   origin=port.origin,
-                                   coupler_params=coup_params,
-                                   grating_angle=angle)
+        return cls().create_coupler(origin=port.origin,
+                                    coupler_params=coup_params,
+                                    grating_angle=angle)
+
+
+# Class for many Cornerstone grating couplers sharing one coupler_params, e.g. every coupler of a chip or a fibre array.
+# The coupler geometry is generated once and each coupler is a rotation and translation of it, applied to the vertices
+# of all the couplers in one broadcast operation. The couplers use the same library cells as CornerstoneGratingCoupler.
+# angles are the coupler angles (default coupler_params['angle'] or -pi/2), grating_angles the angles of the teeth.
+class CornerstoneGratingCouplerBatch:
+
+    def __init__(self, origins, coupler_params, angles=None, grating_angles=-np.pi/2):
+
+        self.coupler_params = coupler_params
+        self.origins = np.atleast_2d(np.asarray(origins, dtype=float))
+        default_angle = coupler_params.get('angle', -np.pi/2)
+        self.angles = np.broadcast_to(default_angle if angles is None else angles, len(self.origins)).astype(float)
+        self.grating_angles = np.broadcast_to(grating_angles, len(self.origins)).astype(float)
+
+        self._outline, self._teeth, _, proto_port = cornerstone_coupler_geometry(
+            *normalize_coupler_params(coupler_params))
+
+        # The cached geometry points down (-pi/2), as in make_cornerstone_coupler_cell
+        self.outline_rotations = self.angles + np.pi/2
+        self.teeth_rotations = self.grating_angles + np.pi/2
+        self.port_origins = self.origins + transform_points(np.array([proto_port[0]]), self.outline_rotations)[:, 0]
+        self.port_angles = proto_port[1] + self.outline_rotations
+        self.width = proto_port[2]
+
+        # Library cell of every coupler, one lookup per distinct pair of coupler and grating angle
+        angle_pairs, pair_index = np.unique(np.around(np.column_stack((self.angles, self.grating_angles)), 9),
+                                            axis=0, return_inverse=True)
+        pair_entries = []
+        for angle, grating_angle in angle_pairs:
+            params = coupler_params if angles is None else dict(coupler_params, angle=angle)
+            key = coupler_library_key(params, grating_angle)
+            if key not in CORNERSTONE_GRATING_LIBRARY:
+                CORNERSTONE_GRATING_LIBRARY[key] = make_cornerstone_coupler_cell(params, grating_angle)
+            pair_entries.append(CORNERSTONE_GRATING_LIBRARY[key])
+        self._library_entries = [pair_entries[i] for i in np.ravel(pair_index)]
+        self.cells = [entry[0] for entry in self._library_entries]
+
+    @classmethod    # Function to make a grating coupler at each port, as create_cornerstone_coupler_at_port does
+    def create_at_ports(cls, ports, coupler_params, grating_angles):
+
+        if 'width' not in coupler_params:
+            coupler_params = dict(coupler_params, width=ports[0].width)
+
+        return cls([port.origin for port in ports], coupler_params, angles=[port.angle for port in ports],
+                   grating_angles=grating_angles)
+
+    def __len__(self):
+
+        return len(self.origins)
+
+    @property
+    def ports(self):
+        return [Port(origin=origin, angle=angle, width=self.width)
+                for origin, angle in zip(self.port_origins, self.port_angles)]
+
+    # Outline vertices of all couplers, shape (couplers, points, 2)
+    @property
+    def outline_vertices(self):
+        return transform_points(np.asarray(self._outline.exterior.coords), self.outline_rotations, self.origins)
+
+    @property
+    def outlines(self):
+        return [Polygon(vertices) for vertices in self.outline_vertices]
+
+    # Teeth vertices of all couplers, shape (couplers, teeth, points, 2). Computed when asked for, a few hundred
+    # couplers of 60 teeth are ~100 MB.
+    @property
+    def teeth_vertices(self):
+        teeth = np.array([polygon.exterior.coords for polygon in self._teeth.geoms])
+        return transform_points(teeth, self.teeth_rotations, self.origins)
+
+    @property
+    def teeth(self):
+        return [MultiPolygon([Polygon(tooth) for tooth in coupler_teeth]) for coupler_teeth in self.teeth_vertices]
+
+    # Function which returns the couplers as CornerstoneGratingCoupler objects, for code written for single couplers
+    def couplers(self):
+        couplers = []
+        for origin, (cell, proto_port, proto_shape_obj), port in zip(self.origins, self._library_entries, self.ports):
+            coupler = CornerstoneGratingCoupler()
+            coupler.coupler_params = self.coupler_params
+            coupler.origin = (origin[0], origin[1])
+            coupler.cell = cell
+            coupler.port = port
+            coupler._proto_shape_obj = proto_shape_obj
+            couplers.append(coupler)
+        return couplers
+
+    # Function which adds a reference to the library cell of every coupler to a cell
+    def add_to_cell(self, cell):
+        for origin, coupler_cell in zip(self.origins, self.cells):
+            cell.add_cell(coupler_cell, origin=(origin[0], origin[1]))
+        return cell
+
+
+# Function which rotates an array of points (..., 2) by each of the angles and translates it to each of the origins,
+# returns an array (angles, ..., 2)
+def transform_points(points, angles, origins=None):
+    cos, sin = np.cos(angles), np.sin(angles)
+    rotation_matrices = np.stack((np.stack((cos, sin), axis=-1), np.stack((-sin, cos), axis=-1)), axis=-2)
+    transformed = np.reshape(points, (-1, 2)) @ rotation_matrices
+    if origins is not None:
+        transformed += np.reshape(origins, (-1, 1, 2))
+    return transformed.reshape((len(rotation_matrices),) + np.shape(points))
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# DEVICE METADATA -----------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Every device function attaches a DeviceMetadata record to its cell as cell.metadata, so the path lengths needed for
+# cutback loss fitting don't have to be measured from the GDS again. It travels with the cell through the worker
+# processes and the device cache.
+#
+#   length            total centre line length of the waveguides on WAVEGUIDE_LAYER (um)
+#   bend_length       the part of it in bends (um)
+#   bends             number of curved segments (bends, arcs, S-bends, spiral arms)
+#   couplers          number of grating couplers
+#   footprint_width   width and height of the device bounding box (um)
+#   footprint_height
+DeviceMetadata = namedtuple('DeviceMetadata', ['device', 'length', 'bend_length', 'bends', 'couplers',
+                                               'footprint_width', 'footprint_height'])
 
 
-# Utility function which checks that grating couplers are appropriately placed
-def grating_checker(gratings):
+# Function which returns (length, curved) for every segment of a waveguide. A segment is curved if its direction
+# changes anywhere along it.
+def waveguide_segments(wg):
 
-    y_diff = np.around(gratings[0].port.origin[1], 9) - np.around(gratings[1].port.origin[1], 9)
-    x_diff = np.around(gratings[0].port.origin[0], 9) - np.around(gratings[1].port.origin[0], 9)
+    segments = []
+    for port, polygon, outline, length, center_coordinates in wg._segments:
+        steps = np.diff(center_coordinates, axis=0)
+        steps = steps[np.any(steps != 0, axis=1)]
+        directions = np.concatenate(([port.angle], np.arctan2(steps[:, 1], steps[:, 0])))
+        turning = np.abs(np.angle(np.exp(1j * np.diff(directions)))).sum()
+        segments.append((float(length), bool(turning > 1e-6)))
 
-    if y_diff != 0:
-        print(" \n \n WARNING: The gratings being checked have a y separation of {}  \n \n ".format(y_diff))
-    if np.abs(x_diff) % (GRATING_PITCH) != 0:
-        print(" \n \n WARNING: The gratings being checked have a x separation of {}. Recommended is {}, {}, {}, {}... \n \n "
-              .format(np.abs(x_diff), GRATING_PITCH, 2*GRATING_PITCH, 3*GRATING_PITCH, 4*GRATING_PITCH))
-    # elif np.abs(x_diff) == (GRATING_PITCH/2):
-    #     print(" \n \n WARNING: The gratings being checked have a x separation of {}. Recommended is {}, {}, {}, {}... \n \n "
-    #           .format(np.abs(x_diff), GRATING_PITCH, 2* GRATING_PITCH, 3* GRATING_PITCH, 4* GRATING_PITCH))
+    return segments
 
-    return x_diff, y_diff
+
+# Function which returns (length, curved) for every waveguide segment of a part placed on the waveguide layer
+def part_segments(part):
+
+    if isinstance(part, Waveguide):
+        return waveguide_segments(part)
+
+    # A ring only makes its waveguides when it is drawn, add up its bus and ring sections instead
+    if isinstance(part, RingResonator):
+        bus = (2 * part.radius if part.straight_feeding else 0) + part.race_length
+        segments = [(bus, False)] * (2 if part.draw_opposite_side_wg else 1)
+        segments += [(part.race_length, False), (part.vertical_race_length, False)] * 2
+        segments += [(pi * part.radius / 2, True)] * 4
+        return [(float(length), curved) for length, curved in segments if length > 0]
+
+    if isinstance(part, Spiral):
+        part.length     # Generates the spiral arms
+        waveguides = [part.wg_in, part.wg_out]
+    else:
+        waveguides = getattr(part, '_wgs', [])  # DirectionalCoupler, MMI
+
+    return [segment for wg in waveguides for segment in waveguide_segments(wg)]
+
+
+# Function which measures a device cell, see DeviceMetadata
+def device_metadata(cell):
+
+    segments = [segment for part in cell.layer_dict.get(WAVEGUIDE_LAYER, []) for segment in part_segments(part)]
+    bounds = cell.bounds
+
+    return DeviceMetadata(cell.name,
+                          sum(length for length, curved in segments),
+                          sum(length for length, curved in segments if curved),
+                          sum(curved for length, curved in segments),
+                          len(coupler_ports(cell)),
+                          bounds[2] - bounds[0], bounds[3] - bounds[1])
 
 
 # ---------------------------------------------------------------------------------------------------------------------
@@ -128,6 +432,7 @@ def grating_checker(gratings):
 # GRATING LOOPBACK
 ##################
 
+@profiled
 def grating_loopback(coupler_params,
                      taper_route,
                      position=(0, 0),
@@ -136,7 +441,7 @@ def grating_loopback(coupler_params,
     # Create the cell that we are going to add to
     grating_loopback_cell = Cell(name)
     grating_loopback_cell.add_to_layer(LABEL_LAYER,
-                                       Text(origin=LABEL_ORIGIN,
+                                       Label(origin=LABEL_ORIGIN,
                                             height=10,#LABEL_HEIGHT,
                                             angle=LABEL_ANGLE_VERTICAL,
                                             text=name
@@ -162,12 +467,12 @@ def grating_loopback(coupler_params,
         **coupler_params, angle=wg.angle)
 
     # Add the left grating coupler cell to our loopback cell
-    grating_loopback_cell.add_cell(left_grating.cell)  # Add the left grating coupler cell to our loopback cell
-    grating_loopback_cell.add_cell(right_grating.cell)  # Add the right grating to the loopback cell
+    grating_loopback_cell.add_cell(left_grating.cell, origin=left_grating.origin)  # Add the left grating coupler cell to our loopback cell
+    grating_loopback_cell.add_cell(right_grating.cell, origin=right_grating.origin)  # Add the right grating to the loopback cell
     grating_loopback_cell.add_to_layer(WAVEGUIDE_LAYER, wg)  # Add the waveguide to the loopback cell
 
-    # Grating checker
-    grating_checker([left_grating, right_grating])
+    # Device metadata (path lengths, bends, couplers and footprint)
+    grating_loopback_cell.metadata = device_metadata(grating_loopback_cell)
 
     return grating_loopback_cell
 
@@ -176,6 +481,7 @@ def grating_loopback(coupler_params,
 # DIRECTIONAL COUPLER
 #####################
 
+@profiled
 def directional_coupler(coupler_params,
                         coupling_length,
                         gap,
@@ -185,7 +491,7 @@ def directional_coupler(coupler_params,
     # Create the cell that we are going to add to
     directional_coupler_cell = Cell(name)
     directional_coupler_cell.add_to_layer(LABEL_LAYER,
-                                          Text(origin=LABEL_ORIGIN,
+                                          Label(origin=LABEL_ORIGIN,
                                                height=LABEL_HEIGHT,
                                                angle=LABEL_ANGLE_VERTICAL,
                                                text=name
@@ -250,20 +556,18 @@ def directional_coupler(coupler_params,
 
 
     # Add the sub-components to the respective cell and layers
-    # directional_coupler_cell.add_cell(left_grating1.cell)  # Add the first left-hand grating coupler cell to the DC cell
-    # directional_coupler_cell.add_cell(left_grating2.cell)  # Add the second left-hand grating coupler cell to the DC cell
+    # directional_coupler_cell.add_cell(left_grating1.cell, origin=left_grating1.origin)  # Add the first left-hand grating coupler cell to the DC cell
+    # directional_coupler_cell.add_cell(left_grating2.cell, origin=left_grating2.origin)  # Add the second left-hand grating coupler cell to the DC cell
     # directional_coupler_cell.add_to_layer(WAVEGUIDE_LAYER, wg1)  # Add the first waveguide to the loopback cell
     # directional_coupler_cell.add_to_layer(WAVEGUIDE_LAYER, wg2)  # Add the second waveguide to the loopback cell
     directional_coupler_cell.add_to_layer(WAVEGUIDE_LAYER, DC)  # Add the DC sub-component to the DC cell
     # directional_coupler_cell.add_to_layer(WAVEGUIDE_LAYER, wg3)  # Add the third waveguide to the DC cell
     # directional_coupler_cell.add_to_layer(WAVEGUIDE_LAYER, wg4)  # Add the fourth waveguide to the DC cell
-    # directional_coupler_cell.add_cell(right_grating1.cell)  # Add the first right-hand grating coupler to the DC cell
-    # directional_coupler_cell.add_cell(right_grating2.cell)  # Add the second right-hand grating coupler to the DC cell
+    # directional_coupler_cell.add_cell(right_grating1.cell, origin=right_grating1.origin)  # Add the first right-hand grating coupler to the DC cell
+    # directional_coupler_cell.add_cell(right_grating2.cell, origin=right_grating2.origin)  # Add the second right-hand grating coupler to the DC cell
 
-    # Grating checker
-    grating_checker([left_grating1, left_grating2])
-    grating_checker([left_grating1, right_grating1])
-    grating_checker([left_grating1, right_grating2])
+    # Device metadata (path lengths, bends, couplers and footprint)
+    directional_coupler_cell.metadata = device_metadata(directional_coupler_cell)
 
     return directional_coupler_cell
 
@@ -272,6 +576,7 @@ def directional_coupler(coupler_params,
 # MMI 1X2
 #########
 
+@profiled
 def mmi_1x2(coupler_params,
             mmi_length,
             mmi_width,
@@ -283,7 +588,7 @@ def mmi_1x2(coupler_params,
     # Create the cell that we are going to add to
     mmi_1x2_cell = Cell(name)
     mmi_1x2_cell.add_to_layer(LABEL_LAYER,
-                              Text(origin=LABEL_ORIGIN,
+                              Label(origin=LABEL_ORIGIN,
                                    height=LABEL_HEIGHT,
                                    angle=LABEL_ANGLE_VERTICAL,
                                    text=name
@@ -329,17 +634,16 @@ def mmi_1x2(coupler_params,
     right_grating2 = CornerstoneGratingCoupler().create_cornerstone_coupler_at_port(port=wg2.current_port, **coupler_params, angle=wg2.angle)
 
     # Add the sub-components to the respective cell and layers
-    mmi_1x2_cell.add_cell(left_grating.cell)  # Add the left grating coupler cell to our MMI cell
-    mmi_1x2_cell.add_cell(right_grating1.cell)  # Add the first right grating coupler to the MMI cell
-    mmi_1x2_cell.add_cell(right_grating2.cell)  # Add the second right grating coupler to the MMI cell
+    mmi_1x2_cell.add_cell(left_grating.cell, origin=left_grating.origin)  # Add the left grating coupler cell to our MMI cell
+    mmi_1x2_cell.add_cell(right_grating1.cell, origin=right_grating1.origin)  # Add the first right grating coupler to the MMI cell
+    mmi_1x2_cell.add_cell(right_grating2.cell, origin=right_grating2.origin)  # Add the second right grating coupler to the MMI cell
     mmi_1x2_cell.add_to_layer(WAVEGUIDE_LAYER, wg)  # Add the first waveguide to the MMI cell
     mmi_1x2_cell.add_to_layer(WAVEGUIDE_LAYER, wg1)  # Add the second waveguide to the MMI cell
     mmi_1x2_cell.add_to_layer(WAVEGUIDE_LAYER, wg2)  # Add the third waveguide to the MMI cell
     mmi_1x2_cell.add_to_layer(WAVEGUIDE_LAYER, mmi) # Add the MMI sub-component to the MMI cell
 
-    # Grating checker
-    grating_checker([left_grating, right_grating1])
-    grating_checker([left_grating, right_grating2])
+    # Device metadata (path lengths, bends, couplers and footprint)
+    mmi_1x2_cell.metadata = device_metadata(mmi_1x2_cell)
 
     return mmi_1x2_cell
 
@@ -348,6 +652,7 @@ def mmi_1x2(coupler_params,
 # MMI 2X2
 #########
 
+@profiled
 def mmi_2x2(coupler_params,
             mmi_length,
             mmi_width,
@@ -359,7 +664,7 @@ def mmi_2x2(coupler_params,
     # Create the cell that we are going to add to
     mmi_2x2_cell = Cell(name)
     mmi_2x2_cell.add_to_layer(LABEL_LAYER,
-                              Text(origin=LABEL_ORIGIN,
+                              Label(origin=LABEL_ORIGIN,
                                    height=LABEL_HEIGHT,
                                    angle=LABEL_ANGLE_VERTICAL,
                                    text=name
@@ -407,20 +712,18 @@ def mmi_2x2(coupler_params,
 
 
     # Add the sub-components to the respective cell and layers
-    mmi_2x2_cell.add_cell(left_grating1.cell)  # Add the first left grating coupler cell to our MMI cell
-    mmi_2x2_cell.add_cell(left_grating2.cell)  # Add the second left grating coupler cell to our MMI cell
-    mmi_2x2_cell.add_cell(right_grating1.cell)  # Add the first right grating to the MMI cell
-    mmi_2x2_cell.add_cell(right_grating2.cell)  # Add the second right grating to the MMI cell
+    mmi_2x2_cell.add_cell(left_grating1.cell, origin=left_grating1.origin)  # Add the first left grating coupler cell to our MMI cell
+    mmi_2x2_cell.add_cell(left_grating2.cell, origin=left_grating2.origin)  # Add the second left grating coupler cell to our MMI cell
+    mmi_2x2_cell.add_cell(right_grating1.cell, origin=right_grating1.origin)  # Add the first right grating to the MMI cell
+    mmi_2x2_cell.add_cell(right_grating2.cell, origin=right_grating2.origin)  # Add the second right grating to the MMI cell
     mmi_2x2_cell.add_to_layer(WAVEGUIDE_LAYER, wg)  # Add the first waveguide to the MMI cell
     mmi_2x2_cell.add_to_layer(WAVEGUIDE_LAYER, wg1)  # Add the second waveguide to the MMI cell
     mmi_2x2_cell.add_to_layer(WAVEGUIDE_LAYER, wg2)  # Add the third waveguide to the MMI cell
     mmi_2x2_cell.add_to_layer(WAVEGUIDE_LAYER, wg4)  # Add the fourth waveguide to the MMI cell
     mmi_2x2_cell.add_to_layer(WAVEGUIDE_LAYER, mmi)  # Add the MMI sub-component to the MMI cell
 
-    # Grating checker
-    grating_checker([left_grating1, left_grating2])
-    grating_checker([left_grating1, right_grating1])
-    grating_checker([left_grating1, right_grating2])
+    # Device metadata (path lengths, bends, couplers and footprint)
+    mmi_2x2_cell.metadata = device_metadata(mmi_2x2_cell)
 
     return mmi_2x2_cell
 
@@ -429,6 +732,7 @@ def mmi_2x2(coupler_params,
 # RING RESONATOR
 ################
 
+@profiled
 def ring_resonator(coupler_params,
                    gap,
                    radius,
@@ -438,7 +742,7 @@ def ring_resonator(coupler_params,
     # Create the cell that we are going to add to
     ring_resonator_cell = Cell(name)
     ring_resonator_cell.add_to_layer(LABEL_LAYER,
-                                     Text(origin=LABEL_ORIGIN,
+                                     Label(origin=LABEL_ORIGIN,
                                           height=LABEL_HEIGHT,
                                           angle=LABEL_ANGLE_VERTICAL,
                                           text=name
@@ -464,13 +768,13 @@ def ring_resonator(coupler_params,
     right_grating = CornerstoneGratingCoupler().create_cornerstone_coupler_at_port(port=wg.current_port, **coupler_params, angle=wg.angle)
 
     # Add the left grating coupler cell to our loopback cell
-    ring_resonator_cell.add_cell(left_grating.cell)  # Add the left grating coupler cell to our loopback cell
-    ring_resonator_cell.add_cell(right_grating.cell)  # Add the right grating to the loopback cell
+    ring_resonator_cell.add_cell(left_grating.cell, origin=left_grating.origin)  # Add the left grating coupler cell to our loopback cell
+    ring_resonator_cell.add_cell(right_grating.cell, origin=right_grating.origin)  # Add the right grating to the loopback cell
     ring_resonator_cell.add_to_layer(WAVEGUIDE_LAYER, wg)  # Add the waveguide to the loopback cell
     ring_resonator_cell.add_to_layer(WAVEGUIDE_LAYER, resonator)  # Add the waveguide to the loopback cell
 
-    # Grating checker
-    grating_checker([left_grating, right_grating])
+    # Device metadata (path lengths, bends, couplers and footprint)
+    ring_resonator_cell.metadata = device_metadata(ring_resonator_cell)
 
     return ring_resonator_cell
 
@@ -479,6 +783,84 @@ def ring_resonator(coupler_params,
 # SPIRAL WINDINGS
 #################
 
+# Spiral with the same geometry as the gdshelpers Spiral, generated with numpy instead of point by point.
+# gdshelpers samples the spiral equidistantly by calling the path function and solving for the spline root of every
+# sample in Python; here the path is evaluated for all samples at once and the same spline is inverted by interpolation.
+# The spiral is returned as abutting pieces of at most SPIRAL_PIECE_POINTS points per side rather than a union, so the
+# GDS export doesn't have to fracture (and heal) one polygon with tens of thousands of points.
+class NumpySpiral(Spiral):
+
+    # Function which returns the equidistant spiral points in the frame of the spiral origin port, as the gdshelpers
+    # Waveguide.add_parameterized_path samples them (sample_points=100 presamples, sample_distance=0.5)
+    def path_points(self, sample_points=100, sample_distance=0.5, oversampling=20):
+        def path(a):
+            return ((self.num * (self._origin_port.total_width + self.gap) * np.abs(1 - a) + self.inner_gap)
+                    * np.array((np.sin(np.pi * a * self.num), np.cos(np.pi * a * self.num)))).T
+
+        presample_t = np.linspace(0, 1, sample_points)
+        presample_length = np.insert(np.cumsum(np.linalg.norm(np.diff(path(presample_t), axis=0), axis=1)), 0, 0)
+        lengths = np.linspace(0, presample_length[-1], int(presample_length[-1] / sample_distance))
+
+        # Invert the spline of the path length on a fine grid instead of finding a root per sample
+        spline_rep = scipy.interpolate.splrep(presample_t, presample_length, s=0)
+        fine_t = np.linspace(0, 1, oversampling * len(lengths))
+        fine_length = np.maximum.accumulate(scipy.interpolate.splev(fine_t, spline_rep))
+        sample_t = np.interp(lengths, fine_length, fine_t)
+        sample_t[0], sample_t[-1] = 0, 1
+
+        return path(sample_t)
+
+    def _generate(self):
+        if GEOMETRY_BACKEND != 'numpy':
+            return super()._generate()
+
+        points = self.path_points()
+        self.wg_in = Waveguide.make_at_port(self._origin_port)
+        self.wg_in.add_parameterized_path(points)
+
+        self.wg_out = Waveguide.make_at_port(self._origin_port.inverted_direction)
+        self.wg_out.add_parameterized_path(points)
+
+        self.wg_in.add_route_single_circle_to_port(self._origin_port.rotated(-np.pi * (self.num % 2)))
+        self.wg_in.add_route_single_circle_to_port(self.wg_out.port)
+
+    def get_shapely_object(self):
+        if GEOMETRY_BACKEND != 'numpy':
+            return super().get_shapely_object()
+
+        if not self.wg_in or not self.wg_out:
+            self._generate()
+
+        polygons = []
+        for wg in (self.wg_in, self.wg_out):
+            for port, polygon, outline, length, center_coordinates in wg._segments:
+                if len(center_coordinates) > SPIRAL_PIECE_POINTS:
+                    polygons.extend(path_pieces(center_coordinates, port.angle, port.total_width))
+                else:
+                    polygons.extend(getattr(polygon, 'geoms', [polygon]))
+
+        return MultiPolygon(polygons)
+
+
+# Function which cuts a waveguide of constant width along a center line into polygons of at most SPIRAL_PIECE_POINTS
+# points per side. The edges are offset along the same normals as in Waveguide.add_parameterized_path, neighbouring
+# pieces share their end points, so the pieces abut exactly.
+def path_pieces(center_coordinates, angle, width):
+    direction = np.vstack(((np.cos(angle), np.sin(angle)), np.diff(center_coordinates, axis=0)))
+    direction /= np.linalg.norm(direction, axis=1)[:, None]
+    normal = np.column_stack((direction[:, 1], -direction[:, 0]))
+    side_1 = center_coordinates - width / 2 * normal
+    side_2 = center_coordinates + width / 2 * normal
+
+    pieces = []
+    for start in range(0, len(center_coordinates) - 1, SPIRAL_PIECE_POINTS - 1):
+        stop = min(start + SPIRAL_PIECE_POINTS, len(center_coordinates))
+        pieces.append(Polygon(np.vstack((side_1[start:stop], side_2[start:stop][::-1]))))
+
+    return pieces
+
+
+@profiled
 def spiral_loopback(coupler_params,
                     number,
                     gap_size,
@@ -488,7 +870,7 @@ def spiral_loopback(coupler_params,
     # Create the cell that we are going to add to
     spiral_loopback_cell = Cell(name)
     spiral_loopback_cell.add_to_layer(LABEL_LAYER,
-                                      Text(origin=LABEL_ORIGIN,
+                                      Label(origin=LABEL_ORIGIN,
                                            height=LABEL_HEIGHT,
                                            angle=LABEL_ANGLE_VERTICAL,
                                            text=name
@@ -505,9 +887,7 @@ def spiral_loopback(coupler_params,
     wg.add_straight_segment(length=GRATING_TAPER_ROUTE)  # Routing from taper to bend
     wg.add_bend(angle=pi/2, radius=BEND_RADIUS)
 
-    spiral = Spiral.make_at_port(port=wg.current_port, num=number, gap=gap_size, inner_gap=inner_gap_size)
-    spiral_length = spiral.length
-    #print(spiral_length)
+    spiral = NumpySpiral.make_at_port(port=wg.current_port, num=number, gap=gap_size, inner_gap=inner_gap_size)
     spiral_obj = spiral.get_shapely_object()    # Generate a Shapely object for the spiral to find its bounding box coordinates
     spiral_size = abs(spiral_obj.bounds[1] - spiral_obj.bounds[3])  # Determine the size of the spiral
 
@@ -528,17 +908,18 @@ def spiral_loopback(coupler_params,
     right_grating = CornerstoneGratingCoupler().create_cornerstone_coupler_at_port(port=wg2.current_port, **coupler_params, angle=wg2.angle)
 
     # Add the left grating coupler cell to our loopback cell
-    spiral_loopback_cell.add_cell(left_grating.cell)  # Add the left grating coupler cell to our loopback cell
-    spiral_loopback_cell.add_cell(right_grating.cell)  # Add the right grating to the loopback cell
+    spiral_loopback_cell.add_cell(left_grating.cell, origin=left_grating.origin)  # Add the left grating coupler cell to our loopback cell
+    spiral_loopback_cell.add_cell(right_grating.cell, origin=right_grating.origin)  # Add the right grating to the loopback cell
     spiral_loopback_cell.add_to_layer(WAVEGUIDE_LAYER, wg)  # Add the waveguide to the loopback cell
     spiral_loopback_cell.add_to_layer(WAVEGUIDE_LAYER, wg2)  # Add the waveguide to the loopback cell
     spiral_loopback_cell.add_to_layer(WAVEGUIDE_LAYER, spiral)  # Add the spiral sub-component to the loopback cell
 
-    # Grating checker
-    grating_checker([left_grating, right_grating])
+    # Device metadata (path lengths, bends, couplers and footprint)
+    spiral_loopback_cell.metadata = device_metadata(spiral_loopback_cell)
 
     return spiral_loopback_cell
 
+@profiled
 def mzi_dc(coupler_params,
            coupling_length,
            gap,
@@ -548,7 +929,7 @@ def mzi_dc(coupler_params,
            name= 'MZI'):
     mzi_dc_cell = Cell(name)
     mzi_dc_cell.add_to_layer(LABEL_LAYER,
-                             Text(origin = LABEL_ORIGIN,
+                             Label(origin = LABEL_ORIGIN,
                                   height = LABEL_HEIGHT,
                                   angle = LABEL_ANGLE_VERTICAL,
                                   text = name))
@@ -642,9 +1023,9 @@ def mzi_dc(coupler_params,
 
     # Add the sub-components to the MZI cell
 
-    mzi_dc_cell.add_cell(left_grating.cell)
-    mzi_dc_cell.add_cell(right_grating1.cell)
-    mzi_dc_cell.add_cell(right_grating2.cell)
+    mzi_dc_cell.add_cell(left_grating.cell, origin=left_grating.origin)
+    mzi_dc_cell.add_cell(right_grating1.cell, origin=right_grating1.origin)
+    mzi_dc_cell.add_cell(right_grating2.cell, origin=right_grating2.origin)
     mzi_dc_cell.add_to_layer(WAVEGUIDE_LAYER,wg1)
     mzi_dc_cell.add_to_layer(WAVEGUIDE_LAYER, wg2)
     mzi_dc_cell.add_to_layer(WAVEGUIDE_LAYER, wg3)
@@ -653,14 +1034,14 @@ def mzi_dc(coupler_params,
     mzi_dc_cell.add_to_layer(WAVEGUIDE_LAYER, DC1)
     mzi_dc_cell.add_to_layer(WAVEGUIDE_LAYER, DC2)
 
-    # Grating checker
-    grating_checker([left_grating,right_grating1])
-    grating_checker([left_grating, right_grating2])
+    # Device metadata (path lengths, bends, couplers and footprint)
+    mzi_dc_cell.metadata = device_metadata(mzi_dc_cell)
 
     return mzi_dc_cell
 
 
 
+@profiled
 def mzi_dc2(coupler_params,
            coupling_length,
            gap,
@@ -670,7 +1051,7 @@ def mzi_dc2(coupler_params,
            name= 'MZI2'):
     mzi_dc2_cell = Cell(name)
     mzi_dc2_cell.add_to_layer(LABEL_LAYER,
-                             Text(origin = LABEL_ORIGIN,
+                             Label(origin = LABEL_ORIGIN,
                                   height = LABEL_HEIGHT,
                                   angle = LABEL_ANGLE_VERTICAL,
                                   text = name))
@@ -777,10 +1158,10 @@ def mzi_dc2(coupler_params,
 
     # Add the sub-components to the MZI cell
 
-    mzi_dc2_cell.add_cell(left_grating1.cell)
-    mzi_dc2_cell.add_cell(left_grating2.cell)
-    mzi_dc2_cell.add_cell(right_grating1.cell)
-    mzi_dc2_cell.add_cell(right_grating2.cell)
+    mzi_dc2_cell.add_cell(left_grating1.cell, origin=left_grating1.origin)
+    mzi_dc2_cell.add_cell(left_grating2.cell, origin=left_grating2.origin)
+    mzi_dc2_cell.add_cell(right_grating1.cell, origin=right_grating1.origin)
+    mzi_dc2_cell.add_cell(right_grating2.cell, origin=right_grating2.origin)
     mzi_dc2_cell.add_to_layer(WAVEGUIDE_LAYER, wg)
     mzi_dc2_cell.add_to_layer(WAVEGUIDE_LAYER,wg1)
     mzi_dc2_cell.add_to_layer(WAVEGUIDE_LAYER, wg2)
@@ -790,12 +1171,12 @@ def mzi_dc2(coupler_params,
     mzi_dc2_cell.add_to_layer(WAVEGUIDE_LAYER, DC1)
     mzi_dc2_cell.add_to_layer(WAVEGUIDE_LAYER, DC2)
 
-    # Grating checker
-    grating_checker([left_grating1,right_grating1])
-    grating_checker([left_grating2, right_grating2])
+    # Device metadata (path lengths, bends, couplers and footprint)
+    mzi_dc2_cell.metadata = device_metadata(mzi_dc2_cell)
 
     return mzi_dc2_cell
 
+@profiled
 def cascaded_mzi_dc(coupler_params,
                     coupling_length,
                     gap,
@@ -805,7 +1186,7 @@ def cascaded_mzi_dc(coupler_params,
                     name='CASCADED_MZI'):
     cascaded_mzi = Cell(name)
     cascaded_mzi.add_to_layer(LABEL_LAYER,
-                            Text(origin = LABEL_ORIGIN,
+                            Label(origin = LABEL_ORIGIN,
                                 height = LABEL_HEIGHT,
                                 angle = LABEL_ANGLE_VERTICAL,
                                 text = name))
@@ -1032,10 +1413,10 @@ def cascaded_mzi_dc(coupler_params,
 
     # Add the sub-components to the MZI cell
 
-    cascaded_mzi.add_cell(left_grating1.cell)
-    cascaded_mzi.add_cell(left_grating2.cell)
-    # cascaded_mzi.add_cell(right_grating1.cell)
-    # cascaded_mzi.add_cell(right_grating2.cell) #####
+    cascaded_mzi.add_cell(left_grating1.cell, origin=left_grating1.origin)
+    cascaded_mzi.add_cell(left_grating2.cell, origin=left_grating2.origin)
+    # cascaded_mzi.add_cell(right_grating1.cell, origin=right_grating1.origin)
+    # cascaded_mzi.add_cell(right_grating2.cell, origin=right_grating2.origin) #####
     cascaded_mzi.add_to_layer(WAVEGUIDE_LAYER, wg)
     cascaded_mzi.add_to_layer(WAVEGUIDE_LAYER,wg1)
     cascaded_mzi.add_to_layer(WAVEGUIDE_LAYER, wg2)
@@ -1056,9 +1437,215 @@ def cascaded_mzi_dc(coupler_params,
     cascaded_mzi.add_to_layer(WAVEGUIDE_LAYER, DC5)
     cascaded_mzi.add_to_layer(WAVEGUIDE_LAYER, DC6)
 
-    # Grating checker
-    # grating_checker([left_grating1,right_grating1])
-    # grating_checker([left_grating2, right_grating2]) ####
-    # grating_checker([left_grating2, right_grating1])
+    # Device metadata (path lengths, bends, couplers and footprint)
+    cascaded_mzi.metadata = device_metadata(cascaded_mzi)
 
     return cascaded_mzi
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+# FOOTPRINT ESTIMATES -------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Analytic estimates of the (xmin, ymin, xmax, ymax) bounds of each device, computed from the same parameters as the
+# device functions without generating any geometry. They follow the routing of the device functions and err on the
+# large side, so layout planning and chip-fit checks can be done before the devices are built.
+
+# Function which estimates the bounds of a Cornerstone grating coupler pointing down from its port at origin
+def coupler_bounds(coupler_params, origin):
+    coupler_length = coupler_params['taper_length'] + coupler_params['n_gratings'] * coupler_params['grating_period']
+    half_width = coupler_length * np.tan((coupler_params['full_opening_angle'] + np.deg2rad(0.35)) / 2) + coupler_params['width'] / 2
+
+    return origin[0] - half_width, origin[1] - coupler_length, origin[0] + half_width, origin[1]
+
+
+# Function which estimates the bounds of a vertical device label
+def label_bounds(text, origin=LABEL_ORIGIN, height=LABEL_HEIGHT):
+    lines = text.split('\n')
+    text_length = max(len(line) for line in lines) * LABEL_CHARACTER_WIDTH * height
+    text_depth = len(lines) * LABEL_LINE_SPACING * height
+
+    # The label is rotated by 90 degrees, so its lines run up the page and stack to the left
+    return origin[0] - text_depth, origin[1], origin[0] + height, origin[1] + text_length
+
+
+# Function which returns the bounds enclosing all given bounds
+def union_bounds(*bounds):
+    bounds = np.array(bounds)
+
+    return bounds[:, 0].min(), bounds[:, 1].min(), bounds[:, 2].max(), bounds[:, 3].max()
+
+
+# Function which returns the x position of the first grating on the VGA pitch to the right of x (as the routing does)
+def next_grating_position(x):
+    for j in range(VGA_NUM_CHANNELS):
+        if x < j * GRATING_PITCH:
+            return j * GRATING_PITCH
+
+    return x + BEND_RADIUS
+
+
+# Length and lateral port separation of a gdshelpers DirectionalCoupler (an S-bend of DC_BEND_ANGLE on either side
+# of each arm)
+def directional_coupler_length(coupling_length):
+    return coupling_length + 4 * BEND_RADIUS * np.sin(DC_BEND_ANGLE)
+
+
+def directional_coupler_height(gap):
+    return 4 * BEND_RADIUS * (1 - np.cos(DC_BEND_ANGLE)) + gap + WAVEGUIDE_WIDTH
+
+
+# Length of an MZI stage (two directional couplers with the arms between them)
+def mzi_stage_length(coupling_length, mzi_centre_spacing):
+    return 2 * directional_coupler_length(coupling_length) + mzi_centre_spacing + 4 * BEND_RADIUS
+
+
+def grating_loopback_bounds(coupler_params, taper_route, position=(0, 0), name='GRATING_LOOPBACK'):
+    route_top = position[1] + taper_route + BEND_RADIUS + WAVEGUIDE_WIDTH / 2
+
+    return union_bounds(coupler_bounds(coupler_params, position),
+                        coupler_bounds(coupler_params, (position[0] + GRATING_PITCH, position[1])),
+                        (position[0], position[1], position[0] + GRATING_PITCH, route_top),
+                        label_bounds(name, height=10))
+
+
+def directional_coupler_bounds(coupler_params, coupling_length, gap, position=(0, 0), name='DIRECTIONAL_COUPLER'):
+    # Only the DC itself is drawn, fed from the second grating coupler
+    dc_x = GRATING_PITCH + BEND_RADIUS + GRATING_TAPER_ROUTE
+    dc_y = position[1] + GRATING_TAPER_ROUTE + BEND_RADIUS
+
+    return union_bounds((dc_x, dc_y - WAVEGUIDE_WIDTH / 2,
+                         dc_x + directional_coupler_length(coupling_length),
+                         dc_y + directional_coupler_height(gap) + WAVEGUIDE_WIDTH / 2),
+                        label_bounds(name))
+
+
+def mmi_1x2_bounds(coupler_params, mmi_length, mmi_width, mmi_taper_width, mmi_taper_length, position=(0, 0),
+                   name='MMI_1X2'):
+    mmi_y = position[1] + GRATING_TAPER_ROUTE + BEND_RADIUS
+
+    return union_bounds(coupler_bounds(coupler_params, position),
+                        coupler_bounds(coupler_params, (3 * GRATING_PITCH, position[1])),
+                        (position[0], position[1], 3 * GRATING_PITCH, mmi_y + mmi_width / 2),
+                        label_bounds(name))
+
+
+def mmi_2x2_bounds(coupler_params, mmi_length, mmi_width, mmi_taper_width, mmi_taper_length, position=(0, 0),
+                   name='MMI_2X2'):
+    mmi_y = position[1] + 2 * GRATING_TAPER_ROUTE + BEND_RADIUS
+
+    return union_bounds(coupler_bounds(coupler_params, position),
+                        coupler_bounds(coupler_params, (4 * GRATING_PITCH, position[1])),
+                        (position[0], position[1], 4 * GRATING_PITCH, mmi_y + mmi_width),
+                        label_bounds(name))
+
+
+def ring_resonator_bounds(coupler_params, gap, radius, position=(0, 0), name='RING_RESONATOR'):
+    bus_y = position[1] + GRATING_TAPER_ROUTE + BEND_RADIUS
+    ring_x = position[0] + GRATING_PITCH / 2
+
+    return union_bounds(coupler_bounds(coupler_params, position),
+                        coupler_bounds(coupler_params, (position[0] + GRATING_PITCH, position[1])),
+                        (position[0], position[1], position[0] + GRATING_PITCH, bus_y),
+                        (ring_x - radius - WAVEGUIDE_WIDTH, bus_y,
+                         ring_x + radius + WAVEGUIDE_WIDTH, bus_y + gap + 2 * radius + 2 * WAVEGUIDE_WIDTH),
+                        label_bounds(name))
+
+
+# Function which estimates the size of a gdshelpers Spiral, whose outer radius is number * (width + gap) + inner gap
+def spiral_size_estimate(number, gap_size, inner_gap_size):
+    return 2 * (inner_gap_size + number * (gap_size + WAVEGUIDE_WIDTH)) + WAVEGUIDE_WIDTH
+
+
+def spiral_loopback_bounds(coupler_params, number, gap_size, inner_gap_size, position=(0, 0), name='SPIRAL'):
+    spiral_size = spiral_size_estimate(number, gap_size, inner_gap_size)
+
+    # The spiral is centred above the left grating, entered at its bottom and left at its top
+    spiral_x = position[0] - BEND_RADIUS
+    spiral_y = position[1] + GRATING_TAPER_ROUTE + BEND_RADIUS
+    return_y = spiral_y + spiral_size + 2 * BEND_RADIUS
+    right_grating_x = position[0] + next_grating_position(spiral_size / 2)
+
+    return union_bounds(coupler_bounds(coupler_params, position),
+                        coupler_bounds(coupler_params, (right_grating_x, position[1])),
+                        (spiral_x - spiral_size / 2, spiral_y, spiral_x + spiral_size / 2, spiral_y + spiral_size),
+                        (spiral_x - GRATING_TAPER_ROUTE - BEND_RADIUS - WAVEGUIDE_WIDTH, position[1],
+                         right_grating_x, return_y + WAVEGUIDE_WIDTH),
+                        label_bounds(name))
+
+
+# Function which estimates the bounds of one MZI stage starting at the lower DC input (x, y)
+def mzi_stage_bounds(x, y, coupling_length, gap, mzi_centre_spacing, path_length_difference):
+    return (x, y - 2 * BEND_RADIUS - path_length_difference / 2 - WAVEGUIDE_WIDTH,
+            x + mzi_stage_length(coupling_length, mzi_centre_spacing),
+            y + directional_coupler_height(gap) + 2 * BEND_RADIUS + WAVEGUIDE_WIDTH)
+
+
+def mzi_dc_bounds(coupler_params, coupling_length, gap, mzi_centre_spacing, path_length_difference, position=(0, 0),
+                  name='MZI'):
+    stage_x = position[0] + BEND_RADIUS + GRATING_TAPER_ROUTE
+    stage_y = position[1] + GRATING_TAPER_ROUTE + BEND_RADIUS
+    stage_end = stage_x + mzi_stage_length(coupling_length, mzi_centre_spacing)
+
+    return union_bounds(coupler_bounds(coupler_params, position),
+                        coupler_bounds(coupler_params, (next_grating_position(stage_end + GRATING_PITCH), position[1])),
+                        mzi_stage_bounds(stage_x, stage_y, coupling_length, gap, mzi_centre_spacing,
+                                         path_length_difference),
+                        label_bounds(name))
+
+
+def mzi_dc2_bounds(coupler_params, coupling_length, gap, mzi_centre_spacing, path_length_difference, position=(0, 0),
+                   name='MZI2'):
+    stage_x = GRATING_PITCH + BEND_RADIUS + GRATING_TAPER_ROUTE
+    stage_y = position[1] + GRATING_TAPER_ROUTE + BEND_RADIUS
+    stage_end = stage_x + mzi_stage_length(coupling_length, mzi_centre_spacing)
+
+    return union_bounds(coupler_bounds(coupler_params, position),
+                        coupler_bounds(coupler_params, (next_grating_position(stage_end + GRATING_PITCH), position[1])),
+                        mzi_stage_bounds(stage_x, stage_y, coupling_length, gap, mzi_centre_spacing,
+                                         path_length_difference),
+                        label_bounds(name))
+
+
+def cascaded_mzi_dc_bounds(coupler_params, coupling_length, gap, mzi_center_spacing, path_length_difference,
+                           position=(0, 0), name='CASCADED_MZI'):
+    stage_x = GRATING_PITCH + BEND_RADIUS + GRATING_TAPER_ROUTE
+    stage_y = position[1] + GRATING_TAPER_ROUTE + BEND_RADIUS
+    stage_end = stage_x + mzi_stage_length(coupling_length, mzi_center_spacing)
+
+    # The two outputs of the first stage are routed one pitch up and one pitch down into the cascaded stages
+    cascade_x = next_grating_position(stage_end) + BEND_RADIUS + GRATING_PITCH
+    cascade_offset = 2 * BEND_RADIUS + GRATING_PITCH
+    top_y = stage_y + directional_coupler_height(gap) + cascade_offset
+    bottom_y = stage_y - cascade_offset - directional_coupler_height(gap)
+
+    return union_bounds(coupler_bounds(coupler_params, position),
+                        coupler_bounds(coupler_params, (GRATING_PITCH, position[1])),
+                        mzi_stage_bounds(stage_x, stage_y, coupling_length, gap, mzi_center_spacing,
+                                         path_length_difference),
+                        mzi_stage_bounds(cascade_x, top_y, coupling_length, gap, mzi_center_spacing,
+                                         path_length_difference),
+                        mzi_stage_bounds(cascade_x, bottom_y, coupling_length, gap, mzi_center_spacing,
+                                         path_length_difference),
+                        label_bounds(name))
+
+
+# Footprint estimate of each device function, by function name
+DEVICE_BOUNDS_ESTIMATORS = {
+    'grating_loopback': grating_loopback_bounds,
+    'directional_coupler': directional_coupler_bounds,
+    'mmi_1x2': mmi_1x2_bounds,
+    'mmi_2x2': mmi_2x2_bounds,
+    'ring_resonator': ring_resonator_bounds,
+    'spiral_loopback': spiral_loopback_bounds,
+    'mzi_dc': mzi_dc_bounds,
+    'mzi_dc2': mzi_dc2_bounds,
+    'cascaded_mzi_dc': cascaded_mzi_dc_bounds,
+}
+
+
+# Function which estimates the bounds of the device a device function would build with the given arguments
+def estimate_bounds(device_function, **device_kwargs):
+    return DEVICE_BOUNDS_ESTIMATORS[device_function.__name__](**device_kwargs)
@@ -0,0 +1,202 @@
+import argparse
+import ast
+import os
+from functools import lru_cache
+
+# ---------------------------------------------------------------------------------------------------------------------
+# PARAMETER DEPENDENCY GRAPH ------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Works out from the source of components.py which module-level parameters of parameters.py every device function
+# reads, directly or through the functions and classes it uses (e.g. grating_loopback -> CornerstoneGratingCoupler ->
+# make_cornerstone_coupler_cell -> GRATING_LAYER). The device cache keys each device on just these parameters, so
+# changing SPIRAL_GAP only regenerates the devices which actually read it.
+#
+# Definitions imported from the other modules of the project (e.g. Label from labels.py) aren't analysed one by one,
+# a device using one depends on the whole source of its module (and the project modules that imports from) and on
+# every parameter the module reads.
+
+PARAMETERS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parameters.py')
+COMPONENTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'components.py')
+
+
+# Function which returns the names of the module-level parameters defined in parameters.py
+@lru_cache(maxsize=None)
+def parameter_names(parameters_file=PARAMETERS_FILE):
+
+    with open(parameters_file) as f:
+        tree = ast.parse(f.read())
+
+    names = set()
+    for node in tree.body:
+        if isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+            targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+            for target in targets:
+                names.update(name.id for name in ast.walk(target) if isinstance(name, ast.Name))
+
+    return frozenset(names)
+
+
+# Function which returns the project modules (the files next to parameters.py, parameters.py itself aside) a module
+# imports from at the top level, as {imported name: module file}
+@lru_cache(maxsize=None)
+def project_imports(module_file, parameters_file=PARAMETERS_FILE):
+
+    with open(module_file) as f:
+        tree = ast.parse(f.read())
+
+    project_path = os.path.dirname(os.path.abspath(parameters_file))
+    imports = {}
+    for node in tree.body:
+        if isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            modules = [(alias.asname or alias.name, node.module) for alias in node.names]
+        elif isinstance(node, ast.Import):
+            modules = [(alias.asname or alias.name, alias.name) for alias in node.names]
+        else:
+            continue
+        for name, module in modules:
+            module_file = os.path.join(project_path, module.replace('.', os.sep) + '.py')
+            if os.path.isfile(module_file) and not os.path.samefile(module_file, parameters_file):
+                imports[name] = module_file
+
+    return imports
+
+
+# Function which returns the project modules a module depends on (itself included, following the imports
+# transitively) and the parameters they read anywhere in their source
+@lru_cache(maxsize=None)
+def module_dependencies(module_file, parameters_file=PARAMETERS_FILE):
+
+    parameters = parameter_names(parameters_file)
+    modules = set()
+    read = set()
+    pending = [module_file]
+    while pending:
+        current = pending.pop()
+        if current in modules:
+            continue
+        modules.add(current)
+        with open(current) as f:
+            tree = ast.parse(f.read())
+        for node in tree.body:
+            read |= global_names(node) & parameters
+        pending.extend(project_imports(current, parameters_file).values())
+
+    return frozenset(read), frozenset(modules)
+
+
+# Function which returns the global names a top level definition reads. Arguments and local variables are left out,
+# so the coupler_params argument of a device isn't mistaken for parameters.coupler_params. Decorators are left out
+# too, they don't change the geometry (e.g. the size of an lru_cache).
+def global_names(node):
+
+    # Class attributes and methods are reached through the class name, so a class reads what its methods read
+    if isinstance(node, ast.ClassDef):
+        names = set()
+        for child in node.bases + node.body:
+            names |= global_names(child)
+        return names
+
+    parts = [node.args] + node.body if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) else [node]
+
+    loaded = set()
+    local = set()
+    for part in parts:
+        for child in ast.walk(part):
+            if isinstance(child, ast.Name):
+                (local if isinstance(child.ctx, ast.Store) else loaded).add(child.id)
+            elif isinstance(child, ast.arg):
+                local.add(child.arg)
+
+    return loaded - local
+
+
+# Function which analyses components.py. Returns, for every top level function, class and constant, the definitions
+# of components.py it uses directly, the project modules it uses definitions of, the parameters it reads directly and
+# its source.
+@lru_cache(maxsize=None)
+def component_definitions(components_file=COMPONENTS_FILE, parameters_file=PARAMETERS_FILE):
+
+    with open(components_file) as f:
+        source = f.read()
+    tree = ast.parse(source)
+    lines = source.splitlines()
+
+    nodes = {}
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            nodes[node.name] = node
+        elif isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    nodes[target.id] = node
+
+    parameters = parameter_names(parameters_file)
+    imports = project_imports(components_file, parameters_file)
+    definitions = {}
+    for name, node in nodes.items():
+        names = global_names(node)
+        definitions[name] = dict(uses=frozenset(names & set(nodes)) - {name},
+                                 modules=frozenset(imports[imported] for imported in names & set(imports)),
+                                 parameters=frozenset(names & parameters),
+                                 source='\n'.join(lines[node.lineno - 1:node.end_lineno]))
+
+    return definitions
+
+
+# Function which returns the parameters a definition of components.py reads, the names of the definitions its result
+# depends on (itself included), following the uses transitively, and the files of the other project modules it uses.
+# Returns (None, None, None) for unknown names.
+@lru_cache(maxsize=None)
+def device_dependencies(name, components_file=COMPONENTS_FILE, parameters_file=PARAMETERS_FILE):
+
+    definitions = component_definitions(components_file, parameters_file)
+    if name not in definitions:
+        return None, None, None
+
+    used = set()
+    pending = [name]
+    while pending:
+        current = pending.pop()
+        if current not in used:
+            used.add(current)
+            pending.extend(definitions[current]['uses'])
+
+    parameters = set()
+    modules = set()
+    for current in used:
+        parameters |= definitions[current]['parameters']
+        for module_file in definitions[current]['modules']:
+            module_parameters, module_files = module_dependencies(module_file, parameters_file)
+            parameters |= module_parameters
+            modules |= module_files
+
+    return frozenset(parameters), frozenset(used), frozenset(modules)
+
+
+# Function which returns the device functions (from the given names) which read a parameter
+def devices_reading(parameter, device_names):
+
+    return [name for name in device_names if parameter in (device_dependencies(name)[0] or ())]
+
+
+if __name__ == '__main__':
+
+    DEVICE_FUNCTIONS = ['grating_loopback', 'directional_coupler', 'mmi_1x2', 'mmi_2x2', 'ring_resonator',
+                        'spiral_loopback', 'mzi_dc', 'mzi_dc2', 'cascaded_mzi_dc']
+
+    parser = argparse.ArgumentParser(description='Show which parameters of parameters.py each device depends on')
+    parser.add_argument('parameters', nargs='*', metavar='PARAMETER',
+                        help='list the devices which read these parameters instead')
+    arguments = parser.parse_args()
+
+    if arguments.parameters:
+        for parameter_name in arguments.parameters:
+            if parameter_name not in parameter_names():
+                print('{0}: not a parameter of parameters.py'.format(parameter_name))
+                continue
+            print('{0}: {1}'.format(parameter_name, ', '.join(devices_reading(parameter_name, DEVICE_FUNCTIONS))
+                                    or 'no devices'))
+    else:
+        for device_name in DEVICE_FUNCTIONS:
+            print('{0}: {1}'.format(device_name, ', '.join(sorted(device_dependencies(device_name)[0]))))
@@ -0,0 +1,374 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+
+import numpy as np
+from gdshelpers.geometry.chip import Cell
+from gdshelpers.geometry.shapely_adapter import shapely_collection_to_basic_objs
+from shapely.affinity import affine_transform
+from shapely.geometry import MultiPolygon, Polygon, box
+from shapely.ops import clip_by_rect, unary_union
+from shapely.prepared import prep
+from shapely.strtree import STRtree
+
+from parameters import *
+from sweep_executor import SWEEP_WORKERS
+
+# ---------------------------------------------------------------------------------------------------------------------
+# DERIVED LAYERS ------------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Some layers follow from the drawn ones, e.g. the suspension etch trench beside every waveguide is
+# buffer(WAVEGUIDE_LAYER, SUPPORT_GAP) - WAVEGUIDE_LAYER. The rules are in DERIVED_LAYERS (parameters.py). Growing and
+# subtracting the layers of a whole chip with shapely takes a union of every polygon on it, instead:
+#
+#   - the source layers of the rules are flattened once into placed polygons, each cell's own polygons only collected
+#     once, and loaded into an STRtree per layer
+#   - the layout is split into DERIVED_TILE_SIZE tiles, each tile gets the source polygons within its halo (the
+#     farthest a derived layer reaches from its sources, see layer_reach), so the tile sees every shape its result
+#     depends on
+#   - the rules are evaluated per tile across worker processes, the result is clipped to the tile and split into
+#     polygons without holes of at most max_points vertices, so the export doesn't have to fracture them again
+#   - the tiles are stitched in tile order (the result doesn't depend on the number of workers): pieces which end on a
+#     seam between two tiles are merged with the pieces they continue into, the others are kept as they are
+#
+# The derived polygons are placed in one cell, which the top cell references.
+#
+# When the devices are streamed (see design_space.stream_with_planner) they aren't kept in memory, derive_device_layers
+# then loads the source polygons of a device (from the device cache) for the first row of tiles its placed bounds come
+# near and drops them after the last, so only the devices around one row of tiles are held at a time.
+
+
+# Function which returns how far from the drawn shapes every derived layer reaches: its growth plus the reach of the
+# layers it grows, or the reach of the layers cut out of it if that is farther
+def layer_reach(rules=DERIVED_LAYERS):
+
+    reach = {}
+    for layer, grown, distance, cut in rules:
+        reach[layer] = max([distance + max([reach.get(source, 0) for source in grown] or [0])] +
+                           [reach.get(source, 0) for source in cut])
+
+    return reach
+
+
+# Function which returns the drawn layers the rules derive their layers from
+def source_layers(rules=DERIVED_LAYERS):
+
+    derived, sources = set(), []
+    for layer, grown, distance, cut in rules:
+        for source in grown + cut:
+            if source not in derived and source not in sources:
+                sources.append(source)
+        derived.add(layer)
+
+    return sources
+
+
+# Function which returns the polygons of the given layers of a cell and all cells it references, placed in the
+# coordinates of the cell (matrix is the 3x3 transformation of the cell). Each cell's own polygons are only collected
+# once.
+def layout_polygons(cell, layers, matrix=np.eye(3), polygons=None, cell_polygon_cache=None):
+
+    polygons = {} if polygons is None else polygons
+    cell_polygon_cache = {} if cell_polygon_cache is None else cell_polygon_cache
+
+    if id(cell) not in cell_polygon_cache:
+        own = {}
+        for layer in layers:
+            for geometry in cell.layer_dict.get(layer, []):
+                geometry = geometry.get_shapely_object() if hasattr(geometry, 'get_shapely_object') else geometry
+                own.setdefault(layer, []).extend(polygon for polygon in shapely_collection_to_basic_objs(geometry)
+                                                 if isinstance(polygon, Polygon) and not polygon.is_empty)
+        cell_polygon_cache[id(cell)] = own
+
+    identity = np.array_equal(matrix, np.eye(3))
+    parameters = [matrix[0, 0], matrix[0, 1], matrix[1, 0], matrix[1, 1], matrix[0, 2], matrix[1, 2]]
+    for layer, own_polygons in cell_polygon_cache[id(cell)].items():
+        polygons.setdefault(layer, []).extend(own_polygons if identity else
+                                              [affine_transform(polygon, parameters) for polygon in own_polygons])
+
+    for ref in cell.cells:
+        angle = ref['angle'] or 0
+        magnification = ref['magnification'] or 1
+        ref_matrix = np.eye(3)
+        ref_matrix[:2, :2] = magnification * np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        if ref['x_reflection']:
+            ref_matrix[:2, :2] = ref_matrix[:2, :2] @ np.diag([1, -1])
+
+        spacing = ref['spacing'] or (0, 0)
+        for column in range(ref['columns']):
+            for row in range(ref['rows']):
+                ref_matrix[:2, 2] = np.asarray(ref['origin'], dtype=float) + (column * spacing[0], row * spacing[1])
+                layout_polygons(ref['cell'], layers, matrix @ ref_matrix, polygons, cell_polygon_cache)
+
+    return polygons
+
+
+# Function which builds a device (read from the device cache, for the cached device functions) and returns the polygons
+# of the layers the rules derive their layers from, placed at origin. Used as the load function of
+# derive_device_layers.
+def placed_device_polygons(device_function, device_kwargs, origin, rules=DERIVED_LAYERS):
+
+    matrix = np.eye(3)
+    matrix[:2, 2] = origin
+
+    return layout_polygons(device_function(**device_kwargs), source_layers(rules), matrix)
+
+
+# Function which returns the polygons of a shapely geometry
+def polygons_of(geometry):
+
+    return [polygon for polygon in shapely_collection_to_basic_objs(geometry)
+            if isinstance(polygon, Polygon) and not polygon.is_empty]
+
+
+# Function which returns the number of vertices of a polygon
+def vertex_count(polygon):
+
+    return sum(len(ring.coords) for ring in [polygon.exterior] + list(polygon.interiors))
+
+
+# Function which splits a polygon into polygons without holes of at most max_points vertices, so the export doesn't
+# have to fracture them: polygons with holes are cut through their first hole, larger polygons in half across their
+# longer side
+def split_polygon(polygon, max_points=4000):
+
+    if not polygon.interiors and vertex_count(polygon) <= max_points:
+        return [polygon]
+
+    minx, miny, maxx, maxy = polygon.bounds
+    if polygon.interiors:
+        cut_x, cut_y = polygon.interiors[0].centroid.coords[0]
+    else:
+        cut_x, cut_y = (minx + maxx) / 2, (miny + maxy) / 2
+    if polygon.interiors or maxx - minx >= maxy - miny:
+        halves = clip_by_rect(polygon, minx, miny, cut_x, maxy), clip_by_rect(polygon, cut_x, miny, maxx, maxy)
+    else:
+        halves = clip_by_rect(polygon, minx, miny, maxx, cut_y), clip_by_rect(polygon, minx, cut_y, maxx, maxy)
+
+    return [piece for half in halves for part in polygons_of(half) for piece in split_polygon(part, max_points)]
+
+
+# Function run in the worker processes, evaluates the rules on the source polygons around one tile. Returns the
+# polygons of every derived layer clipped to the tile and split to at most max_points vertices, each with whether it
+# ends on a seam to a neighbouring tile (a tile edge inside bounds, the outer bounds of all tiles).
+def derive_tile(job):
+
+    tile, bounds, halo, polygons, rules, resolution, max_points = job
+
+    x0, y0, x1, y1 = tile
+    window = (x0 - halo, y0 - halo, x1 + halo, y1 + halo)
+    inside = prep(box(*window))
+
+    # Only the polygons reaching out of the window are clipped, merging the whole waveguides crossing a tile in every
+    # tile would repeat most of the work
+    layers = {layer: [clipped for polygon in layer_polygons
+                      for clipped in ([polygon] if inside.contains(polygon) else
+                                      polygons_of(clip_by_rect(polygon, *window)))]
+              for layer, layer_polygons in polygons.items()}
+    unions = {}
+    cut_layers = {source for layer, grown, distance, cut in rules for source in cut}
+
+    def union(source):
+        if source not in unions:
+            unions[source] = unary_union(layers.get(source, []))
+        return unions[source]
+
+    for layer, grown, distance, cut in rules:
+        # Growing the polygons merges them, so only the layers cut out of another layer (merged anyway) and the layers
+        # which shrink are merged first
+        regions = [(union(source) if source in cut_layers or distance <= 0 else MultiPolygon(layers.get(source, [])))
+                   .buffer(distance, resolution) for source in grown]
+        region = unary_union(regions) if len(regions) != 1 else regions[0]
+
+        cut = [union(source) for source in cut if not union(source).is_empty]
+        if cut:
+            region = region.difference(cut[0] if len(cut) == 1 else unary_union(cut))
+
+        layers[layer], unions[layer] = polygons_of(region), region
+
+    seams = [tile[0] > bounds[0], tile[1] > bounds[1], tile[2] < bounds[2], tile[3] < bounds[3]]
+    derived = {}
+    for layer, grown, distance, cut in rules:
+        derived[layer] = []
+        for polygon in [piece for part in polygons_of(clip_by_rect(unions[layer], *tile))
+                        for piece in split_polygon(part, max_points)]:
+            # Slivers left where a grown edge and the edge it is cut by don't quite coincide are below the GDS grid
+            if 2 * polygon.area < DRC_TOLERANCE * polygon.length:
+                continue
+            # Seam pieces have an edge on a seam, so their bounds reach it
+            on_seam = any(seam and abs(edge - tile_edge) < DRC_TOLERANCE
+                          for seam, edge, tile_edge in zip(seams, polygon.bounds, tile))
+            derived[layer].append((polygon, on_seam))
+
+    return derived
+
+
+# Function which returns the tiles (x0, y0, x1, y1) of tile_size covering bounds, row by row from the bottom
+def layout_tiles(bounds, tile_size=DERIVED_TILE_SIZE):
+
+    x0, y0, x1, y1 = bounds
+    columns, rows = max(1, int(np.ceil((x1 - x0) / tile_size))), max(1, int(np.ceil((y1 - y0) / tile_size)))
+
+    return [(x0 + column * tile_size, y0 + row * tile_size,
+             min(x0 + (column + 1) * tile_size, x1), min(y0 + (row + 1) * tile_size, y1))
+            for row in range(rows) for column in range(columns)]
+
+
+# Function which stitches the pieces of a derived layer from all tiles, given as (polygon, on seam) pairs: every piece
+# ending on a seam is merged with the pieces it continues into across the seam, the other pieces are kept as they are.
+# Pieces which would merge into a polygon with holes or of more than max_points vertices (e.g. the trench of a long
+# spiral) are kept apart, the export would only fracture them again.
+def stitch_tiles(pieces, max_points=4000):
+
+    polygons = [polygon for polygon, on_seam in pieces if not on_seam]
+    seam_pieces = [polygon for polygon, on_seam in pieces if on_seam]
+    if not seam_pieces:
+        return polygons
+
+    # Group the touching seam pieces (union-find)
+    group = list(range(len(seam_pieces)))
+
+    def root(i):
+        while group[i] != i:
+            group[i] = group[group[i]]
+            i = group[i]
+        return i
+
+    tree = STRtree(seam_pieces)
+    for i, polygon in enumerate(seam_pieces):
+        touching = prep(polygon)
+        for j in tree.query_items(polygon):
+            if j > i and root(i) != root(j) and touching.intersects(seam_pieces[j]):
+                group[root(j)] = root(i)
+
+    groups = {}
+    for i, polygon in enumerate(seam_pieces):
+        groups.setdefault(root(i), []).append(polygon)
+    for group_pieces in groups.values():
+        if len(group_pieces) > 1 and sum(vertex_count(polygon) for polygon in group_pieces) <= max_points:
+            merged = polygons_of(unary_union(group_pieces))
+            if not any(polygon.interiors for polygon in merged):
+                group_pieces = merged
+        polygons.extend(group_pieces)
+
+    return polygons
+
+
+# Function which evaluates the batches of tile jobs (see derive_tile) across a process pool, a batch at a time as they
+# are generated, and returns the stitched polygons of every derived layer
+def evaluate_tiles(job_batches, rules=DERIVED_LAYERS, workers=SWEEP_WORKERS, max_points=4000):
+
+    results = []
+    executor = None
+    try:
+        for jobs in job_batches:
+            if workers == 1 or len(jobs) < 2:
+                results.extend(derive_tile(job) for job in jobs)
+            else:
+                executor = executor or ProcessPoolExecutor(max_workers=workers)
+                results.extend(executor.map(derive_tile, jobs))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return {layer: stitch_tiles([piece for result in results for piece in result[layer]], max_points)
+            for layer, grown, distance, cut in rules}
+
+
+# Function which evaluates the rules on placed polygons ({layer: [polygons]}, e.g. from layout_polygons) tile by tile
+# across a process pool and returns the stitched polygons of every derived layer
+def derive_layers(polygons, rules=DERIVED_LAYERS, tile_size=DERIVED_TILE_SIZE, workers=SWEEP_WORKERS,
+                  resolution=DERIVED_BUFFER_RESOLUTION, max_points=4000):
+
+    polygons = {layer: layer_polygons for layer, layer_polygons in polygons.items() if layer_polygons}
+    if not polygons:
+        return {layer: [] for layer, grown, distance, cut in rules}
+
+    halo = max(layer_reach(rules).values())
+    polygon_bounds = np.array([polygon.bounds for layer_polygons in polygons.values() for polygon in layer_polygons])
+    x0, y0 = polygon_bounds[:, :2].min(axis=0) - halo
+    x1, y1 = polygon_bounds[:, 2:].max(axis=0) + halo
+    bounds = (x0, y0, x1, y1)
+
+    # Only the tiles near any source shape are evaluated
+    trees = {layer: STRtree(layer_polygons) for layer, layer_polygons in polygons.items()}
+    jobs = []
+    for tile in layout_tiles(bounds, tile_size):
+        window = box(tile[0] - halo, tile[1] - halo, tile[2] + halo, tile[3] + halo)
+        tile_polygons = {layer: [polygons[layer][i] for i in tree.query_items(window)] for layer, tree in trees.items()}
+        tile_polygons = {layer: layer_polygons for layer, layer_polygons in tile_polygons.items() if layer_polygons}
+        if tile_polygons:
+            jobs.append((tile, bounds, halo, tile_polygons, rules, resolution, max_points))
+
+    return evaluate_tiles([jobs], rules, workers, max_points)
+
+
+# Function which evaluates the rules like derive_layers on devices which aren't kept in memory. devices is a list of
+# (placed bounds, load), load() returns the placed polygons of the device's source layers ({layer: [polygons]}). The
+# tiles are evaluated a row at a time, each device is loaded for the first row of tiles it comes near and dropped
+# after the last.
+def derive_device_layers(devices, rules=DERIVED_LAYERS, tile_size=DERIVED_TILE_SIZE, workers=SWEEP_WORKERS,
+                         resolution=DERIVED_BUFFER_RESOLUTION, max_points=4000):
+
+    if not devices:
+        return {layer: [] for layer, grown, distance, cut in rules}
+
+    halo = max(layer_reach(rules).values())
+    device_bounds = np.array([placed for placed, load in devices])
+    x0, y0 = device_bounds[:, :2].min(axis=0) - halo
+    x1, y1 = device_bounds[:, 2:].max(axis=0) + halo
+    bounds = (x0, y0, x1, y1)
+
+    # The devices every tile needs, and the last tile which needs each device
+    device_tree = STRtree([box(*placed) for placed in device_bounds])
+    tiles = layout_tiles(bounds, tile_size)
+    tile_devices = [sorted(device_tree.query_items(box(x0 - halo, y0 - halo, x1 + halo, y1 + halo)))
+                    for x0, y0, x1, y1 in tiles]
+    last_tile = {}
+    for n, indices in enumerate(tile_devices):
+        for index in indices:
+            last_tile[index] = n
+
+    loaded = {}     # index: {layer: (placed polygons, STRtree)} of the devices the current and later rows need
+
+    def job_batches():
+        for row, row_tiles in groupby(enumerate(tiles), key=lambda numbered_tile: numbered_tile[1][1]):
+            row_tiles = list(row_tiles)
+            jobs = []
+            for n, tile in row_tiles:
+                window = box(tile[0] - halo, tile[1] - halo, tile[2] + halo, tile[3] + halo)
+                tile_polygons = {}
+                for index in tile_devices[n]:
+                    if index not in loaded:
+                        loaded[index] = {layer: (layer_polygons, STRtree(layer_polygons))
+                                         for layer, layer_polygons in devices[index][1]().items() if layer_polygons}
+                    for layer, (layer_polygons, tree) in loaded[index].items():
+                        tile_polygons.setdefault(layer, []).extend(layer_polygons[i] for i in tree.query_items(window))
+                tile_polygons = {layer: layer_polygons for layer, layer_polygons in tile_polygons.items()
+                                 if layer_polygons}
+                if tile_polygons:
+                    jobs.append((tile, bounds, halo, tile_polygons, rules, resolution, max_points))
+            yield jobs
+
+            for index in [index for index in loaded if last_tile[index] <= row_tiles[-1][0]]:
+                del loaded[index]
+
+    return evaluate_tiles(job_batches(), rules, workers, max_points)
+
+
+# Function which returns a cell holding the derived layers of a layout, given as a cell, as placed polygons of the
+# source layers or as a list of devices which aren't in memory (see derive_device_layers)
+def derived_layer_cell(layout, name, rules=DERIVED_LAYERS, tile_size=DERIVED_TILE_SIZE, workers=SWEEP_WORKERS):
+
+    if isinstance(layout, list):
+        derived = derive_device_layers(layout, rules, tile_size, workers)
+    else:
+        polygons = layout_polygons(layout, source_layers(rules)) if isinstance(layout, Cell) else layout
+        derived = derive_layers(polygons, rules, tile_size, workers)
+
+    derived_cell = Cell(name)
+    for layer, layer_polygons in derived.items():
+        if layer_polygons:
+            derived_cell.add_to_layer(layer, *layer_polygons)
+
+    return derived_cell
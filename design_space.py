@@ -1,19 +1,78 @@
-import numpy as np
-from math import pi
-from gdshelpers.geometry.chip import Cell
-from gdshelpers.parts.waveguide import Waveguide
-from gdshelpers.parts.coupler import GratingCoupler
-from shapely.geometry import Polygon
-from gdshelpers.layout import GridLayout
+import argparse
+import os
+import time
 
-from components import *
-from parameters import *
+# Only the standard library is imported here, so importing design_space is instant. gdshelpers, numpy and the devices
+# are imported by the functions which need them. The device sweeps themselves are declared in device_sweeps.py.
 
 # Path where you want your GDS to be saved to
 savepath = r"./"
 
-x_coords = 0
-x_coords_max = CHIP_WIDTH
+# Number of processes the device sweeps are built with (None = one per CPU, 1 = serial)
+sweep_workers = None
+
+# Pack the devices with the layout planner (True) or place each sweep in GridLayout rows (False)
+USE_LAYOUT_PLANNER = True
+
+# Split the devices across as many dies as needed and save them as one reticle with a device manifest
+# (max_reticle_dies = None adds dies until every device fits)
+USE_RETICLE = False
+max_reticle_dies = None
+
+# Write every device to the GDS file as soon as it is built instead of saving the whole chip at the end, so only
+# stream_batch_size devices are in memory at once (None = one per worker process). The GDS records of unchanged
+# devices are copied from the device cache, so a rebuild only fractures the devices whose inputs changed.
+STREAM_GDS = True
+stream_batch_size = None
+
+# File format of the layout: 'gds' (GDSII) or 'oas' (OASIS, see oasis_export.py, repeated elements and compressed
+# cells make the file many times smaller). An output file name ending in .oas selects OASIS too.
+OUTPUT_FORMAT = 'gds'
+
+# Check the finished layout against the design rules of parameters.py (see drc.py) and print the violations, also
+# saved as CSV to drc_report_file if set. In streaming mode the devices are kept in memory for the check.
+RUN_DRC = False
+drc_report_file = None
+
+# Check that the grating couplers of every device line up with the fibre array (see grating_alignment.py) and print the
+# violations, also saved as CSV to alignment_report_file if set. With strict_grating_alignment a misaligned coupler
+# fails the build with a GratingAlignmentError before the GDS is finished.
+CHECK_GRATING_ALIGNMENT = True
+strict_grating_alignment = False
+alignment_report_file = None
+
+# Save the positions of all grating coupler ports for the probe station (see probe_map.py) next to the GDS as
+# <GDS name>_probes.csv, or to probe_map_file if set (.csv, or .parquet with pyarrow installed)
+WRITE_PROBE_MAP = True
+probe_map_file = None
+
+# Save the path length, bends, couplers and footprint of every device with its sweep parameters (see
+# sweep_engine.sweep_table) next to the GDS as <GDS name>_devices.csv, or to sweep_table_file if set
+WRITE_SWEEP_TABLE = True
+sweep_table_file = None
+
+# Replace repeated components (e.g. identical directional couplers or routing) by references to shared cells before
+# saving (see geometry_dedup.py). Streamed devices are written before the rest is built, so there a component is placed
+# by reference from its second occurrence on, the first one is written as geometry with the device it is in.
+DEDUP_GEOMETRY = True
+
+# How the device labels are written (see labels.py): 'glyphs' (references to one cell per glyph), 'polygons' (every
+# label as polygons) or 'text' (GDS TEXT records, which aren't fabricated)
+LABEL_MODE = 'glyphs'
+
+# Save a raster preview of the layout (see preview.py) next to the GDS as <GDS name>_preview.png, at preview_resolution
+# um per pixel, and zoomed tiles of the windows (x0, y0, x1, y1) in preview_tiles as <GDS name>_preview_<n>.png at
+# preview_tile_resolution. In streaming mode the devices are kept in memory for the preview.
+WRITE_PREVIEW = False
+preview_resolution = 2
+preview_tiles = []
+preview_tile_resolution = 0.25
+
+# Generate the layers which follow from the drawn ones (the suspension etch trenches beside the waveguides and the slab
+# protection of the grating couplers, see DERIVED_LAYERS in parameters.py and derived_layers.py) tile by tile across
+# sweep_workers processes, in one cell the top cell references. In streaming mode the devices are read again from the
+# device cache for the tiles around them.
+DERIVE_LAYERS = False
 
 # ---------------------------------------------------------------------------------------------------------------------
 # DESIGN SPACE SETUP --------------------------------------------------------------------------------------------------
@@ -21,8 +80,16 @@ x_coords_max = CHIP_WIDTH
 
 
 # Function which creates the appropriately sized blank design space
-def generate_blank_gds(d_height=CHIP_HEIGHT,  # 3000
-                       d_width=CHIP_WIDTH):  # 6000
+def generate_blank_gds(d_height=None,  # CHIP_HEIGHT, 3000
+                       d_width=None):  # CHIP_WIDTH, 6000
+
+    from gdshelpers.layout import GridLayout
+    from shapely.geometry import Polygon
+    from parameters import CHIP_HEIGHT, CHIP_WIDTH, CELL_OUTLINE_LAYER, LABEL_LAYER, LABEL_HEIGHT, \
+        CELL_VERTICAL_SPACING, CELL_HORIZONTAL_SPACING
+
+    d_height = CHIP_HEIGHT if d_height is None else d_height
+    d_width = CHIP_WIDTH if d_width is None else d_width
 
     # Define a design bounding box as a visual guide
     outer_corners = [(0, 0), (d_width, 0), (d_width, d_height), (0, d_height)]
@@ -44,392 +111,564 @@ def generate_blank_gds(d_height=CHIP_HEIGHT,  # 3000
     return layout, polygon
 
 
-# ---------------------------------------------------------------------------------------------------------------------
-# ---------------------------------------------------------------------------------------------------------------------
-# GENERIC DEVICE SWEEPS -----------------------------------------------------------------------------------------------
-# ---------------------------------------------------------------------------------------------------------------------
-# ---------------------------------------------------------------------------------------------------------------------
+# Function which adds the devices of a sweep to the layout as they are generated, beginning a new row whenever the
+# next device would not fit in the chip width
+def add_sweep_to_rows(layout_cell, sweep, current_width, spacing_factor=1.5):
+
+    from parameters import CHIP_WIDTH
+
+    for params, device_cell in sweep.cells(workers=sweep_workers):
 
+        cell_width = -device_cell.bounds[0] + device_cell.bounds[2]
 
-########################
-# GRATING LOOPBACK SWEEP
-########################
-
-def grating_sweep(layout_cell,current_width):
-
-    # Grating Coupler sweep parameters:
-    waveguide_widths = [WAVEGUIDE_WIDTH]
-    # added_waveguide_lengths = [10, 110, 210,250]
-    added_waveguide_lengths = range(10, 250, 15)
-    periods = [GRATING_PERIOD_STANDARD]  # Periods to be swept over
-    fill_factors = [GRATING_FILL_FACTOR_STANDARD]  # Fill-factors to be swept over
-    cell_width = 0
-    # current_width = 0
-
-    # For each period and each fill-factor create a grating loop back and add to the loopback row
-    for i, added_waveguide_length in enumerate(added_waveguide_lengths):
-        for j, waveguide_width in enumerate(waveguide_widths):
-            for k, period in enumerate(periods):
-                for m, fill_factor in enumerate(fill_factors):
-                    sweep_coupler_params = {
-                        'width': waveguide_width,
-                        'full_opening_angle': np.deg2rad(GRATING_FAN_ANGLE),
-                        'grating_period': GRATING_PERIOD_STANDARD,
-                        'grating_ff': fill_factor,
-                        'n_gratings': GRATING_NO_PERIODS,
-                        'taper_length': GRATING_TAPER_LENGTH
-                    }
-                    # temp_cell = grating_loopback(sweep_coupler_params,
-                    #                              taper_route=added_waveguide_length,
-                    #                              name='Grating Loopback\nAdded Length {0}um\nWidth {1}um\nPeriod {2}um\nff {3}'.format(added_waveguide_length, waveguide_width, round(period, 3), fill_factor)
-                    #                              )
-
-                    # cell_width = -temp_cell.bounds[0] + temp_cell.bounds[2]
-                    # current_width = current_width + cell_width + layout_cell.horizontal_spacing * 2  # 1.5
-
-                    sweep_grating_loopback = grating_loopback(sweep_coupler_params,
-                                                 taper_route=added_waveguide_length,
-                                                 name='RT_ZL_Grating Loopback\nAdded Length {0}um\nWidth {1}um\nPeriod {2}um\nff {3}'.format(added_waveguide_length, waveguide_width, round(period, 3), fill_factor)
-                                                 )
-
-                    cell_width = -sweep_grating_loopback.bounds[0] + sweep_grating_loopback.bounds[2]
-
-                    current_width = current_width + cell_width + layout_cell.horizontal_spacing*1.5
-
-                    # Add to row if it will fit
-                    # if current_width > CHIP_WIDTH:
-                    #     layout_cell.begin_new_row()
-                    #     layout_cell.add_to_row(temp_cell)
-                    #     current_width = cell_width + layout_cell.horizontal_alignment + layout_cell.horizontal_spacing
-                    # else:
-                    #     layout_cell.add_to_row(temp_cell)
-
-                    if current_width > CHIP_WIDTH:
-                        layout_cell.begin_new_row()
-                        layout_cell.add_to_row(sweep_grating_loopback)
-                        current_width = cell_width + layout_cell.horizontal_alignment + layout_cell.horizontal_spacing
-                    else:
-                        layout_cell.add_to_row(sweep_grating_loopback)
+        current_width = current_width + cell_width + layout_cell.horizontal_spacing * spacing_factor
 
+        # Add to row if it will fit
+        if current_width > CHIP_WIDTH:
+            layout_cell.begin_new_row()
+            current_width = cell_width + layout_cell.horizontal_alignment + layout_cell.horizontal_spacing
 
+        layout_cell.add_to_row(device_cell)
 
     return layout_cell, current_width
 
 
-#################
-# TEST STRUCTURES
-#################
+# Function which generates the devices of all sweeps and places them on the chip with the layout planner
+def place_with_planner(sweeps, cell_name):
 
-def test_structure_gc(layout_cell):
+    from gdshelpers.geometry.chip import Cell
+    from build_profiler import PROFILE
+    from layout_planner import plan_layout
 
-    temp_cell = grating_loopback(coupler_params,
-                                 taper_route=GRATING_TAPER_ROUTE,
-                                 name='TEST Grating Loopback\nPeriod {0}um  ff {1}\nGrating Taper Length {2}um'.format(GRATING_PERIOD_STANDARD, GRATING_FILL_FACTOR_STANDARD, GRATING_TAPER_LENGTH))
+    with PROFILE.phase('build devices'):
+        device_cells = [device_cell for sweep in sweeps
+                        for params, device_cell in sweep.cells(workers=sweep_workers)]
 
-    # cell_width = -temp_cell.bounds[0] + temp_cell.bounds[2]
-    # current_width = current_width + cell_width + layout_cell.horizontal_spacing * 2  # 1.5
-    # if current_width > CHIP_WIDTH:
-    #     layout_cell.begin_new_row()
-    #     layout_cell.add_to_row(temp_cell)
-    #     current_width = cell_width + layout_cell.horizontal_alignment + layout_cell.horizontal_spacing
-    # else:
-    #     layout_cell.add_to_row(temp_cell)
+    with PROFILE.phase('device bounds'):
+        footprints = [device_cell.bounds for device_cell in device_cells]
 
-    layout_cell.add_to_row(temp_cell)
+    with PROFILE.phase('plan layout'):
+        plan = plan_layout(footprints)
+    print(plan.report())
+    for index in plan.overflow:
+        print(" \n WARNING: {} did not fit on the chip \n ".format(device_cells[index].name))
 
-    return layout_cell# , current_width
+    with PROFILE.phase('place devices'):
+        design_space_cell = Cell(cell_name)
+        for placement in plan.placements:
+            design_space_cell.add_cell(device_cells[placement.index], origin=placement.origin)
 
+    return design_space_cell, plan
 
 
-#####################
-# DIRECTIONAL COUPLER
-#####################
+# Function which checks a layout with the design rule checker, prints the violations and saves them if
+# drc_report_file is set. reticle_cell layouts are checked die by die.
+def run_drc(top_cell, polygon, reticle=False):
 
-def directional_coupler_sweep(layout_cell, current_width):
+    from build_profiler import PROFILE
+    from drc import check_layout, check_reticle
 
-    gaps = [0.25]
-    coupling_lengths = [1.27]
-    coupling_ratios = ['90 : 10']   # For naming purposes
+    with PROFILE.phase('design rule check'):
+        report = check_reticle(top_cell, polygon) if reticle else check_layout(top_cell, polygon)
+    print(report.report())
+    if drc_report_file:
+        report.save_csv(drc_report_file)
 
-    for i, gap in enumerate(gaps):
-        for j, coupling_length in enumerate(coupling_lengths):
+    return report
 
-            temp_cell = directional_coupler(coupler_params,
-                                            coupling_length=coupling_length,
-                                            gap=gap,
-                                            name='RT_ZL_Directional Coupler  {0}\nGap {1}um\nCoupling Length {2}um'.format(coupling_ratios[j], gap, coupling_length))
 
-            cell_width = -temp_cell.bounds[0] + temp_cell.bounds[2]
-            current_width = current_width + cell_width + layout_cell.horizontal_spacing * 2  # 1.5
-            if current_width > CHIP_WIDTH:
-                layout_cell.begin_new_row()
-                layout_cell.add_to_row(temp_cell)
-                current_width = cell_width + layout_cell.horizontal_alignment + layout_cell.horizontal_spacing
-            else:
-                layout_cell.add_to_row(temp_cell)
-
-            layout_cell.add_to_row(temp_cell)
-
-    return layout_cell  , current_width
-
-
-#########
-# 1x2 MMI
-#########
-
-def mmi_1X2_sweep(layout_cell):
-
-    mmi_length = 32.7
-    mmi_width = 6
-    mmi_taper_width = 1.5
-    mmi_taper_length = 20
-
-    temp_cell = mmi_1x2(coupler_params,
-                        mmi_length=mmi_length,
-                        mmi_width=mmi_width,
-                        mmi_taper_width=mmi_taper_width,
-                        mmi_taper_length=mmi_taper_length,
-                        name='1x2 MMI')
-
-    # cell_width = -temp_cell.bounds[0] + temp_cell.bounds[2]
-    # current_width = current_width + cell_width + layout_cell.horizontal_spacing * 2  # 1.5
-    # if current_width > CHIP_WIDTH:
-    #     layout_cell.begin_new_row()
-    #     layout_cell.add_to_row(temp_cell)
-    #     current_width = cell_width + layout_cell.horizontal_alignment + layout_cell.horizontal_spacing
-    # else:
-    #     layout_cell.add_to_row(temp_cell)
-
-    layout_cell.add_to_row(temp_cell)
-
-    return layout_cell# , current_width
-
-
-#########
-# 2x2 MMI
-#########
-
-def mmi_2X2_sweep(layout_cell):
-
-    mmi_length = 44.8
-    mmi_width = 6
-    mmi_taper_width = 1.5
-    mmi_taper_length = 20
-
-    temp_cell = mmi_2x2(coupler_params,
-                        mmi_length=mmi_length,
-                        mmi_width=mmi_width,
-                        mmi_taper_width=mmi_taper_width,
-                        mmi_taper_length=mmi_taper_length,
-                        name='2x2 MMI')
-
-    # cell_width = -temp_cell.bounds[0] + temp_cell.bounds[2]
-    # current_width = current_width + cell_width + layout_cell.horizontal_spacing * 2  # 1.5
-    # if current_width > CHIP_WIDTH:
-    #     layout_cell.begin_new_row()
-    #     layout_cell.add_to_row(temp_cell)
-    #     current_width = cell_width + layout_cell.horizontal_alignment + layout_cell.horizontal_spacing
-    # else:
-    #     layout_cell.add_to_row(temp_cell)
-
-    layout_cell.add_to_row(temp_cell)
-
-    return layout_cell# , current_width
-
-
-#######################
-#     MZI Call
-########################
-# def mzi_dc(coupler_params,
-#            coupling_length,
-#            gap,
-#            mzi_centre_spacing,
-#            path_length_difference,
-#            position=(0,0),
-#            name=MZI):
-def mzi_sweep(layout_cell):
-    gap = 0.25
-    coupling_length = 1.27
-    mzi_centre_spacing = 75
-    path_length_difference = 0
-
-    mzi_cell = mzi_dc(coupler_params,
-           coupling_length = coupling_length,
-           gap = gap,
-           mzi_centre_spacing = mzi_centre_spacing,
-           path_length_difference = path_length_difference,
-           position=(0,0),
-           name= 'MZI')
-    layout_cell.add_to_row(mzi_cell)
-
-    return layout_cell
-
-def mzi2_sweep(layout_cell):
-    gap = 0.25
-    coupling_length = 1.27
-    mzi_centre_spacing = 75
-    path_length_difference = 0
-
-    mzi_cell = mzi_dc2(coupler_params,
-           coupling_length = coupling_length,
-           gap = gap,
-           mzi_centre_spacing = mzi_centre_spacing,
-           path_length_difference = path_length_difference,
-           position=(0,0),
-           name= 'MZI2')
-    layout_cell.add_to_row(mzi_cell)
-
-    return layout_cell
-
-
-def cascaded_mzi_sweep(layout_cell):
-    gap = 0.25
-    coupling_length = 1.27
-    mzi_centre_spacing = 75
-    path_length_difference = 0
-
-    mzi_cell = cascaded_mzi_dc(coupler_params,
-                        coupling_length = coupling_length,
-                        gap = gap,
-                        mzi_center_spacing = mzi_centre_spacing,
-                        path_length_difference = path_length_difference,
-                        position = (0,0),
-                        name = 'Cascaded MZI'
-                        )
-    layout_cell.add_to_row(mzi_cell)
+# Function which checks the grating alignment of the placed devices, given as (name, coupler ports) pairs, prints the
+# violations and saves them if alignment_report_file is set. Raises a GratingAlignmentError for violations in a strict
+# build.
+def run_alignment_check(devices):
 
-    return layout_cell
+    from build_profiler import PROFILE
+    from grating_alignment import GratingAlignmentError, check_alignment
 
-######################
-# RING RESONATOR SWEEP
-######################
+    with PROFILE.phase('grating alignment'):
+        report = check_alignment(devices)
+    print(report.report())
+    if alignment_report_file:
+        report.save_csv(alignment_report_file)
+    if strict_grating_alignment and not report.passed:
+        raise GratingAlignmentError(report)
 
-def ring_sweep(layout_cell,current_width):
+    return report
 
-    ring_radii = np.linspace(70, 120, 5)    # Ring radii to be swept over (start, stop, no. steps)
-    gap_size = np.linspace(0.250, 0.750, 3) # Gap sizes to be swept over (start, stop, no. steps)
 
-    for i, ring_radius in enumerate(ring_radii):
-        for j, gap in enumerate(gap_size):
-            sweep_ring_parameters = coupler_params
-            sweep_ring_resonator = ring_resonator(sweep_ring_parameters,
-                                                  gap=gap,
-                                                  radius=ring_radius,
-                                                  name='RT_ZL_Ring_Resonator_ZL\nRadius_' + str(ring_radius) + '\nGap_' + str(gap))
+# Function which saves the probe map rows next to the GDS file, or to probe_map_file if set
+def write_probe_map(rows, gds_filename):
 
-            cell_width = -sweep_ring_resonator.bounds[0] + sweep_ring_resonator.bounds[2]
+    from build_profiler import PROFILE
+    from probe_map import save_probe_map
 
-            current_width = current_width + cell_width + layout_cell.horizontal_spacing * 1.5
+    filename = probe_map_file or '{0}_probes.csv'.format(os.path.splitext(gds_filename)[0])
+    with PROFILE.phase('save probe map'):
+        save_probe_map(rows, filename)
+    print('Saved {0} grating coupler ports to the probe map {1}'.format(len(rows), filename))
 
 
-            if current_width > CHIP_WIDTH:
-                # layout_cell.begin_new_row()
-                layout_cell.add_to_row(sweep_ring_resonator)
-                current_width = cell_width + layout_cell.horizontal_alignment + layout_cell.horizontal_spacing
-            else:
-                layout_cell.add_to_row(sweep_ring_resonator)
+# Function which returns the metadata of the devices placed in top_cell (see components.DeviceMetadata)
+def placed_metadata(top_cell):
 
-    return layout_cell, current_width
+    return [sub_cell['cell'].metadata for sub_cell in top_cell.cells if hasattr(sub_cell['cell'], 'metadata')]
 
 
-##############
-# SPIRAL SWEEP
-##############
-
-def spiral_sweep(layout_cell,current_width):
-
-    # Sweep parameters:
-    # number_of_loops = [2, 7, 12, 17, 22, 27]
-    number_of_loops = range(2, 28, 3)
-    gap_sizes = [10]
-    inner_gap_sizes = [15]
-
-    # for each parameter
-    for i, loop_numbers in enumerate(number_of_loops):
-        for j, gap_size in enumerate(gap_sizes):
-            for k, inner_gap_size in enumerate(inner_gap_sizes):
-                sweep_spiral = spiral_loopback(coupler_params,
-                                               name='RT_ZL_Spiral\nNo._loops_' + str(loop_numbers) + '\nGap_between_waveguides_' + str(gap_size) + '\nInner_circle_radius_' + str(inner_gap_size),
-                                               number=loop_numbers,
-                                               gap_size=gap_size,
-                                               inner_gap_size=inner_gap_size
-                                               )
-
-                # layout_cell.add_to_row(sweep_spiral)
-                cell_width = -sweep_spiral.bounds[0] + sweep_spiral.bounds[2]
-
-                current_width = current_width + cell_width + layout_cell.horizontal_spacing * 1.5
-
-                # Add to row if it will fit
-                # if current_width > CHIP_WIDTH:
-                #     layout_cell.begin_new_row()
-                #     layout_cell.add_to_row(temp_cell)
-                #     current_width = cell_width + layout_cell.horizontal_alignment + layout_cell.horizontal_spacing
-                # else:
-                #     layout_cell.add_to_row(temp_cell)
-
-                if current_width > CHIP_WIDTH:
-                    layout_cell.begin_new_row()
-                    layout_cell.add_to_row(sweep_spiral)
-                    current_width = cell_width + layout_cell.horizontal_alignment + layout_cell.horizontal_spacing
-                else:
-                    layout_cell.add_to_row(sweep_spiral)
+# Function which saves the sweep table of the placed devices next to the GDS file, or to sweep_table_file if set
+def write_sweep_table(sweeps, metadata, gds_filename):
 
-    return layout_cell, current_width
+    from sweep_engine import save_sweep_table, sweep_table
 
+    filename = sweep_table_file or '{0}_devices.csv'.format(os.path.splitext(gds_filename)[0])
+    rows = sweep_table(sweeps, metadata)
+    save_sweep_table(rows, filename)
+    print('Saved the path lengths of {0} devices to {1}'.format(len(rows), filename))
 
 
-# ---------------------------------------------------------------------------------------------------------------------
-# ---------------------------------------------------------------------------------------------------------------------
-# DESIGN SPACE LAYOUT -------------------------------------------------------------------------------------------------
-# ---------------------------------------------------------------------------------------------------------------------
-# ---------------------------------------------------------------------------------------------------------------------
+# Function which deduplicates the components of the devices placed in the top cells, see geometry_dedup.py
+def deduplicate_devices(top_cells):
 
-def populate_gds(layout_cell, polygon):
+    from build_profiler import PROFILE
+    from geometry_dedup import GeometryDeduplicator
 
-    current_width = layout_cell.horizontal_alignment
+    deduplicator = GeometryDeduplicator()
+    with PROFILE.phase('deduplicate geometry'):
+        deduplicator.deduplicate(sub_cell['cell'] for top_cell in top_cells for sub_cell in top_cell.cells
+                                 if hasattr(sub_cell['cell'], 'metadata'))
+    print('Replaced {0} repeated components by references to {1} shared cells'.format(
+        deduplicator.replaced, len(deduplicator.shared_cells)))
 
-    layout_cell.begin_new_row()
 
-    #layout_cell, current_width = grating_sweep(layout_cell, current_width)
+# Function which replaces the labels of the devices placed in the top cells by glyph references or TEXT records, see
+# labels.py
+def place_device_labels(top_cells, mode):
 
-    # Add the device sweeps to the layout cell
-    # layout_cell = test_structure_gc(layout_cell)
+    from build_profiler import PROFILE
+    from labels import place_labels
 
+    with PROFILE.phase('place labels'):
+        for top_cell in top_cells:
+            for sub_cell in top_cell.cells:
+                if hasattr(sub_cell['cell'], 'metadata'):
+                    place_labels(sub_cell['cell'], mode)
 
-    # layout_cell = mmi_1X2_sweep(layout_cell)
-    # layout_cell = mmi_2X2_sweep(layout_cell)
-    # layout_cell, current_width = directional_coupler_sweep(layout_cell, current_width)
 
-    # Spiral Sweep
-    layout_cell, current_width = spiral_sweep(layout_cell,current_width)
+# Function which saves the raster preview of a layout and its zoomed tiles next to the GDS, see preview.py
+def write_preview(top_cell, gds_filename):
+
+    from build_profiler import PROFILE
+    from preview import LayoutPreview
+
+    base = '{0}_preview'.format(os.path.splitext(gds_filename)[0])
+    with PROFILE.phase('preview'):
+        layout_preview = LayoutPreview(top_cell)
+        layout_preview.save(base + '.png', resolution=preview_resolution)
+        for n, window in enumerate(preview_tiles):
+            layout_preview.save('{0}_{1}.png'.format(base, n), window, preview_tile_resolution)
+    print('Saved the preview to {0}.png{1}'.format(base, ' and {0} zoomed tiles'.format(len(preview_tiles))
+                                                   if preview_tiles else ''))
+
+
+# Function which returns the cell holding the derived layers of a layout (see derived_layers.py), named after its top
+# cell. layout is the top cell, the placed polygons of the layers they are derived from or the placed devices (see
+# derived_layers.derive_device_layers).
+def build_derived_layers(layout, cell_name):
+
+    from build_profiler import PROFILE
+    from derived_layers import derived_layer_cell
+
+    with PROFILE.phase('derive layers'):
+        return derived_layer_cell(layout, cell_name + '_derived', workers=sweep_workers)
+
+
+# Function which saves a top cell and every cell it references as GDSII or OASIS, with the labels placed as TEXT
+# records (labels='text') written too
+def save_layout(top_cell, filename, output_format=OUTPUT_FORMAT, labels=LABEL_MODE):
+
+    from contextlib import nullcontext
+    from labels import label_records
+    from vertex_budget import budgeted_fracturing
+
+    if output_format == 'oas':
+        from oasis_export import save_oasis
+        save_oasis(top_cell, filename)
+    else:
+        with budgeted_fracturing(), label_records() if labels == 'text' else nullcontext():
+            top_cell.save(filename)
+
+
+# Function which builds the devices of all sweeps a batch at a time, writes each device straight to the GDS file and
+# finally writes the top cell with references to the devices placed by the layout planner
+def stream_with_planner(sweeps, polygon, cell_name, filename, drc=False, check_alignment=CHECK_GRATING_ALIGNMENT,
+                        probe_map=WRITE_PROBE_MAP, write_table=WRITE_SWEEP_TABLE, dedup=DEDUP_GEOMETRY,
+                        labels=LABEL_MODE, output_format=OUTPUT_FORMAT, preview=WRITE_PREVIEW,
+                        derive=DERIVE_LAYERS):
+
+    from functools import partial
+    from gdshelpers.geometry.chip import Cell
+    from build_profiler import PROFILE
+    from derived_layers import placed_device_polygons
+    from device_cache import DEVICE_CACHE_PATH
+    from gds_stream import GDSStreamWriter
+    from oasis_export import OASISStreamWriter
+    from geometry_dedup import GeometryDeduplicator
+    from grating_alignment import coupler_ports
+    from labels import place_labels
+    from layout_planner import plan_layout
+    from parameters import CELL_OUTLINE_LAYER
+    from probe_map import probe_rows
+
+    batch_size = stream_batch_size or sweep_workers or os.cpu_count() or 1
+    deduplicator = GeometryDeduplicator()
+
+    writer = OASISStreamWriter if output_format == 'oas' else GDSStreamWriter
+    with writer(filename, fragment_path=DEVICE_CACHE_PATH) as gds:
+        device_names = []
+        footprints = []
+        device_ports = []
+        device_metadata = []
+        device_builds = []
+        kept_cells = {}
+        with PROFILE.phase('build and write devices'):
+            for sweep in sweeps:
+                for params, device_cell in sweep.cells(batch_size=batch_size, workers=sweep_workers):
+                    footprints.append(device_cell.bounds)
+                    device_names.append(device_cell.name)
+                    device_ports.append(coupler_ports(device_cell))
+                    device_metadata.append(getattr(device_cell, 'metadata', None))
+                    device_builds.append((sweep.device_function, sweep.kwargs_for(params)))
+                    if dedup:
+                        deduplicator.deduplicate([device_cell])
+                    place_labels(device_cell, labels)
+                    gds.write_cell(device_cell)
+                    if drc or preview:
+                        kept_cells[device_cell.name] = device_cell
+
+        with PROFILE.phase('plan layout'):
+            plan = plan_layout(footprints)
+        print(plan.report())
+        for index in plan.overflow:
+            print(" \n WARNING: {} did not fit on the chip, it is only in the GDS library \n ".format(
+                device_names[index]))
+
+        devices = [(device_names[placement.index],
+                    [(x + placement.origin[0], y + placement.origin[1]) for x, y in device_ports[placement.index]])
+                   for placement in plan.placements]
+        if check_alignment:
+            run_alignment_check(devices)
+
+        derived_cell = None
+        if derive:
+            # The devices aren't kept, each is read again from the device cache for the tiles its placed bounds reach
+            placed_devices = []
+            for placement in plan.placements:
+                x0, y0, x1, y1 = footprints[placement.index]
+                x, y = placement.origin
+                placed_devices.append(((x0 + x, y0 + y, x1 + x, y1 + y),
+                                       partial(placed_device_polygons, *device_builds[placement.index],
+                                               placement.origin)))
+            derived_cell = build_derived_layers(placed_devices, cell_name)
+
+        with PROFILE.phase('write top cell'):
+            design_space_cell = Cell(cell_name)
+            for placement in plan.placements:
+                design_space_cell.add_cell(gds.reference(device_names[placement.index]), origin=placement.origin)
+            if derived_cell is not None:
+                design_space_cell.add_cell(derived_cell)
+            design_space_cell.add_to_layer(CELL_OUTLINE_LAYER, polygon)
+            gds.close(design_space_cell)
+
+        print('Copied {0} unchanged cells from the device cache, generated {1}'.format(gds.spliced, gds.encoded))
+        if dedup:
+            print('Placed {0} components by reference to {1} shared cells'.format(
+                deduplicator.replaced, len(deduplicator.shared_cells)))
+
+    if probe_map:
+        write_probe_map(probe_rows(devices), filename)
+    if write_table:
+        write_sweep_table(sweeps, [device_metadata[placement.index] for placement in plan.placements
+                                   if device_metadata[placement.index] is not None], filename)
+
+    if drc or preview:
+        # The top cell only references stand-ins, check and preview a copy of it placing the kept devices
+        placed_cell = Cell(cell_name)
+        for placement in plan.placements:
+            placed_cell.add_cell(kept_cells[device_names[placement.index]], origin=placement.origin)
+        if drc:
+            run_drc(placed_cell, polygon)
+        if preview:
+            placed_cell.add_to_layer(CELL_OUTLINE_LAYER, polygon)
+            if derived_cell is not None:
+                placed_cell.add_cell(derived_cell)
+            write_preview(placed_cell, filename)
 
-    # Cascaded MZI
-    layout_cell = cascaded_mzi_sweep(layout_cell)
-    layout_cell.begin_new_row()
+    return design_space_cell
 
-    # Ring Sweep
-    layout_cell,current_width = ring_sweep(layout_cell,current_width)
-    layout_cell.begin_new_row()
 
-    # Grating Sweep
-    layout_cell, current_width = grating_sweep(layout_cell, current_width)
+# ---------------------------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+# DESIGN SPACE LAYOUT -------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
 
-    # Generate the design space populated with the devices
-    design_space_cell, mapping = layout_cell.generate_layout(cell_name='Cell0_University_of_Bristol_Nanofab_2024_RT_ZL')
+def populate_gds(layout_cell, polygon, use_planner=USE_LAYOUT_PLANNER, use_reticle=USE_RETICLE, sweeps=None,
+                 filename=None, stream=STREAM_GDS, drc=RUN_DRC, check_alignment=CHECK_GRATING_ALIGNMENT,
+                 probe_map=WRITE_PROBE_MAP, write_table=WRITE_SWEEP_TABLE, dedup=DEDUP_GEOMETRY, labels=LABEL_MODE,
+                 output_format=OUTPUT_FORMAT, preview=WRITE_PREVIEW, derive=DERIVE_LAYERS):
+
+    from build_profiler import PROFILE
+    from device_cache import evict_device_caches
+    from device_sweeps import design_sweeps
+    from grating_alignment import layout_devices
+    from parameters import CELL_OUTLINE_LAYER
+    from probe_map import probe_rows, reticle_probe_rows
+
+    cell_name = 'Cell0_University_of_Bristol_Nanofab_2024_RT_ZL'
+    sweeps = design_sweeps() if sweeps is None else sweeps
+
+    if use_reticle:
+        from reticle import populate_reticle, save_manifest
+
+        # Every die gets its own bounding box and is referenced once from the reticle
+        with PROFILE.phase('build dies'):
+            reticle_cell, manifest = populate_reticle(sweeps, outline=polygon, max_dies=max_reticle_dies,
+                                                      workers=sweep_workers)
+        filename = filename or '{0}SOI_Devices_RT_ZL_2023_reticle.{1}'.format(savepath, output_format)
+        if check_alignment:
+            run_alignment_check([device for die in reticle_cell.cells
+                                 for device in layout_devices(die['cell'], die['origin'], die['cell'].name + ': ')])
+        if drc:
+            run_drc(reticle_cell, polygon, reticle=True)
+        if dedup:
+            deduplicate_devices(die['cell'] for die in reticle_cell.cells)
+        if labels != 'polygons':
+            place_device_labels([die['cell'] for die in reticle_cell.cells], labels)
+        if derive:
+            for die in reticle_cell.cells:
+                die['cell'].add_cell(build_derived_layers(die['cell'], die['cell'].name))
+        with PROFILE.phase('save GDS'):
+            save_layout(reticle_cell, filename, output_format, labels)
+        save_manifest(manifest, '{0}_manifest.csv'.format(os.path.splitext(filename)[0]))
+        if probe_map:
+            write_probe_map(reticle_probe_rows(reticle_cell), filename)
+        if write_table:
+            write_sweep_table(sweeps, [record for die in reticle_cell.cells for record in placed_metadata(die['cell'])],
+                              filename)
+        if preview:
+            write_preview(reticle_cell, filename)
+
+        evict_device_caches(sweep.device_function for sweep in sweeps)
+        return reticle_cell
+
+    if stream and use_planner:
+        # Devices are written as they are built, the returned top cell only holds references
+        top_cell = stream_with_planner(sweeps, polygon, cell_name,
+                                       filename or '{0}SOI_Devices_RT_ZL_2023.{1}'.format(savepath, output_format),
+                                       drc=drc, check_alignment=check_alignment, probe_map=probe_map,
+                                       write_table=write_table, dedup=dedup, labels=labels, output_format=output_format,
+                                       preview=preview, derive=derive)
+        evict_device_caches(sweep.device_function for sweep in sweeps)
+        return top_cell
+
+    if use_planner:
+        # Pack all devices onto the chip with the layout planner
+        design_space_cell, plan = place_with_planner(sweeps, cell_name)
+
+    else:
+        # Add the device sweeps to the layout cell, each sweep starting on a new row
+        current_width = layout_cell.horizontal_alignment
+        with PROFILE.phase('build devices'):
+            for sweep in sweeps:
+                layout_cell.begin_new_row()
+                layout_cell, current_width = add_sweep_to_rows(layout_cell, sweep, layout_cell.horizontal_alignment)
+
+        # Generate the design space populated with the devices
+        with PROFILE.phase('generate layout'):
+            design_space_cell, mapping = layout_cell.generate_layout(cell_name=cell_name)
 
     # Add our bounding box
     design_space_cell.add_to_layer(CELL_OUTLINE_LAYER, polygon)
 
-    # Save our GDS
-    design_space_cell.save('{0}SOI_Devices_RT_ZL_2023.gds'.format(savepath))
-    # design_space_cell.show()
+    devices = layout_devices(design_space_cell)
+    if check_alignment:
+        run_alignment_check(devices)
+    if drc:
+        run_drc(design_space_cell, polygon)
+    if dedup:
+        deduplicate_devices([design_space_cell])
+    if labels != 'polygons':
+        place_device_labels([design_space_cell], labels)
+    if derive:
+        design_space_cell.add_cell(build_derived_layers(design_space_cell, cell_name))
 
+    # Save our GDS
+    filename = filename or '{0}SOI_Devices_RT_ZL_2023.{1}'.format(savepath, output_format)
+    with PROFILE.phase('save GDS'):
+        save_layout(design_space_cell, filename, output_format, labels)
+    if probe_map:
+        write_probe_map(probe_rows(devices), filename)
+    if write_table:
+        write_sweep_table(sweeps, placed_metadata(design_space_cell), filename)
+    if preview:
+        write_preview(design_space_cell, filename)
+
+    evict_device_caches(sweep.device_function for sweep in sweeps)
     return design_space_cell
 
 
-# Call the function which generates a blank design space
-blank_design_space, bounding_box = generate_blank_gds()
+# Function which estimates the layout from the footprint estimates in components.py without generating any geometry
+def estimate_design(sweeps, use_reticle=USE_RETICLE):
+
+    from layout_planner import plan_dies, plan_layout
+
+    for sweep in sweeps:
+        print('{0:<20} {1:>5} devices {2:>12.0f} um^2'.format(sweep.device_function.__name__, len(sweep),
+                                                             sweep.estimate_area()))
+
+    footprints = [bounds for sweep in sweeps for bounds in sweep.estimate_bounds()]
+
+    if use_reticle:
+        plans, unassigned = plan_dies(footprints, max_dies=max_reticle_dies)
+        for n, plan in enumerate(plans):
+            print('Die {0}: {1}'.format(n, plan.report()))
+        print('{0} dies, {1} devices did not fit on any die'.format(len(plans), len(unassigned)))
+        return plans
+
+    plan = plan_layout(footprints)
+    print(plan.report())
+
+    return plan
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# COMMAND LINE --------------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
 
-# Populate the blank gds with all of our devices
-populate_gds(blank_design_space, bounding_box)
\ No newline at end of file
+def main(argv=None):
+
+    global sweep_workers, max_reticle_dies, drc_report_file, strict_grating_alignment, alignment_report_file, \
+        probe_map_file, sweep_table_file, preview_resolution, preview_tiles
+
+    parser = argparse.ArgumentParser(prog='python -m design_space', description='Build the design space GDS')
+    parser.add_argument('-s', '--sweeps', nargs='+', metavar='SWEEP',
+                        help='sweeps to place on the chip, in order (default: device_sweeps.DEFAULT_SWEEPS)')
+    parser.add_argument('--list-sweeps', action='store_true', help='list the available sweeps and exit')
+    parser.add_argument('-o', '--output', help='GDS or OASIS file to write (default: in savepath)')
+    parser.add_argument('--format', choices=['gds', 'oas'],
+                        help='write GDSII or OASIS (default: from the --output extension, else %s)' % OUTPUT_FORMAT)
+    parser.add_argument('-j', '--workers', type=int, default=sweep_workers,
+                        help='processes to build the devices with (default: one per CPU)')
+    parser.add_argument('-n', '--dry-run', '--estimate-only', action='store_true', dest='dry_run',
+                        help='only estimate the footprints and the layout, no geometry is generated or saved')
+    parser.add_argument('--rows', action='store_true', help='place each sweep in GridLayout rows, not the planner')
+    parser.add_argument('--reticle', action='store_true', default=USE_RETICLE,
+                        help='split the devices across several dies and save a reticle with a manifest')
+    parser.add_argument('--max-dies', type=int, default=max_reticle_dies, help='max. number of reticle dies')
+    parser.add_argument('--no-stream', action='store_false', dest='stream', default=STREAM_GDS,
+                        help='save the whole chip with Cell.save at the end instead of streaming the devices')
+    parser.add_argument('--drc', action='store_true', default=RUN_DRC,
+                        help='check the layout against the design rules of parameters.py')
+    parser.add_argument('--drc-report', metavar='FILE', help='save the design rule violations as CSV (implies --drc)')
+    parser.add_argument('--strict-alignment', action='store_true', default=strict_grating_alignment,
+                        help='fail the build if a grating coupler is not aligned to the fibre array')
+    parser.add_argument('--alignment-report', metavar='FILE', help='save the grating alignment violations as CSV')
+    parser.add_argument('--probe-map', metavar='FILE',
+                        help='save the probe map of the coupler ports here (.csv or .parquet, default: next to the GDS)')
+    parser.add_argument('--no-probe-map', action='store_false', dest='write_probe_map', default=WRITE_PROBE_MAP,
+                        help="don't save the probe map")
+    parser.add_argument('--sweep-table', metavar='FILE',
+                        help='save the path lengths of the devices here (default: next to the GDS)')
+    parser.add_argument('--no-sweep-table', action='store_false', dest='write_sweep_table', default=WRITE_SWEEP_TABLE,
+                        help="don't save the sweep table")
+    parser.add_argument('--no-dedup', action='store_false', dest='dedup', default=DEDUP_GEOMETRY,
+                        help="don't replace repeated components by references to shared cells")
+    parser.add_argument('--labels', choices=['glyphs', 'polygons', 'text'], default=LABEL_MODE,
+                        help='write the device labels as glyph references, polygons or GDS TEXT records')
+    parser.add_argument('--preview', action='store_true', default=WRITE_PREVIEW,
+                        help='save a PNG preview of the layout next to the GDS')
+    parser.add_argument('--preview-resolution', type=float, default=preview_resolution, metavar='UM',
+                        help='um per pixel of the preview (default: %(default)s)')
+    parser.add_argument('--preview-tile', type=float, nargs=4, action='append', metavar=('X0', 'Y0', 'X1', 'Y1'),
+                        help='also save a zoomed preview of this window (implies --preview, repeatable)')
+    parser.add_argument('--derived-layers', action='store_true', dest='derive', default=DERIVE_LAYERS,
+                        help='generate the derived layers (suspension etch, slab protection)')
+    parser.add_argument('--profile', action='store_true',
+                        help='also time the gdshelpers steps (Text labels, grating couplers, fracturing)')
+    parser.add_argument('--no-profile', action='store_true', help="don't print the build timing report")
+    parser.add_argument('--profile-json', metavar='FILE', help='also save the build timing report as JSON')
+    arguments = parser.parse_args(argv)
+
+    from device_sweeps import DEFAULT_SWEEPS, SWEEPS, design_sweeps
+
+    if arguments.list_sweeps:
+        for name in SWEEPS:
+            print(name + (' (default)' if name in DEFAULT_SWEEPS else ''))
+        return
+
+    try:
+        sweeps = design_sweeps(arguments.sweeps or DEFAULT_SWEEPS)
+    except ValueError as error:
+        parser.error(str(error))
+
+    sweep_workers = arguments.workers
+    max_reticle_dies = arguments.max_dies
+    drc_report_file = arguments.drc_report or drc_report_file
+    strict_grating_alignment = arguments.strict_alignment
+    alignment_report_file = arguments.alignment_report or alignment_report_file
+    probe_map_file = arguments.probe_map or probe_map_file
+    sweep_table_file = arguments.sweep_table or sweep_table_file
+    preview_resolution = arguments.preview_resolution
+    preview_tiles = arguments.preview_tile or preview_tiles
+    output_format = arguments.format or ('oas' if (arguments.output or '').lower().endswith('.oas') else OUTPUT_FORMAT)
+    if probe_map_file and probe_map_file.lower().endswith('.parquet'):
+        try:
+            import pyarrow
+        except ImportError:
+            parser.error('saving the probe map as Parquet needs pyarrow, save it as .csv instead')
+
+    if arguments.dry_run:
+        estimate_design(sweeps, use_reticle=arguments.reticle)
+        return
+
+    from build_profiler import PROFILE, profile_gdshelpers
+    from vertex_budget import VERTEX_COUNTS
+
+    PROFILE.enabled = not arguments.no_profile
+    # Record the time spent in the gdshelpers steps the build is slowest in (see build_profiler.py)
+    if arguments.profile and PROFILE.enabled:
+        profile_gdshelpers()
+    PROFILE.reset()
+    VERTEX_COUNTS.reset()
+    start = time.perf_counter()
+
+    # Call the function which generates a blank design space
+    with PROFILE.phase('generate blank design space'):
+        blank_design_space, bounding_box = generate_blank_gds()
+
+    # Populate the blank gds with all of our devices
+    from grating_alignment import GratingAlignmentError
+    try:
+        populate_gds(blank_design_space, bounding_box, use_planner=not arguments.rows, use_reticle=arguments.reticle,
+                     sweeps=sweeps, filename=arguments.output, stream=arguments.stream,
+                     drc=arguments.drc or arguments.drc_report is not None,
+                     probe_map=arguments.write_probe_map, write_table=arguments.write_sweep_table,
+                     dedup=arguments.dedup, labels=arguments.labels, output_format=output_format,
+                     preview=arguments.preview or arguments.preview_tile is not None, derive=arguments.derive)
+    except GratingAlignmentError as error:
+        parser.exit(1, 'Build failed: {0}\n'.format(error))
+
+    print('Built in {0:.1f} s'.format(time.perf_counter() - start))
+
+    # Vertices of the polygons fractured in this build, before and after the vertex budget
+    if VERTEX_COUNTS.layers:
+        print(VERTEX_COUNTS.report())
+
+    if PROFILE.enabled:
+        print(PROFILE.report())
+        if arguments.profile_json:
+            PROFILE.save_json(arguments.profile_json)
+
+
+# Only build when run as a script (python -m design_space), the sweep worker processes import this module too
+if __name__ == '__main__':
+    main()
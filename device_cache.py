@@ -0,0 +1,205 @@
+import argparse
+import hashlib
+import os
+import pickle
+from functools import lru_cache
+
+import numpy as np
+
+import gdshelpers
+import parameters
+from components import intern_coupler_cells
+from dependency_graph import COMPONENTS_FILE, PARAMETERS_FILE, component_definitions, device_dependencies, \
+    module_dependencies
+
+# ---------------------------------------------------------------------------------------------------------------------
+# ON-DISK DEVICE CACHE ------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Folder the generated device cells are cached in, and the size it is allowed to grow to before the least recently used
+# devices are evicted
+DEVICE_CACHE_PATH = r"./.nanofab_cache/"
+DEVICE_CACHE_MAX_SIZE = 2 * 1024 ** 3   # bytes
+
+
+# Function which returns the sources of project modules (see dependency_graph.py) as [(file name, source)]
+def module_sources(module_files):
+
+    sources = []
+    for module_file in sorted(module_files):
+        with open(module_file, 'rb') as source_file:
+            sources.append((os.path.basename(module_file), source_file.read()))
+
+    return sources
+
+
+# Function which hashes the source files every device depends on: parameters.py, components.py and the project modules
+# components.py imports from, so editing any of them (or the device definitions themselves) invalidates the whole cache
+@lru_cache(maxsize=None)
+def source_hash():
+
+    source_digest = hashlib.sha1()
+    for name, source in module_sources(module_dependencies(COMPONENTS_FILE, PARAMETERS_FILE)[1] | {PARAMETERS_FILE}):
+        source_digest.update(source)
+
+    return source_digest.hexdigest()
+
+
+# Function which hashes what a device function of components.py depends on: the source of the function and of every
+# function, class and constant of components.py it uses, the sources of the other project modules they use (e.g.
+# labels.py for Label), and the values of the parameters they read (see dependency_graph.py). Editing a parameter only
+# invalidates the devices which read it. Functions which aren't in components.py fall back to the hash of the whole
+# source.
+@lru_cache(maxsize=None)
+def dependency_hash(function_name):
+
+    parameter_names, used_definitions, used_modules = device_dependencies(function_name, COMPONENTS_FILE,
+                                                                          PARAMETERS_FILE)
+    if parameter_names is None:
+        return source_hash()
+
+    definitions = component_definitions(COMPONENTS_FILE, PARAMETERS_FILE)
+    dependencies = (sorted((name, definitions[name]['source']) for name in used_definitions),
+                    module_sources(used_modules),
+                    sorted((name, normalize_argument(getattr(parameters, name))) for name in parameter_names),
+                    gdshelpers.__version__)
+
+    return hashlib.sha1(repr(dependencies).encode()).hexdigest()
+
+
+# Function which turns device arguments into a plain, reproducible structure (numpy scalars, dicts, ranges, ...)
+def normalize_argument(value):
+
+    if isinstance(value, dict):
+        return tuple(sorted((key, normalize_argument(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple, range, np.ndarray)):
+        return tuple(normalize_argument(item) for item in value)
+    if isinstance(value, np.generic):
+        return value.item()
+
+    return value
+
+
+# Function which creates the content address of a device from its function name, arguments and the source hash
+def device_cache_key(function_name, args, kwargs):
+
+    key = repr((function_name, normalize_argument(args), normalize_argument(kwargs), dependency_hash(function_name)))
+
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+# Function which lists the cache entries: the pickled device cells and the GDS or OASIS records of the devices written
+# by the streaming writers (gds_stream.py, oasis_export.py)
+def device_cache_entries(cache_path=DEVICE_CACHE_PATH):
+
+    if not os.path.isdir(cache_path):
+        return []
+
+    return [entry for entry in os.scandir(cache_path) if entry.name.endswith(('.pkl', '.gds', '.oas'))]
+
+
+# Function which deletes the least recently used cached devices until the cache fits in max_size bytes. Other builds
+# (e.g. sweep workers or a second build) may delete entries at the same time, those are skipped.
+def evict_device_cache(cache_path=DEVICE_CACHE_PATH, max_size=DEVICE_CACHE_MAX_SIZE):
+
+    entries = []
+    for entry in device_cache_entries(cache_path):
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    cache_size = sum(size for mtime, size, path in entries)
+
+    # Oldest access first, cache hits touch their file so this is least recently used order
+    for mtime, size, path in sorted(entries):
+        if cache_size <= max_size:
+            break
+        cache_size -= size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# Function which deletes every cached device
+def clear_device_cache(cache_path=DEVICE_CACHE_PATH):
+
+    for entry in device_cache_entries(cache_path):
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+
+# Wrapper around a device function from components.py which loads the device cell from the disk cache if it was
+# already generated with the same arguments and parameters, and stores it otherwise. The cell gets the cache key as its
+# cache_key attribute, the streaming GDS writer keys the cell's GDS records on it.
+# The cache is only evicted at the end of a build, see evict_device_caches.
+class CachedDevice:
+
+    def __init__(self, device_function, cache_path=DEVICE_CACHE_PATH, max_size=DEVICE_CACHE_MAX_SIZE):
+
+        self.device_function = device_function
+        self.__name__ = device_function.__name__
+        self.cache_path = cache_path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, *args, **kwargs):
+
+        cache_key = device_cache_key(self.__name__, args, kwargs)
+        cache_file = os.path.join(self.cache_path, cache_key + '.pkl')
+
+        if os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'rb') as f:
+                    device_cell = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                device_cell = None  # Unreadable entry, regenerate it below
+
+            if device_cell is not None:
+                os.utime(cache_file)  # Mark as recently used for the LRU eviction
+                self.hits += 1
+                return intern_coupler_cells(device_cell)
+
+        self.misses += 1
+        device_cell = self.device_function(*args, **kwargs)
+        device_cell.cache_key = cache_key
+        device_cell.bounds  # Store the bounds with the cell, the layout needs them and they cost as much as the geometry
+
+        # Write to a temporary file first so an interrupted build never leaves a half written entry behind
+        os.makedirs(self.cache_path, exist_ok=True)
+        temp_file = '{0}.{1}.tmp'.format(cache_file, os.getpid())
+        with open(temp_file, 'wb') as f:
+            pickle.dump(device_cell, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, cache_file)
+
+        return device_cell
+
+
+# Function which evicts the least recently used entries from the cache folders of the cached device functions, once
+# per build after every device and its GDS or OASIS records are written (not after every generated device, the sweep
+# workers would all scan the folder at the same time)
+def evict_device_caches(device_functions):
+
+    for cache_path, max_size in {(device_function.cache_path, device_function.max_size)
+                                 for device_function in device_functions if isinstance(device_function, CachedDevice)}:
+        evict_device_cache(cache_path, max_size)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Manage the on-disk device cache used by design_space.py')
+    parser.add_argument('--clear', action='store_true', help='delete every cached device')
+    parser.add_argument('--cache-path', default=DEVICE_CACHE_PATH, help='cache folder (default: %(default)s)')
+    arguments = parser.parse_args()
+
+    if arguments.clear:
+        clear_device_cache(arguments.cache_path)
+    else:
+        cached = device_cache_entries(arguments.cache_path)
+        print('{0} cached devices, {1} cached GDS/OASIS records, {2:.1f} MB'.format(
+            sum(e.name.endswith('.pkl') for e in cached), sum(e.name.endswith(('.gds', '.oas')) for e in cached),
+            sum(e.stat().st_size for e in cached) / 1024 ** 2))
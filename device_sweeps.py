@@ -0,0 +1,221 @@
+import numpy as np
+
+from components import *
+from parameters import *
+from device_cache import CachedDevice
+from sweep_engine import Sweep, cartesian_grid, combine_grids, zipped_grid
+
+# Load devices which were already generated with the same arguments and parameters from the on-disk cache
+# (python device_cache.py --clear empties it)
+grating_loopback = CachedDevice(grating_loopback)
+directional_coupler = CachedDevice(directional_coupler)
+mmi_1x2 = CachedDevice(mmi_1x2)
+mmi_2x2 = CachedDevice(mmi_2x2)
+ring_resonator = CachedDevice(ring_resonator)
+spiral_loopback = CachedDevice(spiral_loopback)
+mzi_dc = CachedDevice(mzi_dc)
+mzi_dc2 = CachedDevice(mzi_dc2)
+cascaded_mzi_dc = CachedDevice(cascaded_mzi_dc)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+# GENERIC DEVICE SWEEPS -----------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+
+
+########################
+# GRATING LOOPBACK SWEEP
+########################
+
+def grating_sweep():
+
+    # Grating Coupler sweep parameters:
+    # added_waveguide_lengths = [10, 110, 210,250]
+    return Sweep(grating_loopback,
+                 cartesian_grid(added_waveguide_length=range(10, 250, 15),
+                                waveguide_width=[WAVEGUIDE_WIDTH],
+                                period=[GRATING_PERIOD_STANDARD],  # Periods to be swept over
+                                fill_factor=[GRATING_FILL_FACTOR_STANDARD]),  # Fill-factors to be swept over
+                 name='RT_ZL_Grating Loopback\nAdded Length {added_waveguide_length}um\nWidth {waveguide_width}um\nPeriod {period}um\nff {fill_factor}',
+                 device_kwargs=lambda p: dict(coupler_params={
+                                                  'width': p['waveguide_width'],
+                                                  'full_opening_angle': np.deg2rad(GRATING_FAN_ANGLE),
+                                                  'grating_period': p['period'],
+                                                  'grating_ff': p['fill_factor'],
+                                                  'n_gratings': GRATING_NO_PERIODS,
+                                                  'taper_length': GRATING_TAPER_LENGTH
+                                              },
+                                              taper_route=p['added_waveguide_length']))
+
+
+#################
+# TEST STRUCTURES
+#################
+
+def test_structure_gc():
+
+    return Sweep(grating_loopback,
+                 [{}],
+                 name='TEST Grating Loopback\nPeriod {0}um  ff {1}\nGrating Taper Length {2}um'.format(GRATING_PERIOD_STANDARD, GRATING_FILL_FACTOR_STANDARD, GRATING_TAPER_LENGTH),
+                 fixed_kwargs=dict(coupler_params=coupler_params,
+                                   taper_route=GRATING_TAPER_ROUTE))
+
+
+#####################
+# DIRECTIONAL COUPLER
+#####################
+
+def directional_coupler_sweep():
+
+    return Sweep(directional_coupler,
+                 combine_grids(cartesian_grid(gap=[0.25]),
+                               zipped_grid(coupling_length=[1.27],
+                                           coupling_ratio=['90 : 10'])),   # For naming purposes
+                 name='RT_ZL_Directional Coupler  {coupling_ratio}\nGap {gap}um\nCoupling Length {coupling_length}um',
+                 device_kwargs=lambda p: dict(gap=p['gap'], coupling_length=p['coupling_length']),
+                 fixed_kwargs=dict(coupler_params=coupler_params))
+
+
+#########
+# 1x2 MMI
+#########
+
+def mmi_1X2_sweep():
+
+    return Sweep(mmi_1x2,
+                 [{}],
+                 name='1x2 MMI',
+                 fixed_kwargs=dict(coupler_params=coupler_params,
+                                   mmi_length=32.7,
+                                   mmi_width=6,
+                                   mmi_taper_width=1.5,
+                                   mmi_taper_length=20))
+
+
+#########
+# 2x2 MMI
+#########
+
+def mmi_2X2_sweep():
+
+    return Sweep(mmi_2x2,
+                 [{}],
+                 name='2x2 MMI',
+                 fixed_kwargs=dict(coupler_params=coupler_params,
+                                   mmi_length=44.8,
+                                   mmi_width=6,
+                                   mmi_taper_width=1.5,
+                                   mmi_taper_length=20))
+
+
+#######################
+#     MZI Call
+########################
+
+def mzi_sweep():
+
+    return Sweep(mzi_dc,
+                 [{}],
+                 name='MZI',
+                 fixed_kwargs=dict(coupler_params=coupler_params,
+                                   coupling_length=1.27,
+                                   gap=0.25,
+                                   mzi_centre_spacing=75,
+                                   path_length_difference=0))
+
+
+def mzi2_sweep():
+
+    return Sweep(mzi_dc2,
+                 [{}],
+                 name='MZI2',
+                 fixed_kwargs=dict(coupler_params=coupler_params,
+                                   coupling_length=1.27,
+                                   gap=0.25,
+                                   mzi_centre_spacing=75,
+                                   path_length_difference=0))
+
+
+def cascaded_mzi_sweep():
+
+    return Sweep(cascaded_mzi_dc,
+                 [{}],
+                 name='Cascaded MZI',
+                 fixed_kwargs=dict(coupler_params=coupler_params,
+                                   coupling_length=1.27,
+                                   gap=0.25,
+                                   mzi_center_spacing=75,
+                                   path_length_difference=0))
+
+
+######################
+# RING RESONATOR SWEEP
+######################
+
+def ring_sweep():
+
+    return Sweep(ring_resonator,
+                 cartesian_grid(radius=np.linspace(70, 120, 5),    # Ring radii to be swept over (start, stop, no. steps)
+                                gap=np.linspace(0.250, 0.750, 3)),  # Gap sizes to be swept over (start, stop, no. steps)
+                 name='RT_ZL_Ring_Resonator_ZL\nRadius_{radius}\nGap_{gap}',
+                 fixed_kwargs=dict(coupler_params=coupler_params))
+
+
+##############
+# SPIRAL SWEEP
+##############
+
+def spiral_sweep():
+
+    # Sweep parameters:
+    # number_of_loops = [2, 7, 12, 17, 22, 27]
+    return Sweep(spiral_loopback,
+                 cartesian_grid(number=range(2, 28, 3),
+                                gap_size=[10],
+                                inner_gap_size=[15]),
+                 name='RT_ZL_Spiral\nNo._loops_{number}\nGap_between_waveguides_{gap_size}\nInner_circle_radius_{inner_gap_size}',
+                 fixed_kwargs=dict(coupler_params=coupler_params))
+
+
+# The sweeps which can be placed on the chip, by the name they are selected with (python -m design_space --sweeps ...)
+SWEEPS = {
+    'test_gc': test_structure_gc,
+    'grating': grating_sweep,
+    'directional_coupler': directional_coupler_sweep,
+    'mmi_1x2': mmi_1X2_sweep,
+    'mmi_2x2': mmi_2X2_sweep,
+    'mzi': mzi_sweep,
+    'mzi2': mzi2_sweep,
+    'cascaded_mzi': cascaded_mzi_sweep,
+    'ring': ring_sweep,
+    'spiral': spiral_sweep,
+}
+
+# The sweeps placed on the chip by default, in placement order
+DEFAULT_SWEEPS = [
+    # 'test_gc',
+    # 'mmi_1x2',
+    # 'mmi_2x2',
+    # 'directional_coupler',
+    'spiral',
+    'cascaded_mzi',
+    'ring',
+    'grating',
+]
+
+
+# Function which declares the selected sweeps, nothing is generated until their cells are iterated over
+def design_sweeps(names=DEFAULT_SWEEPS):
+
+    unknown = [name for name in names if name not in SWEEPS]
+    if unknown:
+        raise ValueError('Unknown sweeps {0}, choose from {1}'.format(unknown, list(SWEEPS)))
+
+    # The devices of a sweep are named after their parameters, a sweep placed twice would repeat the cell names
+    repeated = sorted({name for name in names if list(names).count(name) > 1})
+    if repeated:
+        raise ValueError('Sweeps {0} are given more than once, each sweep can only be placed once'.format(repeated))
+
+    return [SWEEPS[name]() for name in names]
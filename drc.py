@@ -0,0 +1,353 @@
+import csv
+from collections import Counter, namedtuple
+
+import numpy as np
+from gdshelpers.geometry.shapely_adapter import geometric_union, shapely_collection_to_basic_objs
+from shapely.geometry import Polygon, box
+from shapely.ops import nearest_points, unary_union
+from shapely.prepared import prep
+from shapely.strtree import STRtree
+
+from parameters import *
+
+# ---------------------------------------------------------------------------------------------------------------------
+# DESIGN RULE CHECK ---------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Checks a finished layout against the design rules of parameters.py:
+#
+#   min_width       features narrower than DRC_MIN_WIDTH
+#   min_spacing     gaps narrower than DRC_MIN_SPACING between separate shapes of one device (shapes which touch are
+#                   one shape once written, e.g. a waveguide ending on a grating coupler)
+#   device_spacing  gaps narrower than DRC_DEVICE_SPACING between shapes of neighbouring devices
+#   overlap         shapes of different devices which touch or overlap, on any layer
+#   enclosure       shapes the outer layer of a DRC_ENCLOSURE rule doesn't cover with the required margin
+#   chip_boundary   shapes outside the chip outline
+#
+# The polygons of every layer are loaded into an STRtree, so each polygon is only compared with the polygons near it.
+# Width and spacing within a cell don't depend on where the cell is placed, so they are checked once per cell definition
+# (e.g. once for all copies of a grating coupler) and reported at every placed copy.
+
+# x, y: where the violation is. value: the measured width or gap, for enclosure and chip_boundary violations the area
+# (um^2) outside. cells: the device(s) involved, the sub cells of the checked top cell.
+Violation = namedtuple('Violation', ['rule', 'layer', 'x', 'y', 'value', 'limit', 'cells'])
+
+
+class DRCReport:
+
+    def __init__(self, violations, polygons=0):
+
+        self.violations = violations
+        self.polygons = polygons   # Number of placed polygons checked
+
+    @property
+    def passed(self):
+        return not self.violations
+
+    def counts(self):
+
+        return Counter(violation.rule for violation in self.violations)
+
+    # Function which returns the violation counts and the first max_rows violations as text
+    def report(self, max_rows=20):
+
+        if self.passed:
+            return 'DRC passed, {0} polygons checked'.format(self.polygons)
+
+        lines = ['DRC found {0} violations in {1} polygons: {2}'.format(
+            len(self.violations), self.polygons,
+            ', '.join('{0} {1}'.format(count, rule) for rule, count in sorted(self.counts().items())))]
+        lines.append('{0:<15} {1:<9} {2:>10} {3:>10} {4:>9} {5:>7}  {6}'.format(
+            'Rule', 'Layer', 'x', 'y', 'Value', 'Limit', 'Cells'))
+        for violation in self.violations[:max_rows]:
+            lines.append('{0:<15} {1:<9} {2:>10.3f} {3:>10.3f} {4:>9.3f} {5:>7.3f}  {6}'.format(
+                violation.rule, '{0}/{1}'.format(*violation.layer), violation.x, violation.y, violation.value,
+                violation.limit, violation.cells))
+        if len(self.violations) > max_rows:
+            lines.append('... {0} more'.format(len(self.violations) - max_rows))
+
+        return '\n'.join(lines)
+
+    # Function which saves all violations as CSV, one row per violation
+    def save_csv(self, filename):
+
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['rule', 'layer', 'datatype', 'x', 'y', 'value', 'limit', 'cells'])
+            for violation in self.violations:
+                writer.writerow([violation.rule, violation.layer[0], violation.layer[1], round(violation.x, 3),
+                                 round(violation.y, 3), round(violation.value, 6), violation.limit, violation.cells])
+
+
+# Function which returns every cell placed under top_cell as (cell, transform, device) tuples, top_cell included.
+# transform is the (x, y, angle) of the cell in top_cell coordinates, device the index of the sub cell of top_cell the
+# cell belongs to (None for top_cell itself).
+def cell_instances(cell, transform=(0., 0., 0.), device=None, instances=None):
+
+    instances = [] if instances is None else instances
+    instances.append((cell, transform, device))
+
+    x, y, angle = transform
+    for n, sub_cell in enumerate(cell.cells):
+        spacing = sub_cell['spacing'] or (0, 0)
+        for column in range(sub_cell['columns']):
+            for row in range(sub_cell['rows']):
+                sub_x = sub_cell['origin'][0] + column * spacing[0]
+                sub_y = sub_cell['origin'][1] + row * spacing[1]
+                sub_transform = (x + np.cos(angle) * sub_x - np.sin(angle) * sub_y,
+                                 y + np.sin(angle) * sub_x + np.cos(angle) * sub_y,
+                                 angle + (sub_cell['angle'] or 0))
+                cell_instances(sub_cell['cell'], sub_transform, n if device is None else device, instances)
+
+    return instances
+
+
+# Function which returns the polygons of the geometry a cell holds itself (not that of its sub cells), per layer
+def cell_polygons(cell):
+
+    layers = {}
+    for layer, geometries in cell.layer_dict.items():
+        if layer in DRC_SKIP_LAYERS:
+            continue
+        polygons = layers.setdefault(layer, [])
+        for geometry in geometries:
+            geometry = geometry.get_shapely_object() if hasattr(geometry, 'get_shapely_object') else geometry
+            if type(geometry) in [list, tuple]:
+                geometry = geometric_union(geometry)
+            polygons.extend(polygon for polygon in shapely_collection_to_basic_objs(geometry)
+                            if isinstance(polygon, Polygon) and not polygon.is_empty)
+
+    return layers
+
+
+# Function which returns the exterior and interior coordinates of polygons as numpy arrays
+def polygon_arrays(polygons):
+
+    return [(np.asarray(polygon.exterior.coords), [np.asarray(interior.coords) for interior in polygon.interiors])
+            for polygon in polygons]
+
+
+# Function which returns the (minx, miny, maxx, maxy) bounds of polygons given as polygon_arrays, shape (polygons, 4).
+# Much faster than the bounds of the shapely polygons.
+def array_bounds(arrays):
+
+    return np.array([np.concatenate((exterior.min(axis=0), exterior.max(axis=0))) for exterior, interiors in arrays])
+
+
+# Function which places polygons given as polygon_arrays at a cell transform. Transforming the arrays with numpy is
+# much faster than shapely.affinity, which converts the coordinates of every polygon again.
+def transform_arrays(arrays, transform):
+
+    x, y, angle = transform
+    rotation = np.array(((np.cos(angle), np.sin(angle)), (-np.sin(angle), np.cos(angle))))
+    offset = np.array((x, y))
+    return [(exterior @ rotation + offset, [interior @ rotation + offset for interior in interiors])
+            for exterior, interiors in arrays]
+
+
+# Function which places array_bounds at a cell transform: the bounds of the transformed bounding boxes, which contain
+# the transformed polygons (exactly their bounds if the cell isn't rotated)
+def transform_bounds(bounds, transform):
+
+    x, y, angle = transform
+    corners = bounds[:, [[0, 1], [2, 1], [2, 3], [0, 3]]]
+    rotation = np.array(((np.cos(angle), np.sin(angle)), (-np.sin(angle), np.cos(angle))))
+    corners = corners @ rotation + (x, y)
+    return np.concatenate((corners.min(axis=1), corners.max(axis=1)), axis=1)
+
+
+# Function which returns the pieces of a geometry which are more than DRC_TOLERANCE wide (estimated as
+# 2 * area / perimeter), dropping the slivers left over by floating point noise
+def significant_pieces(geometry):
+
+    return [piece for piece in shapely_collection_to_basic_objs(geometry)
+            if isinstance(piece, Polygon) and piece.length > 0 and 2 * piece.area / piece.length > DRC_TOLERANCE]
+
+
+# Function which returns the parts of the polygons narrower than the min. width of their layer: what is left of a
+# polygon after removing its opening (shrink by half the width, then grow back)
+def width_violations(layer, polygons):
+
+    width = DRC_MIN_WIDTH.get(layer)
+    if not width:
+        return []
+
+    found = []
+    for polygon in polygons:
+        opened = polygon.buffer(-width / 2, join_style=2).buffer(width / 2, join_style=2)
+
+        # The opening is inside the polygon, only a polygon which loses area has narrow parts (the difference of two
+        # nearly identical curved polygons is slow, so it is only computed for those)
+        if polygon.area - opened.area < DRC_TOLERANCE ** 2:
+            continue
+        for piece in significant_pieces(polygon.difference(opened)):
+            point = piece.representative_point()
+            found.append(('min_width', layer, point.x, point.y, 2 * piece.area / piece.length, width, None, None))
+
+    return found
+
+
+# Function which returns the spacing violations between the polygons of a layer. Without owners every pair belongs to
+# one cell; with owners (the cell instance of every polygon) pairs of one instance are skipped, as they were checked
+# with the cell, and devices tells apart the pairs of one device and of neighbouring devices.
+def spacing_violations(layer, polygons, bounds, owners=None, devices=None):
+
+    min_spacing = DRC_MIN_SPACING.get(layer, 0)
+    device_spacing = max(DRC_DEVICE_SPACING.get(layer, 0), min_spacing)
+    if owners is None and not min_spacing:
+        return []
+    search = min_spacing if owners is None else device_spacing
+
+    tree = STRtree(polygons)
+    prepared = {}
+    grown = {}
+    found = []
+    for i, (polygon, (minx, miny, maxx, maxy)) in enumerate(zip(polygons, bounds)):
+        for j in tree.query_items(box(minx - search, miny - search, maxx + search, maxy + search)):
+            if j <= i or (owners is not None and owners[i] == owners[j]):
+                continue
+            same_device = owners is None or devices[i] == devices[j]
+            limit = min_spacing if same_device else device_spacing
+
+            if i not in prepared:
+                prepared[i] = prep(polygon)
+            if prepared[i].intersects(polygons[j]):
+                if not same_device:
+                    point = polygon.intersection(polygons[j]).representative_point()
+                    found.append(('overlap', layer, point.x, point.y, 0.0, 0, i, j))
+                continue
+            if not limit:
+                continue
+
+            # Only measure the gap of pairs closer than the limit
+            if (i, limit) not in grown:
+                grown[i, limit] = prep(polygon.buffer(limit))
+            if not grown[i, limit].intersects(polygons[j]):
+                continue
+            distance = polygon.distance(polygons[j])
+            if DRC_TOLERANCE < distance < limit:
+                point_1, point_2 = nearest_points(polygon, polygons[j])
+                found.append(('min_spacing' if same_device else 'device_spacing', layer, (point_1.x + point_2.x) / 2,
+                              (point_1.y + point_2.y) / 2, distance, limit, i, j))
+
+    return found
+
+
+# Function which returns the polygons of the inner layer of each DRC_ENCLOSURE rule the outer layer doesn't cover
+# with the required margin
+def enclosure_violations(layer_polygons):
+
+    found = []
+    for (inner_layer, outer_layer), margin in DRC_ENCLOSURE.items():
+        outer = layer_polygons.get(outer_layer, [])
+        tree = STRtree(outer) if outer else None
+        for i, polygon in enumerate(layer_polygons.get(inner_layer, [])):
+            required = polygon.buffer(margin, join_style=2) if margin else polygon
+            covering = [outer[j] for j in tree.query_items(required)] if tree is not None else []
+            missing = required.difference(unary_union(covering)) if covering else required
+            pieces = significant_pieces(missing)
+            if pieces:
+                point = pieces[0].representative_point()
+                found.append(('enclosure', inner_layer, point.x, point.y, sum(piece.area for piece in pieces),
+                              margin, i, None))
+
+    return found
+
+
+# Function which returns the polygons which aren't inside the chip outline
+def boundary_violations(layer, polygons, chip_polygon):
+
+    chip = prep(chip_polygon)
+    found = []
+    for i, polygon in enumerate(polygons):
+        if chip.contains(polygon):
+            continue
+        pieces = significant_pieces(polygon.difference(chip_polygon))
+        if pieces:
+            point = pieces[0].representative_point()
+            found.append(('chip_boundary', layer, point.x, point.y, sum(piece.area for piece in pieces), 0, i, None))
+
+    return found
+
+
+# Function which checks the layout under top_cell against the design rules. The sub cells of top_cell are the devices
+# (a device may hold further sub cells, e.g. its grating couplers). chip_polygon is the chip outline, if given every
+# polygon must be inside it. Returns a DRCReport.
+def check_layout(top_cell, chip_polygon=None):
+
+    instances = cell_instances(top_cell)
+    device_names = [sub_cell['cell'].name for sub_cell in top_cell.cells]
+
+    def cells_involved(*devices):
+        names = [top_cell.name if device is None else device_names[device] for device in devices]
+        return ' / '.join(sorted(set(names), key=names.index))
+
+    # Width and spacing inside every cell definition, reported at every copy of the cell
+    polygons_of = {}
+    arrays_of = {}
+    bounds_of = {}
+    placements = {}
+    for cell, transform, device in instances:
+        if cell.name not in polygons_of:
+            polygons_of[cell.name] = cell_polygons(cell)
+            arrays_of[cell.name] = {layer: polygon_arrays(polygons) for layer, polygons in polygons_of[cell.name].items()}
+            bounds_of[cell.name] = {layer: array_bounds(arrays) for layer, arrays in arrays_of[cell.name].items()
+                                    if arrays}
+        placements.setdefault(cell.name, []).append((transform, device))
+
+    violations = []
+    for name, layers in polygons_of.items():
+        found = []
+        for layer, polygons in layers.items():
+            found += width_violations(layer, polygons)
+            if polygons:
+                found += spacing_violations(layer, polygons, bounds_of[name][layer])
+        for rule, layer, x, y, value, limit, _, _ in found:
+            for (instance_x, instance_y, angle), device in placements[name]:
+                violations.append(Violation(rule, layer, instance_x + np.cos(angle) * x - np.sin(angle) * y,
+                                            instance_y + np.sin(angle) * x + np.cos(angle) * y, value, limit,
+                                            cells_involved(device)))
+
+    # Everything else on the placed polygons
+    layer_arrays = {}
+    layer_bounds = {}
+    layer_owners = {}
+    layer_devices = {}
+    for instance, (cell, transform, device) in enumerate(instances):
+        for layer, arrays in arrays_of[cell.name].items():
+            if not arrays:
+                continue
+            layer_arrays.setdefault(layer, []).extend(transform_arrays(arrays, transform))
+            layer_bounds.setdefault(layer, []).append(transform_bounds(bounds_of[cell.name][layer], transform))
+            layer_owners.setdefault(layer, []).extend([instance] * len(arrays))
+            layer_devices.setdefault(layer, []).extend([device] * len(arrays))
+    layer_polygons = {layer: [Polygon(exterior, interiors) for exterior, interiors in arrays]
+                      for layer, arrays in layer_arrays.items()}
+
+    found = enclosure_violations(layer_polygons)
+    for layer, polygons in layer_polygons.items():
+        found += spacing_violations(layer, polygons, np.concatenate(layer_bounds[layer]), layer_owners[layer],
+                                    layer_devices[layer])
+        if chip_polygon is not None:
+            found += boundary_violations(layer, polygons, chip_polygon)
+    for rule, layer, x, y, value, limit, i, j in found:
+        devices = [layer_devices[layer][i]] + ([] if j is None else [layer_devices[layer][j]])
+        violations.append(Violation(rule, layer, x, y, value, limit, cells_involved(*devices)))
+
+    return DRCReport(violations, sum(len(polygons) for polygons in layer_polygons.values()))
+
+
+# Function which checks every die of a reticle (the sub cells of reticle_cell) against its die outline. The violations
+# are given in reticle coordinates, their cells prefixed with the die.
+def check_reticle(reticle_cell, die_outline=None):
+
+    violations = []
+    polygons = 0
+    for die in reticle_cell.cells:
+        report = check_layout(die['cell'], die_outline)
+        violations += [violation._replace(x=violation.x + die['origin'][0], y=violation.y + die['origin'][1],
+                                          cells='{0}: {1}'.format(die['cell'].name, violation.cells))
+                       for violation in report.violations]
+        polygons += report.polygons
+
+    return DRCReport(violations, polygons)
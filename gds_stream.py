@@ -0,0 +1,158 @@
+import datetime
+import os
+from struct import pack
+
+from gdshelpers.geometry.chip import Cell
+from gdshelpers.export.gdsii_export import _real_to_8byte
+
+from labels import cell_to_gdsii_binary
+from vertex_budget import budgeted_fracturing, vertex_budget_key
+
+# ---------------------------------------------------------------------------------------------------------------------
+# STREAMING GDS WRITER ------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Cell.save needs the whole chip in memory, every device cell is fractured and written at the very end. The stream
+# writer instead writes each device cell definition as soon as the device is built, so the device can be dropped
+# straight away, and the top cell at the end only holds references. The records are encoded with the gdshelpers GDSII
+# exporter, so the file is the same as the one Cell.save writes.
+#
+# With a fragment_path, the encoded records of every cached device (cells with a cache_key, see device_cache.py) are
+# kept there too. When the layout is rebuilt, the records of the devices whose inputs didn't change are copied into
+# the new file as they are, and only the changed devices are fractured and encoded again.
+#
+# The file format is in header, encode and footer, the OASIS writer (oasis_export.py) streams the same way.
+
+GDS_LIBRARY_NAME = 'gdshelpers_exported_library'
+
+
+class GDSStreamWriter:
+
+    fragment_extension = '.gds'
+
+    def __init__(self, filename, unit=1e-6, grid_steps_per_unit=1000, max_points=4000, max_line_points=4000,
+                 fragment_path=None):
+
+        self.filename = filename
+        self.unit = unit
+        self.grid_steps_per_unit = grid_steps_per_unit
+        self.max_points = max_points
+        self.max_line_points = max_line_points
+        self.timestamp = datetime.datetime.now()
+        self.written = set()    # Names of the cells already in the file
+        self.fragment_path = fragment_path
+        self.spliced = 0        # Number of cells copied from the fragment cache
+        self.encoded = 0        # Number of cells encoded from their geometry
+
+        # Write to a temporary file, an interrupted build never leaves a half written GDS behind
+        self.temp_filename = '{0}.{1}.tmp'.format(filename, os.getpid())
+        self.file = open(self.temp_filename, 'wb')
+        self.file.write(self.header())
+
+    # Function which returns the records the file starts with
+    def header(self):
+
+        grid_step_unit = self.unit / self.grid_steps_per_unit
+        name = GDS_LIBRARY_NAME + '\0' * (len(GDS_LIBRARY_NAME) % 2)  # Strings always have even length
+
+        return (pack('>3H', 6, 0x0002, 0x258) +  # HEADER v6.0
+                pack('>14H', 28, 0x0102, *self.timestamp.timetuple()[:6] * 2) +  # BGNLIB
+                pack('>2H', 4 + len(name), 0x0206) + name.encode('ascii') +  # LIBNAME
+                pack('>2H', 20, 0x0305) + _real_to_8byte(grid_step_unit / self.unit) + _real_to_8byte(grid_step_unit))
+
+    # Function which returns the records of a cell definition, its polygons fractured within the vertex budget
+    def encode(self, cell):
+
+        with budgeted_fracturing():
+            return cell_to_gdsii_binary(cell, self.grid_steps_per_unit, self.max_points, self.max_line_points,
+                                        self.timestamp)
+
+    # Function which returns the records the file ends with
+    def footer(self):
+
+        return pack('>2H', 4, 0x0400)  # ENDLIB
+
+    # Function which writes the definition of a cell and of the sub cells which aren't in the file yet (e.g. the grating
+    # coupler library cells are written once, with the first device using them)
+    def write_cell(self, cell):
+
+        if cell.name in self.written:
+            raise AssertionError('Each cell name must be unique, "{}" is used more than once'.format(cell.name))
+
+        self.written.add(cell.name)
+        for sub_cell in cell.cells:
+            if sub_cell['cell'].name not in self.written:
+                self.write_cell(sub_cell['cell'])
+
+        fragment_file = self.fragment_file(cell)
+        if fragment_file is not None and os.path.exists(fragment_file):
+            with open(fragment_file, 'rb') as f:
+                self.file.write(f.read())
+            os.utime(fragment_file)  # Mark as recently used for the cache eviction
+            self.spliced += 1
+            return
+
+        binary = self.encode(cell)
+        self.file.write(binary)
+        self.encoded += 1
+
+        if fragment_file is not None:
+            temp_file = '{0}.{1}.tmp'.format(fragment_file, os.getpid())
+            with open(temp_file, 'wb') as f:
+                f.write(binary)
+            os.replace(temp_file, fragment_file)
+
+    # Function which returns the file the encoded records of a cell are kept in, None for cells which aren't cached.
+    # The export settings and the vertex budget are part of the name, they change the records.
+    def fragment_file(self, cell):
+
+        cache_key = getattr(cell, 'cache_key', None)
+        if self.fragment_path is None or cache_key is None:
+            return None
+
+        os.makedirs(self.fragment_path, exist_ok=True)
+
+        return os.path.join(self.fragment_path, '{0}_{1}_{2}_{3}_{4}{5}'.format(
+            cache_key, self.grid_steps_per_unit, self.max_points, self.max_line_points, vertex_budget_key(),
+            self.fragment_extension))
+
+    # Function which returns an empty stand-in for a cell already written, so a top cell can reference it without the
+    # device geometry being kept in memory
+    def reference(self, name):
+
+        if name not in self.written:
+            raise KeyError('Cell "{}" has not been written yet'.format(name))
+
+        return Cell(name)
+
+    # Function which writes the top cell (its own geometry and references to the cells written before) and finishes
+    # the file
+    def close(self, top_cell=None):
+
+        if top_cell is not None:
+            for sub_cell in top_cell.cells:
+                if sub_cell['cell'].name not in self.written:
+                    self.write_cell(sub_cell['cell'])
+            self.written.add(top_cell.name)
+            self.file.write(self.encode(top_cell))
+
+        self.file.write(self.footer())
+        self.file.close()
+        os.replace(self.temp_filename, self.filename)
+
+    # Function which closes and deletes the unfinished file, e.g. after an exception during the build
+    def abort(self):
+
+        self.file.close()
+        os.remove(self.temp_filename)
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        if exc_type is not None:
+            self.abort()
+        elif not self.file.closed:
+            self.close()
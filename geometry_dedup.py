@@ -0,0 +1,120 @@
+import hashlib
+from collections import Counter
+
+import numpy as np
+from gdshelpers.geometry.chip import Cell
+from gdshelpers.geometry.shapely_adapter import shapely_collection_to_basic_objs
+from shapely.affinity import rotate, translate
+
+from parameters import *
+
+# ---------------------------------------------------------------------------------------------------------------------
+# GEOMETRY DEDUPLICATION ----------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+
+# The device functions add their components (waveguides, directional couplers, MMIs, rings, spirals) to the device cell
+# as flat geometry, so the six identical directional couplers of a cascaded MZI or the identical routing of every
+# device of a sweep are all written out in full. Before saving, every component is moved into the frame of its own
+# start port (origin at the port, port pointing along x) and its polygons are hashed on the GDS grid. Components with
+# the same hash are replaced by references to one shared cell holding the geometry once.
+#
+# Only the components are deduplicated, the device functions stay as they are. Labels and plain shapely geometry have
+# no port frame and are left in place.
+
+DEDUP_GRID_STEPS = 1000     # Grid steps per um the canonical polygons are hashed on (the GDS grid)
+
+
+# Function which returns the (origin, angle) frame of a component, None for components without one
+def component_frame(part):
+
+    port = getattr(part, '_origin_port', None)     # Ring resonators, spirals
+    if port is None and getattr(part, '_segments', None):
+        port = part._segments[0][0]                # Waveguides, the port they start at
+    if port is not None:
+        return tuple(port.origin), port.angle
+
+    if hasattr(part, '_origin') and hasattr(part, '_angle'):
+        return tuple(part._origin), part._angle     # Directional couplers, MMIs
+
+    return None
+
+
+# Function which returns the geometry of a component in its own frame and the hash of its polygons on the GDS grid
+def canonical_geometry(geometry, origin, angle, grid_steps=DEDUP_GRID_STEPS):
+
+    geometry = rotate(translate(geometry, -origin[0], -origin[1]), -angle, origin=(0, 0), use_radians=True)
+
+    digest = hashlib.sha1()
+    for polygon in shapely_collection_to_basic_objs(geometry):
+        for ring in [polygon.exterior] + list(polygon.interiors):
+            digest.update(np.round(np.asarray(ring.coords) * grid_steps).astype(np.int64).tobytes())
+        digest.update(b'|')
+
+    return geometry, digest.hexdigest()
+
+
+class GeometryDeduplicator:
+
+    def __init__(self):
+
+        self.shared_cells = {}  # (layer, hash): shared cell, the same cells are used for every layout of the build
+        self.replaced = 0       # Number of components replaced by a reference
+        self.seen = Counter()   # (layer, hash): occurrences in the cells deduplicated before
+
+    # Function which returns the components of a cell which can be deduplicated as
+    # (layer, index in the layer, geometry, geometry in its frame, hash, part name, origin, angle)
+    @staticmethod
+    def components(cell):
+
+        found = []
+        for layer, geometries in cell.layer_dict.items():
+            for index, part in enumerate(geometries):
+                frame = component_frame(part)
+                if frame is None:
+                    continue
+                geometry = part.get_shapely_object()
+                found.append((layer, index, geometry) + canonical_geometry(geometry, *frame) +
+                             (type(part).__name__,) + frame)
+
+        return found
+
+    # Function which replaces the components occurring at least min_repeats times across the cells (and the cells
+    # deduplicated before, e.g. the devices already streamed) by references to shared cells. The other components are
+    # replaced by their geometry, so it isn't generated again when saving.
+    def deduplicate(self, cells, min_repeats=2):
+
+        cells = list(cells)
+        cell_components = [self.components(cell) for cell in cells]
+        counts = Counter((component[0], component[4]) for components in cell_components for component in components)
+        counts.update(self.seen)
+        self.seen.update((component[0], component[4]) for components in cell_components for component in components)
+
+        for cell, components in zip(cells, cell_components):
+            removed = set()
+            for layer, index, geometry, canonical, geometry_hash, part_name, origin, angle in components:
+                key = (layer, geometry_hash)
+                if counts[key] < min_repeats and key not in self.shared_cells:
+                    cell.layer_dict[layer][index] = geometry
+                    continue
+
+                if key not in self.shared_cells:
+                    shared_cell = Cell('{0}_{1}'.format(part_name, geometry_hash[:16]))
+                    shared_cell.add_to_layer(layer, canonical)
+                    # The hash addresses the content, so the streaming writer can cache the records of the cell
+                    shared_cell.cache_key = 'dedup_{0}_{1}_{2}'.format(layer[0], layer[1], geometry_hash)
+                    self.shared_cells[key] = shared_cell
+                cell.add_cell(self.shared_cells[key], origin=origin, angle=angle)
+                removed.add((layer, index))
+                self.replaced += 1
+
+            for layer in {layer for layer, index in removed}:
+                cell.layer_dict[layer] = [geometry for index, geometry in enumerate(cell.layer_dict[layer])
+                                          if (layer, index) not in removed]
+
+            # The GDS records of a cached device change with the references (which components are replaced depends on
+            # the cells deduplicated before), the streaming writer caches them apart
+            if removed and getattr(cell, 'cache_key', None) is not None:
+                cell.cache_key = '{0}_dedup{1}'.format(
+                    cell.cache_key, hashlib.sha1(repr(sorted(removed)).encode()).hexdigest()[:8])
+
+        return cells
@@ -0,0 +1,169 @@
+import csv
+from collections import Counter, namedtuple
+
+import numpy as np
+
+from parameters import *
+
+# ---------------------------------------------------------------------------------------------------------------------
+# GRATING ALIGNMENT ---------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+
+# All grating couplers of a device are probed at once by a fibre array (VGA) of VGA_NUM_CHANNELS fibres, GRATING_PITCH
+# apart. Relative to the first coupler of its device (channel 0), every coupler port must be:
+#
+#   row             on the same row (no y offset)
+#   pitch           a whole number of GRATING_PITCH away
+#   channels        within VGA_NUM_CHANNELS channels of the lowest channel of the device
+#   shared channel  the only coupler of the device on its channel
+#
+# The ports of every device on the chip are checked together in one vectorized pass. Offsets within
+# GRATING_ALIGNMENT_TOLERANCE count as aligned, so floating point noise isn't reported.
+
+# device: the device name, port: the index of the coupler in its device, x/y: the port position, x_offset: the distance
+# from the nearest pitch position, y_offset: the distance from the row, channel: the nearest fibre channel
+AlignmentViolation = namedtuple('AlignmentViolation',
+                                ['device', 'port', 'x', 'y', 'x_offset', 'y_offset', 'channel', 'problem'])
+
+
+# Raised by a strict build when couplers are misaligned, holds the AlignmentReport
+class GratingAlignmentError(Exception):
+
+    def __init__(self, report):
+
+        super().__init__('{0} grating alignment violations'.format(len(report.violations)))
+        self.report = report
+
+
+class AlignmentReport:
+
+    def __init__(self, violations, ports=0, devices=0):
+
+        self.violations = violations
+        self.ports = ports        # Number of coupler ports checked
+        self.devices = devices    # Number of devices they belong to
+
+    @property
+    def passed(self):
+        return not self.violations
+
+    def counts(self):
+
+        return Counter(violation.problem for violation in self.violations)
+
+    # Function which returns the violation counts and the first max_rows violations as text
+    def report(self, max_rows=20):
+
+        if self.passed:
+            return 'Grating alignment passed, {0} coupler ports of {1} devices checked'.format(self.ports,
+                                                                                             self.devices)
+
+        lines = ['Grating alignment found {0} violations in {1} ports of {2} devices: {3}'.format(
+            len(self.violations), self.ports, self.devices,
+            ', '.join('{0} {1}'.format(count, problem) for problem, count in sorted(self.counts().items())))]
+        lines.append('{0:<40} {1:>4} {2:>10} {3:>10} {4:>9} {5:>9} {6:>7}  {7}'.format(
+            'Device', 'Port', 'x', 'y', 'x offset', 'y offset', 'Channel', 'Problem'))
+        for violation in self.violations[:max_rows]:
+            lines.append('{0:<40} {1:>4} {2:>10.3f} {3:>10.3f} {4:>9.3f} {5:>9.3f} {6:>7}  {7}'.format(
+                violation.device.replace('\n', ' ')[:40], violation.port, violation.x, violation.y,
+                violation.x_offset, violation.y_offset, violation.channel, violation.problem))
+        if len(self.violations) > max_rows:
+            lines.append('... {0} more'.format(len(self.violations) - max_rows))
+
+        return '\n'.join(lines)
+
+    # Function which saves all violations as CSV, one row per violation
+    def save_csv(self, filename):
+
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(AlignmentViolation._fields)
+            for violation in self.violations:
+                writer.writerow([violation.device, violation.port, round(violation.x, 3), round(violation.y, 3),
+                                 round(violation.x_offset, 6), round(violation.y_offset, 6), violation.channel,
+                                 violation.problem])
+
+
+# Function which checks the alignment of coupler ports. device_index gives the device of each port (an index into
+# device_names), ports the (x, y) port positions in the order the couplers were placed. Returns the violations.
+def alignment_violations(device_names, device_index, ports, pitch=GRATING_PITCH, channels=VGA_NUM_CHANNELS,
+                         tolerance=GRATING_ALIGNMENT_TOLERANCE):
+
+    device_index = np.asarray(device_index, dtype=int)
+    ports = np.reshape(np.asarray(ports, dtype=float), (-1, 2))
+    if not len(ports):
+        return []
+
+    # The first port of each device is its reference, channel 0
+    devices, first, inverse = np.unique(device_index, return_index=True, return_inverse=True)
+    offset = ports - ports[first][inverse]
+    channel = np.rint(offset[:, 0] / pitch).astype(int)
+    x_offset = offset[:, 0] - channel * pitch
+    y_offset = offset[:, 1]
+
+    # Index of every port within its device, in placement order
+    order = np.argsort(inverse, kind='stable')
+    group_start = np.searchsorted(inverse[order], inverse[order])
+    port_number = np.empty(len(ports), dtype=int)
+    port_number[order] = np.arange(len(ports)) - group_start
+
+    lowest_channel = np.full(len(devices), np.iinfo(int).max)
+    np.minimum.at(lowest_channel, inverse, channel)
+
+    aligned = np.abs(x_offset) <= tolerance
+    _, first_on_channel = np.unique(np.column_stack((inverse, channel))[aligned], axis=0, return_index=True)
+    shared = aligned.copy()
+    shared[np.flatnonzero(aligned)[first_on_channel]] = False
+
+    problems = [('row', np.abs(y_offset) > tolerance),
+                ('pitch', ~aligned),
+                ('channels', channel - lowest_channel[inverse] >= channels),
+                ('shared channel', shared)]
+
+    found = sorted(((device_index[i], port_number[i], n, i) for n, (problem, mask) in enumerate(problems)
+                    for i in np.flatnonzero(mask)))
+
+    return [AlignmentViolation(device_names[device_index[i]], int(port_number[i]), float(ports[i, 0]),
+                               float(ports[i, 1]), float(x_offset[i]), float(y_offset[i]), int(channel[i]),
+                               problems[n][0])
+            for _, _, n, i in found]
+
+
+# Function which returns the port positions of the grating couplers in a device cell (the references to coupler
+# library cells, in the order they were added), in the coordinates of the cell
+def coupler_ports(cell, origin=(0., 0.), angle=0.):
+
+    from components import CORNERSTONE_GRATING_CELL_PREFIX
+
+    ports = []
+    for sub_cell in cell.cells:
+        sub_x, sub_y = sub_cell['origin']
+        sub_origin = (origin[0] + np.cos(angle) * sub_x - np.sin(angle) * sub_y,
+                      origin[1] + np.sin(angle) * sub_x + np.cos(angle) * sub_y)
+        if sub_cell['cell'].name.startswith(CORNERSTONE_GRATING_CELL_PREFIX):
+            ports.append(sub_origin)   # The coupler port is at the origin of the coupler cell
+        else:
+            ports.extend(coupler_ports(sub_cell['cell'], sub_origin, angle + (sub_cell['angle'] or 0)))
+
+    return ports
+
+
+# Function which returns (name, coupler ports) of every device placed in top_cell (its sub cells), in top_cell
+# coordinates shifted by origin
+def layout_devices(top_cell, origin=(0., 0.), prefix=''):
+
+    return [(prefix + sub_cell['cell'].name,
+             coupler_ports(sub_cell['cell'], np.add(origin, sub_cell['origin']), sub_cell['angle'] or 0.))
+            for sub_cell in top_cell.cells]
+
+
+# Function which checks the couplers of all devices on a chip, given as (name, coupler ports) pairs. Returns an
+# AlignmentReport.
+def check_alignment(devices):
+
+    devices = [(name, ports) for name, ports in devices if len(ports)]
+    device_names = [name for name, ports in devices]
+    device_index = np.concatenate([[n] * len(ports) for n, (name, ports) in enumerate(devices)]) if devices else []
+    ports = np.concatenate([np.reshape(ports, (-1, 2)) for name, ports in devices]) if devices else []
+
+    return AlignmentReport(alignment_violations(device_names, device_index, ports), len(ports), len(devices))
@@ -0,0 +1,183 @@
+from contextlib import contextmanager
+from functools import lru_cache
+from struct import pack
+
+import numpy as np
+import shapely.affinity
+import shapely.ops
+from gdshelpers.export.gdsii_export import _cell_to_gdsii_binary as gdsii_cell_binary, _real_to_8byte
+from gdshelpers.geometry.chip import Cell
+from gdshelpers.parts import _fonts
+from gdshelpers.parts.text import Text
+from shapely.geometry import MultiPolygon, Polygon
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# DEVICE LABELS -------------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+
+# The gdshelpers Text renders every character of a label from the font strokes and unions the whole label, so each
+# device label costs tens of ms and a few thousand vertices. Label renders the same text from glyph polygons cached
+# per (font, character, height, angle), each glyph a pre-translated copy. Before saving, place_labels replaces the
+# labels of a cell depending on the label mode (design_space.LABEL_MODE):
+#
+#   'glyphs'    references to one cell per glyph, so every glyph is written to the GDS file once
+#   'text'      GDS TEXT records, one per line of the label (annotation only, not fabricated)
+#   'polygons'  nothing, the labels are written as polygons like the gdshelpers Text
+
+
+# Function which returns the polygon of a glyph with its origin at the centre of the character base line, rotated by
+# angle
+@lru_cache(maxsize=None)
+def glyph_polygon(font, char, height, angle=0.):
+
+    glyph = shapely.ops.unary_union([Polygon(np.array(line).T * height) for line in _fonts.FONTS[font][char]['lines']])
+
+    return shapely.affinity.rotate(glyph, angle, origin=(0, 0), use_radians=True) if angle else glyph
+
+
+# Function which returns the cell holding a glyph on a layer, each glyph cell is shared by every label using it
+@lru_cache(maxsize=None)
+def glyph_cell(font, char, height, layer):
+
+    cell = Cell('GLYPH_{0}_{1}_{2:g}_{3}_{4}'.format(font, ord(char), height, *layer))
+    cell.add_to_layer(layer, glyph_polygon(font, char, height))
+    cell.cache_key = cell.name  # The name says everything about the glyph, the streaming writer can cache it
+
+    return cell
+
+
+# Text with the same layout as the gdshelpers Text (alignment, kerning, line spacing), made from cached glyphs
+class Label(Text):
+
+    # Function which returns the lines of the label as (line, x, y) and the characters as (character, x, y), at the
+    # positions in the cell their glyphs (centre of the base line) and lines (left end of the base line) are placed at
+    def layout(self):
+
+        font = _fonts.FONTS[self.font]
+        lines = [(0., 0.)]
+        characters = []
+        max_x = 0
+        cursor_x, cursor_y = 0, 0
+        for i, char in enumerate(self.text):
+            if char == '\n':
+                cursor_x, cursor_y = 0, cursor_y - self.line_spacing
+                lines.append((cursor_x, cursor_y))
+                continue
+
+            assert char in font, 'Character "%s" is not supported by font "%s"' % (char, self.font)
+            char_font = font[char]
+            cursor_x += char_font['width'] / 2 * self.height
+            characters.append((cursor_x, cursor_y))
+
+            if i < len(self.text) - 1 and self.text[i + 1] != '\n':
+                cursor_x += (char_font['width'] / 2 + char_font['kerning'][self.text[i + 1]]) * self.height
+
+            max_x = max(max_x, cursor_x + char_font['width'] / 2 * self.height)
+
+        # Align, rotate and move the positions as the gdshelpers Text moves its polygons
+        offset = self._alignment.calculate_offset(np.array([[0, max_x], [cursor_y, self.height]]).T)
+        cos, sin = np.cos(self.angle), np.sin(self.angle)
+        positions = (np.reshape(lines + characters, (-1, 2)) + offset) @ np.array([[cos, sin], [-sin, cos]])
+        positions += self.origin
+
+        return (list(zip(self.text.split('\n'), *positions[:len(lines)].T)),
+                list(zip(self.text.replace('\n', ''), *positions[len(lines):].T)))
+
+    def get_shapely_object(self):
+
+        if not self.text or self.true_bbox_alignment:
+            return super().get_shapely_object()
+
+        if self._shapely_object:
+            return self._shapely_object
+
+        polygons = []
+        for char, x, y in self.layout()[1]:
+            glyph = glyph_polygon(self.font, char, self.height, self.angle)
+            if not glyph.is_empty:
+                glyph = shapely.affinity.translate(glyph, x, y)
+                polygons.extend(getattr(glyph, 'geoms', [glyph]))
+
+        self._shapely_object = MultiPolygon(polygons)
+        self._bbox = np.array(self._shapely_object.bounds).reshape(2, 2)
+
+        return self._shapely_object
+
+
+# Function which replaces the labels (Label or gdshelpers Text) of a cell by references to glyph cells or by TEXT
+# records, depending on the mode (see above). The TEXT records are kept in cell.text_records as
+# (layer, line, origin, height, angle).
+def place_labels(cell, mode='glyphs'):
+
+    if mode == 'polygons':
+        return cell
+
+    placed = set()
+    for layer, geometries in cell.layer_dict.items():
+        for label in geometries:
+            if not isinstance(label, Text) or label.true_bbox_alignment or not label.text:
+                continue
+
+            lines, characters = Label.layout(label)
+            if mode == 'text':
+                if not hasattr(cell, 'text_records'):
+                    cell.text_records = []
+                cell.text_records.extend((layer, line, (x, y), label.height, label.angle) for line, x, y in lines)
+            else:
+                for char, x, y in characters:
+                    if _fonts.FONTS[label.font][char]['lines']:
+                        cell.add_cell(glyph_cell(label.font, char, label.height, layer), origin=(x, y),
+                                      angle=label.angle or None)
+            placed.add(id(label))
+
+    if placed:
+        for layer, geometries in cell.layer_dict.items():
+            cell.layer_dict[layer] = [geometry for geometry in geometries if id(geometry) not in placed]
+        # The GDS records of a cached device change with the labels, the streaming writer caches them apart
+        if getattr(cell, 'cache_key', None) is not None:
+            cell.cache_key = '{0}_{1}'.format(cell.cache_key, mode)
+
+    return cell
+
+
+# Function which returns the GDS TEXT records of a cell (see place_labels)
+def text_records(cell, grid_steps_per_unit):
+
+    records = []
+    for layer, line, origin, height, angle in getattr(cell, 'text_records', []):
+        line = line + '\0' * (len(line) % 2)  # Strings always have even length
+        records.append(pack('>2H', 4, 0x0C00))  # TEXT
+        records.append(pack('>6H', 6, 0x0D02, layer[0], 6, 0x1602, layer[1]))  # LAYER, TEXTTYPE
+        records.append(pack('>3H', 6, 0x1A01, 0) + pack('>2H', 12, 0x1B05) + _real_to_8byte(height))  # STRANS, MAG
+        if angle:
+            records.append(pack('>2H', 12, 0x1C05) + _real_to_8byte(np.rad2deg(angle) % 360.))  # ANGLE
+        records.append(pack('>2H', 12, 0x1003) + np.round(np.array(origin) * grid_steps_per_unit).astype('>i4').tobytes())
+        records.append(pack('>2H', 4 + len(line), 0x1906) + line.encode('ascii'))  # STRING
+        records.append(pack('>2H', 4, 0x1100))  # ENDEL
+
+    return b''.join(records)
+
+
+# Function which encodes a cell like the gdshelpers GDSII exporter and adds its TEXT records
+def cell_to_gdsii_binary(cell, grid_steps_per_unit, max_points, max_line_points, timestamp):
+
+    binary = gdsii_cell_binary(cell, grid_steps_per_unit, max_points, max_line_points, timestamp)
+    records = text_records(cell, grid_steps_per_unit)
+
+    return binary[:-4] + records + binary[-4:] if records else binary  # Before ENDSTR
+
+
+# Context manager which makes Cell.save write the TEXT records of the cells too, the gdshelpers encoder is restored when
+# it exits
+@contextmanager
+def label_records():
+
+    from gdshelpers.export import gdsii_export
+
+    original = gdsii_export._cell_to_gdsii_binary
+    gdsii_export._cell_to_gdsii_binary = cell_to_gdsii_binary
+    try:
+        yield
+    finally:
+        gdsii_export._cell_to_gdsii_binary = original
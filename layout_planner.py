@@ -0,0 +1,117 @@
+from collections import namedtuple
+
+import numpy as np
+
+from parameters import *
+
+# ---------------------------------------------------------------------------------------------------------------------
+# LAYOUT PLANNER ------------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Packs device footprints onto the chip with a bottom-left skyline algorithm. The skyline is kept as a height map with
+# PLANNER_RESOLUTION um columns, and devices are only placed with their origin (the first grating coupler port) on
+# the GRATING_PITCH grid, so every grating coupler on the chip lines up with the VGA fibre pitch.
+
+PLANNER_RESOLUTION = 1  # um
+
+# index: position of the device in the list of footprints, origin: where to place the device cell
+Placement = namedtuple('Placement', ['index', 'origin', 'bounds'])
+
+
+class LayoutPlan:
+
+    def __init__(self, placements, overflow, footprints, chip_width, chip_height):
+
+        self.placements = placements    # Placements of the devices that fit, in the order they were placed
+        self.overflow = overflow        # Indices of the devices that did not fit on the chip
+        self.chip_width = chip_width
+        self.chip_height = chip_height
+
+        device_area = sum((footprints[p.index][2] - footprints[p.index][0]) *
+                          (footprints[p.index][3] - footprints[p.index][1]) for p in placements)
+        self.used_height = max([p.bounds[3] for p in placements], default=0)
+        self.utilization = device_area / (chip_width * chip_height)
+        self.packing_density = device_area / (chip_width * self.used_height) if self.used_height else 0
+
+    # Function which summarizes the plan in a few lines
+    def report(self):
+
+        lines = ['Placed {0} devices, {1} did not fit'.format(len(self.placements), len(self.overflow)),
+                 'Used height {0:.0f} of {1} um'.format(self.used_height, self.chip_height),
+                 'Chip utilization {0:.1%} (packing density {1:.1%} of the used height)'.format(self.utilization,
+                                                                                              self.packing_density)]
+
+        return '\n'.join(lines)
+
+
+# Function which plans the position of every device. footprints are the (xmin, ymin, xmax, ymax) bounds of the devices
+# relative to their own origin, e.g. cell.bounds or the estimates from components.estimate_bounds.
+def plan_layout(footprints,
+                chip_width=CHIP_WIDTH,
+                chip_height=CHIP_HEIGHT,
+                horizontal_spacing=CELL_HORIZONTAL_SPACING,
+                vertical_spacing=CELL_VERTICAL_SPACING,
+                column_pitch=GRATING_PITCH,
+                sort=True):
+
+    footprints = [tuple(bounds) for bounds in footprints]
+    skyline = np.zeros(int(np.ceil(chip_width / PLANNER_RESOLUTION)))
+
+    # Place the tallest devices first, they are the hardest to fit. Python's sort is stable, so equally tall
+    # devices keep their sweep order.
+    order = range(len(footprints))
+    if sort:
+        order = sorted(order, key=lambda i: footprints[i][1] - footprints[i][3])
+
+    placements = []
+    overflow = []
+    for index in order:
+        xmin, ymin, xmax, ymax = footprints[index]
+
+        # Origins on the column pitch which keep the device (plus spacing on the right) inside the chip
+        first_column = int(np.ceil(-xmin / column_pitch))
+        last_column = int(np.floor((chip_width - xmax - horizontal_spacing) / column_pitch))
+
+        best = None
+        for column in range(first_column, last_column + 1):
+            origin_x = column * column_pitch
+            start = int(np.floor((origin_x + xmin) / PLANNER_RESOLUTION))
+            stop = int(np.ceil((origin_x + xmax + horizontal_spacing) / PLANNER_RESOLUTION))
+            y = skyline[start:stop].max()
+            if best is None or y < best[0]:
+                best = (y, origin_x, start, stop)
+
+        if best is None or best[0] + (ymax - ymin) > chip_height:
+            overflow.append(index)
+            continue
+
+        y, origin_x, start, stop = best
+        skyline[start:stop] = y + (ymax - ymin) + vertical_spacing
+        origin = (origin_x, y - ymin)
+        placements.append(Placement(index, origin, (origin_x + xmin, y, origin_x + xmax, y + ymax - ymin)))
+
+    return LayoutPlan(placements, overflow, footprints, chip_width, chip_height)
+
+
+# Function which splits more devices than fit on one chip across as many dies as needed (at most max_dies), filling
+# each die with the planner before starting the next one. Returns one LayoutPlan per die, with indices into the full
+# list of footprints, and the indices of the devices that did not fit on any die.
+def plan_dies(footprints, max_dies=None, **plan_kwargs):
+
+    footprints = [tuple(bounds) for bounds in footprints]
+    remaining = list(range(len(footprints)))
+
+    plans = []
+    while remaining and (max_dies is None or len(plans) < max_dies):
+        plan = plan_layout([footprints[i] for i in remaining], **plan_kwargs)
+
+        # A device larger than the die would never fit, don't keep adding empty dies
+        if not plan.placements:
+            break
+
+        plan.placements = [placement._replace(index=remaining[placement.index]) for placement in plan.placements]
+        plan.overflow = [remaining[i] for i in plan.overflow]
+        plans.append(plan)
+        remaining = plan.overflow
+
+    return plans, remaining
@@ -0,0 +1,305 @@
+import hashlib
+import zlib
+from struct import pack
+
+import numpy as np
+from shapely.geometry import LineString, Polygon
+
+from gds_stream import GDSStreamWriter
+from vertex_budget import budgeted_fracturing
+
+# ---------------------------------------------------------------------------------------------------------------------
+# OASIS WRITER --------------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+
+# OASIS (SEMI P39) holds the same cell hierarchy as GDSII in far fewer bytes: integers have variable length, polygons
+# are stored as vertex deltas, identical elements are stored once with a repetition and the elements of every cell are
+# deflate compressed in a CBLOCK. The OASIS writer streams the cells like the GDS writer (see gds_stream.py), only the
+# records differ:
+#
+#   - references to the same cell with the same rotation (the grating couplers of a device on the GRATING_PITCH grid,
+#     the glyphs of a label, cell arrays) are one PLACEMENT with a repetition
+#   - identical polygons (same layer and shape) of a cell are one POLYGON with a repetition, duplicates in the same
+#     place are written once
+#   - cells and references are given by name, the records of a cell don't depend on the rest of the file and are kept
+#     in the fragment cache like the GDS records. OASIS names only hold printable ASCII without spaces, so the device
+#     names (which hold spaces and line breaks) are written as cell_name returns them
+#   - labels kept as TEXT records (see labels.py) are OASIS TEXT records, which have no height or rotation
+
+OASIS_MAGIC = b'%SEMI-OASIS\r\n'
+OASIS_COMPRESSION_LEVEL = 6     # zlib level of the CBLOCKs, 0 writes the cells uncompressed
+SHORT_ARRAY = 64                # Arrays shorter than this are encoded value by value, numpy is slower for them
+
+
+# Function which encodes a non-negative integer as an OASIS unsigned integer (7 bits per byte, lowest first)
+def unsigned(value):
+
+    encoded = bytearray()
+    while value > 0x7f:
+        encoded.append(value & 0x7f | 0x80)
+        value >>= 7
+    encoded.append(value)
+
+    return bytes(encoded)
+
+
+# Function which encodes an integer as an OASIS signed integer (the sign in the lowest bit)
+def signed(value):
+
+    return unsigned(abs(value) << 1 | (value < 0))
+
+
+# Function which encodes a real number, integers exactly and everything else as an IEEE double
+def real(value):
+
+    if float(value).is_integer():
+        return unsigned(0 if value >= 0 else 1) + unsigned(abs(int(value)))
+
+    return unsigned(7) + pack('<d', value)
+
+
+def string(value):
+
+    value = value.encode('ascii')
+
+    return unsigned(len(value)) + value
+
+
+# Function which returns the OASIS name of a cell, an n-string (printable ASCII 0x21-0x7E): whitespace and every other
+# character are replaced by '_'. A name which had to change gets a hash of the original name, so two names which only
+# differ in those characters stay apart.
+def cell_name(name):
+
+    sanitized = ''.join(char if '!' <= char <= '~' else '_' for char in name)
+    if sanitized == name and name:
+        return name
+
+    return '{0}_{1}'.format(sanitized, hashlib.sha1(name.encode('utf-8')).hexdigest()[:8])
+
+
+# Function which encodes an array of non-negative integers as OASIS unsigned integers
+def unsigned_array(values):
+
+    values = np.asarray(values, dtype=np.int64).reshape(-1, 1)
+    if len(values) < SHORT_ARRAY:
+        return b''.join(unsigned(value) for value in values.ravel().tolist())
+
+    # 7 bit groups of every value, as many as the largest value needs, with the continuation bit on all but the last
+    shifts = 7 * np.arange(max(1, (int(values.max()).bit_length() + 6) // 7), dtype=np.int64)
+    groups = (values >> shifts) & 0x7f
+    more = (values >> (shifts + 7)) > 0
+    used = np.ones_like(more)
+    used[:, 1:] = more[:, :-1]
+
+    return (groups | more << 7)[used].astype(np.uint8).tobytes()
+
+
+# Function which encodes a displacement as an OASIS g-delta, horizontal and vertical ones in one integer (form 1, east,
+# north, west or south), the others in two (form 2)
+def g_delta(dx, dy):
+
+    if dy == 0:
+        return unsigned(abs(dx) << 4 | (2 if dx < 0 else 0) << 1)
+    if dx == 0:
+        return unsigned(abs(dy) << 4 | (3 if dy < 0 else 1) << 1)
+
+    return unsigned(abs(dx) << 2 | (dx < 0) << 1 | 1) + signed(dy)
+
+
+# Function which encodes an array of displacements as g-deltas (see g_delta), short arrays one by one
+def g_deltas(deltas):
+
+    deltas = np.asarray(deltas, dtype=np.int64).reshape(-1, 2)
+    if len(deltas) < SHORT_ARRAY:
+        return b''.join(g_delta(dx, dy) for dx, dy in deltas.tolist())
+
+    dx, dy = deltas.T
+    horizontal = dy == 0
+    vertical = (dx == 0) & ~horizontal
+
+    first = np.abs(dx) << 2 | (dx < 0) << 1 | 1
+    first = np.where(horizontal, np.abs(dx) << 4 | np.where(dx < 0, 2, 0) << 1, first)
+    first = np.where(vertical, np.abs(dy) << 4 | np.where(dy < 0, 3, 1) << 1, first)
+    second = np.abs(dy) << 1 | (dy < 0)
+
+    values = np.column_stack((first, second))[np.column_stack((np.ones_like(horizontal), ~(horizontal | vertical)))]
+
+    return unsigned_array(values)
+
+
+# Function which encodes a point list (type 4, g-deltas between successive points) of points relative to the first one
+def point_list(points):
+
+    deltas = np.diff(points, axis=0)
+
+    return unsigned(4) + unsigned(len(deltas)) + g_deltas(deltas)
+
+
+# Function which returns the first of a set of positions and the repetition placing an element at all of them, None
+# for a single position. Rows, columns and lattices with a uniform spacing get the short repetition types.
+def repetition(positions):
+
+    positions = sorted({(int(x), int(y)) for x, y in positions})
+    if len(positions) == 1:
+        return positions[0], None
+
+    xs, ys = sorted({x for x, y in positions}), sorted({y for x, y in positions})
+    x_spaces, y_spaces = [b - a for a, b in zip(xs, xs[1:])], [b - a for a, b in zip(ys, ys[1:])]
+    if len(xs) * len(ys) == len(positions) and len(set(x_spaces)) <= 1 and len(set(y_spaces)) <= 1:
+        if len(ys) == 1:
+            encoded = unsigned(2) + unsigned(len(xs) - 2) + unsigned(x_spaces[0])     # Uniform row
+        elif len(xs) == 1:
+            encoded = unsigned(3) + unsigned(len(ys) - 2) + unsigned(y_spaces[0])     # Uniform column
+        else:
+            encoded = (unsigned(1) + unsigned(len(xs) - 2) + unsigned(len(ys) - 2) +       # Uniform lattice
+                       unsigned(x_spaces[0]) + unsigned(y_spaces[0]))
+        return (xs[0], ys[0]), encoded
+
+    if len(ys) == 1:
+        encoded = unsigned(4) + unsigned(len(xs) - 2) + unsigned_array(x_spaces)          # Irregular row
+    elif len(xs) == 1:
+        encoded = unsigned(5) + unsigned(len(ys) - 2) + unsigned_array(y_spaces)          # Irregular column
+    else:
+        encoded = unsigned(10) + unsigned(len(positions) - 2) + g_deltas(np.diff(positions, axis=0))
+    return positions[0], encoded
+
+
+# Function which returns the records of an element with the X, Y and R bits (xy_bits, r_bit) of its info byte
+def placed_element(record_id, info, fields, positions, xy_bits, r_bit):
+
+    (x, y), repeated = repetition(positions)
+    info |= xy_bits | (r_bit if repeated is not None else 0)
+
+    return unsigned(record_id) + bytes([info]) + fields + signed(int(x)) + signed(int(y)) + (repeated or b'')
+
+
+class OASISStreamWriter(GDSStreamWriter):
+
+    fragment_extension = '_n.oas'   # Records with the names of cell_name
+
+    def __init__(self, filename, unit=1e-6, grid_steps_per_unit=1000, max_points=4000, max_line_points=4000,
+                 fragment_path=None, compression_level=OASIS_COMPRESSION_LEVEL):
+
+        self.compression_level = compression_level
+        self.names = {}     # OASIS name: name of the cell written with it
+        # The cached records are compressed, they are only copied into files written at the same level
+        self.fragment_extension = '_z{0}{1}'.format(compression_level, self.fragment_extension)
+        super().__init__(filename, unit, grid_steps_per_unit, max_points, max_line_points, fragment_path)
+
+    # Function which returns the OASIS name of a cell written to the file, checking no other cell has it
+    def oasis_name(self, cell):
+
+        name = cell_name(cell.name)
+        if self.names.setdefault(name, cell.name) != cell.name:
+            raise AssertionError('Cells "{0}" and "{1}" are both named "{2}" in OASIS'.format(
+                self.names[name], cell.name, name))
+
+        return name
+
+    def write_cell(self, cell):
+
+        self.oasis_name(cell)
+        super().write_cell(cell)
+
+    # Function which returns the magic bytes and the START record (version, database units per micron, empty tables)
+    def header(self):
+
+        return OASIS_MAGIC + unsigned(1) + string('1.0') + real(self.grid_steps_per_unit * (1e-6 / self.unit)) + \
+            unsigned(0) + unsigned(0) * 12
+
+    # Function which returns the CELL record of a cell and its elements, compressed in a CBLOCK
+    def encode(self, cell):
+
+        with budgeted_fracturing():
+            elements = self.polygon_records(cell) + self.placement_records(cell) + self.text_records(cell)
+        records = unsigned(14) + string(self.oasis_name(cell))  # CELL by name
+        if not elements or not self.compression_level:
+            return records + elements
+
+        compressor = zlib.compressobj(self.compression_level, zlib.DEFLATED, -15)  # Raw deflate, no zlib header
+        compressed = compressor.compress(elements) + compressor.flush()
+
+        return records + unsigned(34) + unsigned(0) + unsigned(len(elements)) + unsigned(len(compressed)) + compressed
+
+    # Function which returns the END record, padded to 256 bytes, without validation
+    def footer(self):
+
+        return unsigned(2) + string(' ' * 252) + unsigned(0)
+
+    # Function which returns the POLYGON and PATH records of a cell, one POLYGON with a repetition per shape
+    def polygon_records(self, cell):
+
+        records = []
+        for layer, geometries in cell.get_fractured_layer_dict(self.max_points, self.max_line_points).items():
+            layer, datatype = (layer, 0) if isinstance(layer, int) else layer
+            layer_fields = unsigned(layer) + unsigned(datatype)
+
+            shapes = {}
+            for geometry in geometries:
+                if isinstance(geometry, Polygon):
+                    if geometry.interiors:
+                        raise AssertionError('OASIS polygons are written without holes, fracture them first')
+                    points = np.round(np.asarray(geometry.exterior.coords)[:-1] * self.grid_steps_per_unit)
+                    points = points.astype(np.int64)
+                    shapes.setdefault(point_list(points), []).append(points[0])
+
+                elif isinstance(geometry, LineString):
+                    points = np.round(np.asarray(geometry.coords) * self.grid_steps_per_unit).astype(np.int64)
+                    half_width = round(getattr(geometry, 'width', 0) * self.grid_steps_per_unit / 2)
+                    # Flush ends like a GDS PATH of type 0
+                    records.append(placed_element(22, 0x80 | 0x40 | 0x20 | 0x02 | 0x01,
+                                                  layer_fields + unsigned(half_width) + unsigned(0b0101) +
+                                                  point_list(points), [points[0]], 0x18, 0x04))
+
+            for shape, positions in shapes.items():
+                records.append(placed_element(21, 0x20 | 0x02 | 0x01, layer_fields + shape, positions, 0x18, 0x04))
+
+        return b''.join(records)
+
+    # Function which returns the PLACEMENT records of a cell, one PLACEMENT with a repetition per referenced cell and
+    # transformation. Cell arrays are placed as repetitions too.
+    def placement_records(self, cell):
+
+        placements = {}
+        for ref in cell.cells:
+            angle = np.rad2deg(ref['angle']) % 360. if ref['angle'] is not None else 0.
+            key = (cell_name(ref['cell'].name), round(angle, 9), ref['magnification'], ref['x_reflection'])
+            positions = placements.setdefault(key, [])
+
+            x, y = ref['origin']
+            spacing = ref['spacing'] or (0, 0)
+            for column in range(ref['columns']):
+                for row in range(ref['rows']):
+                    positions.append((round((x + column * spacing[0]) * self.grid_steps_per_unit),
+                                      round((y + row * spacing[1]) * self.grid_steps_per_unit)))
+
+        records = []
+        for (name, angle, magnification, x_reflection), positions in placements.items():
+            quarter_turns = angle / 90.
+            if magnification is None and quarter_turns == round(quarter_turns):
+                info = 0x80 | int(round(quarter_turns)) % 4 << 1 | x_reflection  # Cell by name, rotation in AA
+                records.append(placed_element(17, info, string(name), positions, 0x30, 0x08))
+            else:
+                fields = string(name) + real(1 if magnification is None else magnification) + real(angle)
+                records.append(placed_element(18, 0x80 | 0x04 | 0x02 | x_reflection, fields, positions,
+                                              0x30, 0x08))
+
+        return b''.join(records)
+
+    # Function which returns the TEXT records of the labels kept as text (see labels.place_labels)
+    def text_records(self, cell):
+
+        records = []
+        for (layer, datatype), line, origin, height, angle in getattr(cell, 'text_records', []):
+            position = np.round(np.asarray(origin) * self.grid_steps_per_unit)
+            records.append(placed_element(19, 0x40 | 0x02 | 0x01, string(line) + unsigned(layer) + unsigned(datatype),
+                                          [position], 0x18, 0x04))
+
+        return b''.join(records)
+
+
+# Function which saves a cell and every cell it references as OASIS, the OASIS counterpart of Cell.save
+def save_oasis(cell, filename, unit=1e-6, grid_steps_per_unit=1000, max_points=4000, max_line_points=4000):
+
+    with OASISStreamWriter(filename, unit, grid_steps_per_unit, max_points, max_line_points) as oasis:
+        oasis.close(cell)
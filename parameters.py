@@ -19,17 +19,26 @@ CHIP_WIDTH = 6000
 CELL_VERTICAL_SPACING = 20
 CELL_HORIZONTAL_SPACING = 10
 
+RETICLE_COLUMNS = 2         # Dies per row of the reticle
+RETICLE_DIE_SPACING = 500   # Dicing lane between the dies of the reticle
+
 LABEL_ORIGIN = [90, -385]
 LABEL_ORIGIN_HORIZONTAL = [-300, -110]
 LABEL_HEIGHT = 10
 LABEL_ANGLE_VERTICAL = np.pi / 2
 LABEL_ANGLE_HORIZONTAL = 0
+LABEL_CHARACTER_WIDTH = 0.8  # Approx. character advance as a fraction of the label height (for footprint estimates)
+LABEL_LINE_SPACING = 1.5
+
+GEOMETRY_BACKEND = 'numpy'  # 'numpy' (vectorized coupler and spiral geometry) or 'gdshelpers' (the gdshelpers parts)
+SPIRAL_PIECE_POINTS = 1000  # Max. points along one polygon piece of a numpy spiral (GDS polygons hold up to 4000)
 
 WAVEGUIDE_WIDTH = 0.5
 BEND_RADIUS = 25
 WG_TAPER_LENGTH = 10
 WG_TAPER_WIDTH = 0.2
 WG_MIN_SPACING = 10
+DC_BEND_ANGLE = np.pi / 5  # S-bend angle of the gdshelpers DirectionalCoupler (its default)
 
 VGA_NUM_CHANNELS = 8
 
@@ -55,6 +64,9 @@ GRATING_NO_PERIODS = 60
 GRATING_TAPER_LENGTH = 350
 GRATING_TAPER_ROUTE = 10
 GRATING_PITCH = 127
+GRATING_ALIGNMENT_TOLERANCE = 0.001  # Max. coupler offset from the VGA pitch and row still counted as aligned
+
+GRATING_GEOMETRY_CACHE_SIZE = 64  # Max. number of distinct grating coupler geometries kept in memory
 
 GRATING_COUPLER_TOTAL_LENGTH = GRATING_TAPER_LENGTH + GRATING_NO_PERIODS*GRATING_PERIOD_STANDARD - GRATING_PERIOD_STANDARD*(1 - GRATING_FILL_FACTOR_STANDARD)
 GRATING_COUPLER_END_WIDTH = GRATING_COUPLER_TOTAL_LENGTH*(np.sin(GRATING_FAN_ANGLE * pi/180))#GRATING_COUPLER_WIDTH
@@ -115,6 +127,55 @@ RING_RADIUS = 9.75  # NEEDS TO BE CHANGED FOR SiN
 SPIRAL_GAP = 5      # NEEDS TO BE CHANGED FOR SiN
 SPIRAL_INNER_GAP = 50
 
+##############
+# DESIGN RULES
+##############
+DRC_MIN_WIDTH = {WAVEGUIDE_LAYER: 0.15, GRATING_LAYER: 0.15}    # Min. feature width per layer
+DRC_MIN_SPACING = {WAVEGUIDE_LAYER: 0.15, GRATING_LAYER: 0.15}  # Min. gap between shapes of one device
+DRC_DEVICE_SPACING = {WAVEGUIDE_LAYER: WG_MIN_SPACING}          # Min. gap between shapes of neighbouring devices
+DRC_ENCLOSURE = {}  # {(inner layer, outer layer): min. margin by which the outer layer must enclose the inner layer}
+DRC_SKIP_LAYERS = [CELL_OUTLINE_LAYER]  # Layers which aren't checked at all
+DRC_TOLERANCE = 0.001  # Gaps and slivers below the GDS grid are ignored
+
+###############
+# VERTEX BUDGET
+###############
+CURVE_MAX_DEVIATION = {WAVEGUIDE_LAYER: 1, GRATING_LAYER: 1,     # Max. deviation (nm) of simplified curves, per layer
+                       SUS_ETCH_LAYER: 1, SLAB_PROTECTION_LAYER: 1}
+MAX_POLYGON_VERTICES = {}   # Max. vertices per polygon, per layer (default: the max_points of the export, 4000)
+GDS_MAX_VERTICES = 8190     # GDSII limit for one polygon, larger polygons are always fractured
+CURVE_CORNER_ANGLE = np.deg2rad(10)  # Vertices turning by more than this are corners and never simplified away
+
+################
+# DERIVED LAYERS
+################
+# (derived layer, layers grown, grown by (um), layers cut out of it), evaluated in this order, so a rule can use the
+# layers derived before it (see derived_layers.py)
+DERIVED_LAYERS = [
+    (SLAB_PROTECTION_LAYER, [GRATING_LAYER], SUPPORT_GAP, []),  # The grating couplers stay on the slab
+    (SUS_ETCH_LAYER, [WAVEGUIDE_LAYER], SUPPORT_GAP, [WAVEGUIDE_LAYER, SLAB_PROTECTION_LAYER]),  # Trench beside the WGs
+]
+DERIVED_TILE_SIZE = 500         # Tiles the layout is split into for the derived layers (um)
+DERIVED_BUFFER_RESOLUTION = 4   # Segments per quarter circle of the grown corners
+
+#########
+# PREVIEW
+#########
+PREVIEW_LAYER_COLOURS = {                       # RGB colour of every layer in the raster preview, drawn in this order
+    CELL_OUTLINE_LAYER: (160, 160, 160),
+    SLAB_PROTECTION_LAYER: (120, 200, 120),
+    SUS_ETCH_LAYER: (190, 150, 220),
+    WAVEGUIDE_LAYER: (30, 90, 200),
+    GRATING_LAYER: (220, 60, 40),
+    HEATER_FILAMENT_LAYER: (240, 150, 30),
+    HEATER_CONTACT_PAD_LAYER: (200, 170, 40),
+    LABEL_LAYER: (60, 60, 60),
+}
+PREVIEW_DEFAULT_COLOUR = (120, 120, 120)        # Layers without a colour
+PREVIEW_OPACITY = 0.75                          # Opacity of the filled layers, overlaps stay visible
+PREVIEW_OUTLINE_LAYERS = [CELL_OUTLINE_LAYER]   # Layers drawn as outlines only
+PREVIEW_TOLERANCE = 0.05                        # Polygons are simplified to within this (um), below a tile pixel
+
 ##########################
 # HARRY'S BRAGG PARAMETERS
 ##########################
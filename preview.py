@@ -0,0 +1,207 @@
+import zlib
+from struct import pack
+
+import numpy as np
+from gdshelpers.geometry.shapely_adapter import shapely_collection_to_basic_objs
+
+from parameters import *
+
+# ---------------------------------------------------------------------------------------------------------------------
+# RASTER PREVIEW ------------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Cell.show plots every polygon with matplotlib, which takes minutes for a whole chip. The raster preview flattens the
+# cell hierarchy once into the polygon edges of every layer (each cell's polygons are simplified to within
+# PREVIEW_TOLERANCE and their edges extracted once, then transformed with numpy for every reference), then fills every
+# layer with a vectorized scanline fill:
+#
+#   - every edge gives its crossings with the pixel row centres it spans, with +1/-1 for its direction
+#   - sorted by row and x, the running sum of the directions is the winding number right of every crossing, the spans
+#     with a non-zero winding number are inside (overlapping polygons stay filled, holes stay empty)
+#   - the spans are filled as a difference image summed along the rows
+#
+# The edges are drawn on top, so features narrower than a pixel (the waveguides of a whole chip preview) are still
+# visible. Layers are coloured with PREVIEW_LAYER_COLOURS and the image is saved as PNG with zlib only. Zoomed tiles of
+# any window are rendered from the same flattened edges.
+
+
+# Function which returns the edges (start points, end points) of every layer of a cell's own geometry, exteriors
+# counterclockwise and holes clockwise
+def cell_edges(cell, tolerance=PREVIEW_TOLERANCE):
+
+    edges = {}
+    for layer, geometries in cell.layer_dict.items():
+        rings = []
+        for geometry in geometries:
+            geometry = geometry.get_shapely_object() if hasattr(geometry, 'get_shapely_object') else geometry
+            for polygon in shapely_collection_to_basic_objs(geometry):
+                if polygon.is_empty or not hasattr(polygon, 'exterior'):
+                    continue
+                polygon = polygon.simplify(tolerance, preserve_topology=False) if tolerance else polygon
+                if polygon.is_empty or not hasattr(polygon, 'exterior'):
+                    continue
+                for index, ring in enumerate([polygon.exterior] + list(polygon.interiors)):
+                    points = np.asarray(ring.coords)[:, :2]
+                    area = np.sum(points[:-1, 0] * points[1:, 1] - points[1:, 0] * points[:-1, 1])
+                    rings.append(points[::-1] if (area < 0) == (index == 0) else points)
+
+        if rings:
+            starts = np.concatenate([ring[:-1] for ring in rings])
+            ends = np.concatenate([ring[1:] for ring in rings])
+            edges[layer] = (starts, ends)
+
+    return edges
+
+
+# Function which returns the edges of every layer of a cell and all cells it references, in the coordinates of the
+# cell. Each cell's own edges are only extracted once.
+def flatten_edges(cell, matrix=np.eye(2), offset=np.zeros(2), edges=None, cell_edge_cache=None):
+
+    edges = {} if edges is None else edges
+    cell_edge_cache = {} if cell_edge_cache is None else cell_edge_cache
+
+    if id(cell) not in cell_edge_cache:
+        cell_edge_cache[id(cell)] = cell_edges(cell)
+    for layer, (starts, ends) in cell_edge_cache[id(cell)].items():
+        starts, ends = starts @ matrix.T + offset, ends @ matrix.T + offset
+        # A mirroring transformation turns every ring around, turn it back so the winding numbers keep their sign
+        edges.setdefault(layer, []).append((ends, starts) if np.linalg.det(matrix) < 0 else (starts, ends))
+
+    for ref in cell.cells:
+        angle = ref['angle'] or 0
+        magnification = ref['magnification'] or 1
+        ref_matrix = magnification * np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        if ref['x_reflection']:
+            ref_matrix = ref_matrix @ np.diag([1, -1])
+
+        spacing = ref['spacing'] or (0, 0)
+        for column in range(ref['columns']):
+            for row in range(ref['rows']):
+                origin = np.asarray(ref['origin'], dtype=float) + (column * spacing[0], row * spacing[1])
+                flatten_edges(ref['cell'], matrix @ ref_matrix, matrix @ origin + offset, edges, cell_edge_cache)
+
+    return edges
+
+
+# Function which returns the mask of the pixels inside the polygons given by their edges (in pixel coordinates, rows
+# counted from the bottom), by scanline filling with the non-zero winding rule
+def fill_mask(starts, ends, height, width):
+
+    mask = np.zeros(height * (width + 1), dtype=np.int64)
+    (xa, ya), (xb, yb) = starts.T, ends.T
+    sloped = ya != yb
+    xa, ya, xb, yb = xa[sloped], ya[sloped], xb[sloped], yb[sloped]
+
+    # The rows whose centre (row + 0.5) each edge crosses, from the lower to the upper end of the edge
+    first_row = np.clip(np.ceil(np.minimum(ya, yb) - 0.5), 0, height).astype(np.int64)
+    last_row = np.clip(np.ceil(np.maximum(ya, yb) - 0.5), 0, height).astype(np.int64)
+    counts = last_row - first_row
+    if not counts.sum():
+        return mask.reshape(height, width + 1)[:, :width] > 0
+
+    edge = np.repeat(np.arange(len(counts)), counts)
+    rows = first_row[edge] + np.arange(len(edge)) - np.repeat(np.cumsum(counts) - counts, counts)
+    x = xa[edge] + (rows + 0.5 - ya[edge]) * (xb[edge] - xa[edge]) / (yb[edge] - ya[edge])
+    direction = np.where(yb[edge] > ya[edge], 1, -1)
+
+    # The winding number of every row returns to zero at its last crossing, so one running sum serves all rows
+    order = np.lexsort((x, rows))
+    rows, x = rows[order], x[order]
+    inside = np.flatnonzero(np.cumsum(direction[order])[:-1] != 0)
+
+    span_starts = np.clip(np.ceil(x[inside] - 0.5), 0, width).astype(np.int64)
+    span_ends = np.clip(np.ceil(x[inside + 1] - 0.5), 0, width).astype(np.int64)
+    row_start = rows[inside] * (width + 1)
+    mask += np.bincount(row_start + span_starts, minlength=len(mask))
+    mask -= np.bincount(row_start + span_ends, minlength=len(mask))
+
+    return np.cumsum(mask.reshape(height, width + 1), axis=1)[:, :width] > 0
+
+
+# Function which returns the mask of the pixels the edges (in pixel coordinates) pass through, sampled at least once
+# per pixel along every edge. The end of an edge is the start of the next one, only the starts are sampled.
+def outline_mask(starts, ends, height, width):
+
+    mask = np.zeros(height * width, dtype=bool)
+    samples = np.maximum(np.ceil(np.max(np.abs(ends - starts), axis=1)), 1).astype(np.int64)
+    edge = np.repeat(np.arange(len(samples)), samples)
+    t = (np.arange(len(edge)) - np.repeat(np.cumsum(samples) - samples, samples)) / samples[edge]
+    points = np.floor(starts[edge] + (ends[edge] - starts[edge]) * t[:, None]).astype(np.int64)
+
+    inside = (points[:, 0] >= 0) & (points[:, 0] < width) & (points[:, 1] >= 0) & (points[:, 1] < height)
+    mask[points[inside, 1] * width + points[inside, 0]] = True
+
+    return mask.reshape(height, width)
+
+
+# Function which writes an RGB image (rows from the top) as PNG
+def write_png(filename, image, compression_level=6):
+
+    height, width = image.shape[:2]
+    rows = np.hstack((np.zeros((height, 1), dtype=np.uint8), image.reshape(height, -1)))  # Filter type 0 per row
+
+    def chunk(kind, data):
+        return pack('>I', len(data)) + kind + data + pack('>I', zlib.crc32(kind + data))
+
+    with open(filename, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', pack('>2I5B', width, height, 8, 2, 0, 0, 0)))  # 8 bit RGB
+        f.write(chunk(b'IDAT', zlib.compress(rows.tobytes(), compression_level)))
+        f.write(chunk(b'IEND', b''))
+
+
+class LayoutPreview:
+
+    def __init__(self, cell):
+
+        self.edges = {layer: (np.concatenate([starts for starts, ends in parts]),
+                              np.concatenate([ends for starts, ends in parts]))
+                      for layer, parts in flatten_edges(cell).items()}
+        self.bounds = cell.bounds   # The window of the whole layout
+
+    # Function which returns the RGB image (rows from the top) of a window (x0, y0, x1, y1) of the layout, by default
+    # the whole layout, at resolution um per pixel
+    def render(self, window=None, resolution=2.):
+
+        x0, y0, x1, y1 = self.bounds if window is None else window
+        width, height = max(1, int(np.ceil((x1 - x0) / resolution))), max(1, int(np.ceil((y1 - y0) / resolution)))
+
+        image = np.full((height, width, 3), 255, dtype=np.float32)
+        layers = [layer for layer in PREVIEW_LAYER_COLOURS if layer in self.edges]
+        layers += sorted(layer for layer in self.edges if layer not in PREVIEW_LAYER_COLOURS)
+        for layer in layers:
+            starts, ends = self.edges[layer]
+
+            # Only the edges of the rows in the window, the ones left or right of it still count for the winding
+            keep = (np.maximum(starts[:, 1], ends[:, 1]) >= y0) & (np.minimum(starts[:, 1], ends[:, 1]) <= y1)
+            starts = (starts[keep] - (x0, y0)) / resolution
+            ends = (ends[keep] - (x0, y0)) / resolution
+
+            mask = outline_mask(starts, ends, height, width)
+            if layer not in PREVIEW_OUTLINE_LAYERS:
+                mask |= fill_mask(starts, ends, height, width)
+
+            colour = np.array(PREVIEW_LAYER_COLOURS.get(layer, PREVIEW_DEFAULT_COLOUR), dtype=np.float32)
+            image[mask] += PREVIEW_OPACITY * (colour - image[mask])
+
+        return np.round(image[::-1]).astype(np.uint8)
+
+    # Function which saves the preview of a window of the layout (by default all of it) as PNG
+    def save(self, filename, window=None, resolution=2.):
+
+        write_png(filename, self.render(window, resolution))
+
+    # Function which saves zoomed tiles of tile_size um covering the layout (or the window) as PNG files
+    # <base>_<column>_<row>.png, row 0 at the bottom. Returns the file names.
+    def save_tiles(self, base, tile_size=500., resolution=0.25, window=None):
+
+        x0, y0, x1, y1 = self.bounds if window is None else window
+        filenames = []
+        for column, tile_x in enumerate(np.arange(x0, x1, tile_size)):
+            for row, tile_y in enumerate(np.arange(y0, y1, tile_size)):
+                filename = '{0}_{1}_{2}.png'.format(base, column, row)
+                self.save(filename, (tile_x, tile_y, min(tile_x + tile_size, x1), min(tile_y + tile_size, y1)),
+                          resolution)
+                filenames.append(filename)
+
+        return filenames
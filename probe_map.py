@@ -0,0 +1,78 @@
+import csv
+import os
+
+import numpy as np
+
+from parameters import *
+
+# ---------------------------------------------------------------------------------------------------------------------
+# PROBE MAP -----------------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+
+# The probe station measures a device by landing the fibre array (VGA) on its grating couplers. The probe map lists the
+# absolute position of every coupler port on the chip, one row per port, grouped by device (in placement order) and
+# sorted by VGA channel within each device, so a test run can step from device to device without manual alignment.
+#
+#   device        the device (cell) name, newlines replaced by spaces
+#   device_index  the index of the device in the probe map
+#   die           the die of a reticle (0 on a single chip)
+#   channel       the fibre of the VGA above the port, 0 for the lowest channel of the device
+#   port          the index of the coupler in its device, in the order the couplers were added
+#   x, y          the port position in the top cell of the GDS (the chip or the reticle)
+#   die_x, die_y  the port position on its die (the same as x, y on a single chip)
+#
+# Maps ending in .parquet are written with pyarrow (if it is installed), everything else as CSV.
+
+PROBE_MAP_FIELDS = ['device', 'device_index', 'die', 'channel', 'port', 'x', 'y', 'die_x', 'die_y']
+
+
+# Function which returns the probe map rows of the devices on one die, given as (name, coupler ports) pairs with the
+# ports in top cell coordinates (see grating_alignment.layout_devices). die_origin is the position of the die in the
+# top cell, first_index the device_index of the first device.
+def probe_rows(devices, die=0, die_origin=(0., 0.), first_index=0, pitch=GRATING_PITCH):
+
+    rows = []
+    for n, (name, ports) in enumerate((name, ports) for name, ports in devices if len(ports)):
+        ports = np.reshape(np.asarray(ports, dtype=float), (-1, 2))
+        channels = np.rint((ports[:, 0] - ports[0, 0]) / pitch).astype(int)
+        channels -= channels.min()
+        for port in np.lexsort((np.arange(len(ports)), channels)):
+            x, y = ports[port]
+            rows.append([name.replace('\n', ' '), first_index + n, die, int(channels[port]), int(port),
+                         round(float(x), 3), round(float(y), 3),
+                         round(float(x - die_origin[0]), 3), round(float(y - die_origin[1]), 3)])
+
+    return rows
+
+
+# Function which returns the probe map rows of a reticle, die by die, from the dies referenced by reticle_cell
+def reticle_probe_rows(reticle_cell):
+
+    from grating_alignment import layout_devices
+
+    rows = []
+    for die, die_reference in enumerate(reticle_cell.cells):
+        rows.extend(probe_rows(layout_devices(die_reference['cell'], die_reference['origin']), die,
+                               die_reference['origin'], first_index=rows[-1][1] + 1 if rows else 0))
+
+    return rows
+
+
+# Function which writes the probe map rows as CSV, or as Parquet if the filename ends in .parquet
+def save_probe_map(rows, filename):
+
+    if os.path.splitext(filename)[1].lower() == '.parquet':
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('Saving the probe map as Parquet needs pyarrow, save it as .csv instead')
+
+        columns = list(zip(*rows)) if rows else [[] for _ in PROBE_MAP_FIELDS]
+        pyarrow.parquet.write_table(pyarrow.table(dict(zip(PROBE_MAP_FIELDS, columns))), filename)
+        return
+
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(PROBE_MAP_FIELDS)
+        writer.writerows(rows)
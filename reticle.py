@@ -0,0 +1,127 @@
+import csv
+from concurrent.futures import ProcessPoolExecutor
+
+from gdshelpers.geometry.chip import Cell
+
+from build_profiler import PROFILE
+from components import intern_coupler_cells
+from layout_planner import plan_dies, plan_layout
+from parameters import *
+from sweep_executor import SWEEP_WORKERS
+
+# ---------------------------------------------------------------------------------------------------------------------
+# MULTI-DIE RETICLE ---------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+
+# When the sweeps hold more devices than fit on one chip, they are split across several CHIP_WIDTH x CHIP_HEIGHT dies.
+# The devices are assigned to the dies from their footprint estimates (no geometry needed), then every die is built
+# and packed in its own process and the dies are referenced once each from a reticle cell. Devices which turn out not
+# to fit their die once built (the estimate was too small) are moved to new dies, planned from their real bounds.
+# Devices which fit no die (or not within max_dies) are dropped, they are listed in the manifest without a position.
+
+
+# Function run in the worker processes, builds the devices of one die and packs them with their real bounds.
+# devices is a list of (device_function, device_kwargs), the devices which don't fit are returned with their bounds.
+def build_die(job):
+
+    die_name, devices, outline = job
+    PROFILE.reset()
+
+    device_cells = [device_function(**device_kwargs) for device_function, device_kwargs in devices]
+    plan = plan_layout([device_cell.bounds for device_cell in device_cells])
+
+    die_cell = Cell(die_name)
+    for placement in plan.placements:
+        die_cell.add_cell(device_cells[placement.index], origin=placement.origin)
+    if outline is not None:
+        die_cell.add_to_layer(CELL_OUTLINE_LAYER, outline)
+
+    placed = [(devices[p.index][1]['name'], tuple(p.origin)) for p in plan.placements]
+    overflow = [(devices[i], device_cells[i].bounds) for i in plan.overflow]
+
+    return die_cell, placed, overflow, PROFILE.records
+
+
+# Function which returns the origin of the n-th die on the reticle, filling RETICLE_COLUMNS dies per row
+def die_origin(n, columns=RETICLE_COLUMNS, die_spacing=RETICLE_DIE_SPACING):
+
+    return ((n % columns) * (CHIP_WIDTH + die_spacing),
+            (n // columns) * (CHIP_HEIGHT + die_spacing))
+
+
+# Function which builds the dies of the jobs (see build_die), in parallel if there are several
+def build_dies(jobs, workers=SWEEP_WORKERS):
+
+    if workers == 1 or len(jobs) < 2:
+        # build_die resets the profile of the process it runs in, keep the records made so far
+        profile_records = dict(PROFILE.records)
+        dies = [build_die(job) for job in jobs]
+        PROFILE.records = profile_records
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            dies = list(executor.map(build_die, jobs))
+
+    return dies
+
+
+# Function which splits the devices of the sweeps across dies, builds the dies in parallel and references each die
+# once from the reticle cell. Returns the reticle cell and the manifest rows
+# (device, die, x and y on the die, x and y on the reticle), the dropped devices have None for the die and position.
+def populate_reticle(sweeps, outline=None, max_dies=None, workers=SWEEP_WORKERS,
+                     cell_name='Reticle_University_of_Bristol_Nanofab_2024_RT_ZL',
+                     die_name='Cell{}_University_of_Bristol_Nanofab_2024_RT_ZL'):
+
+    devices = [(sweep.device_function, sweep.kwargs_for(params)) for sweep in sweeps for params in sweep.grid]
+    footprints = [bounds for sweep in sweeps for bounds in sweep.estimate_bounds()]
+
+    plans, unassigned = plan_dies(footprints, max_dies=max_dies)
+    dropped = [devices[index] for index in unassigned]
+    jobs = [(die_name.format(n), [devices[p.index] for p in plan.placements], outline) for n, plan in enumerate(plans)]
+
+    dies = []
+    while jobs:
+        built = build_dies(jobs, workers)
+        dies.extend(built)
+
+        # The devices which didn't fit the die they were assigned to go on new dies, planned from their real bounds
+        overflow = []
+        for die_cell, placed, die_overflow, die_profile_records in built:
+            for (device_function, device_kwargs), bounds in die_overflow:
+                print(" \n WARNING: {0} did not fit on {1}, moved to a new die \n ".format(device_kwargs['name'],
+                                                                                       die_cell.name))
+            overflow.extend(die_overflow)
+        plans, unassigned = plan_dies([bounds for device, bounds in overflow],
+                                      max_dies=None if max_dies is None else max_dies - len(dies))
+        dropped.extend(overflow[index][0] for index in unassigned)
+        jobs = [(die_name.format(len(dies) + n), [overflow[p.index][0] for p in plan.placements], outline)
+                for n, plan in enumerate(plans)]
+
+    reticle_cell = Cell(cell_name)
+    manifest = []
+    for n, (die_cell, placed, overflow, die_profile_records) in enumerate(dies):
+        PROFILE.merge(die_profile_records)
+        # Each worker made its own grating coupler cells, share the ones of this process instead
+        die_cell = intern_coupler_cells(die_cell)
+        die_x, die_y = die_origin(n)
+        reticle_cell.add_cell(die_cell, origin=(die_x, die_y))
+
+        for name, (x, y) in placed:
+            manifest.append((name, die_cell.name, x, y, die_x + x, die_y + y))
+
+    for device_function, device_kwargs in dropped:
+        print(" \n WARNING: {} did not fit on any die, it is left out \n ".format(device_kwargs['name']))
+        manifest.append((device_kwargs['name'], None, None, None, None, None))
+
+    return reticle_cell, manifest
+
+
+# Function which writes the manifest of which device landed on which die and where as a CSV file
+def save_manifest(manifest, filename):
+
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['device', 'die', 'die_x', 'die_y', 'reticle_x', 'reticle_y'])
+        for name, die, x, y, reticle_x, reticle_y in manifest:
+            # Dropped devices have no die and no position
+            writer.writerow([name.replace('\n', ' '), die or 'dropped'] +
+                            [round(value, 3) if value is not None else '' for value in (x, y, reticle_x, reticle_y)])
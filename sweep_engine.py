@@ -0,0 +1,163 @@
+import csv
+import itertools
+
+import numpy as np
+
+from components import DeviceMetadata, estimate_bounds
+from sweep_executor import SWEEP_WORKERS, build_devices
+
+# ---------------------------------------------------------------------------------------------------------------------
+# PARAMETER GRIDS -----------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+
+# A parameter grid is a list of dictionaries, one per device, mapping sweep parameter names to values
+
+
+# Function which creates every combination of the given axes, the last axis varies fastest (like nested for loops)
+def cartesian_grid(**axes):
+
+    names = list(axes)
+
+    return [dict(zip(names, values)) for values in itertools.product(*axes.values())]
+
+
+# Function which pairs up the values of equally long axes, e.g. coupling lengths with their coupling ratio names
+def zipped_grid(**axes):
+
+    lengths = {len(values) for values in axes.values()}
+    if len(lengths) > 1:
+        raise ValueError('Zipped sweep axes must all have the same length, got {}'.format(
+            {name: len(values) for name, values in axes.items()}))
+
+    names = list(axes)
+
+    return [dict(zip(names, values)) for values in zip(*axes.values())]
+
+
+# Function which creates every combination of several grids, e.g. a cartesian grid of gaps with a zipped grid of lengths
+def combine_grids(*grids):
+
+    return [dict(itertools.chain.from_iterable(params.items() for params in combination))
+            for combination in itertools.product(*grids)]
+
+
+# Function which draws uniformly distributed random samples, each range is given as (low, high)
+def random_grid(samples, seed=None, **ranges):
+
+    rng = np.random.default_rng(seed)
+    values = {name: rng.uniform(low, high, samples) for name, (low, high) in ranges.items()}
+
+    return [{name: values[name][i] for name in ranges} for i in range(samples)]
+
+
+# Function which draws a Latin hypercube sample, so each parameter range is evenly covered with only a few devices
+def latin_hypercube_grid(samples, seed=None, **ranges):
+
+    rng = np.random.default_rng(seed)
+    values = {}
+    for name, (low, high) in ranges.items():
+        strata = (rng.permutation(samples) + rng.uniform(0, 1, samples)) / samples
+        values[name] = low + strata * (high - low)
+
+    return [{name: values[name][i] for name in ranges} for i in range(samples)]
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# SWEEP ---------------------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+
+# A device sweep: a device function from components.py, the parameter grid it is swept over and how the parameters
+# become the device's arguments. Nothing is generated until the cells are iterated over.
+class Sweep:
+
+    def __init__(self, device_function, grid, name='{}', device_kwargs=None, fixed_kwargs=None):
+
+        self.device_function = device_function
+        self.grid = list(grid)
+        self.name = name                        # Label format string, filled in with the sweep parameters
+        self.device_kwargs = device_kwargs      # Function mapping sweep parameters to device arguments (default: as is)
+        self.fixed_kwargs = fixed_kwargs or {}  # Device arguments shared by every device of the sweep
+
+    def __len__(self):
+
+        return len(self.grid)
+
+    # Function which returns the device function arguments for one point of the grid
+    def kwargs_for(self, params):
+
+        kwargs = dict(self.fixed_kwargs)
+        kwargs.update(self.device_kwargs(params) if self.device_kwargs is not None else params)
+        kwargs['name'] = self.name.format(**params)
+
+        return kwargs
+
+    # Function which estimates the (xmin, ymin, xmax, ymax) bounds of every device of the sweep without generating any
+    # geometry, using the footprint estimates in components.py unless another estimator is given
+    def estimate_bounds(self, estimator=None):
+
+        if estimator is None:
+            return [estimate_bounds(self.device_function, **self.kwargs_for(params)) for params in self.grid]
+
+        return [estimator(**self.kwargs_for(params)) for params in self.grid]
+
+    # Function which estimates the total area of the sweep, spacing is added around every device
+    def estimate_area(self, spacing=0, estimator=None):
+
+        return sum((bounds[2] - bounds[0] + spacing) * (bounds[3] - bounds[1] + spacing)
+                   for bounds in self.estimate_bounds(estimator))
+
+    # Function which lazily generates the devices, batch_size devices at a time (all at once by default) across
+    # the given number of workers, and yields (params, cell) pairs in grid order
+    def cells(self, batch_size=None, workers=SWEEP_WORKERS):
+
+        batch_size = batch_size or max(len(self.grid), 1)
+
+        for start in range(0, len(self.grid), batch_size):
+            batch = self.grid[start:start + batch_size]
+            device_cells = build_devices(self.device_function, [self.kwargs_for(params) for params in batch],
+                                         workers=workers)
+            for params, device_cell in zip(batch, device_cells):
+                yield params, device_cell
+
+    def __iter__(self):
+
+        return self.cells()
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# SWEEP TABLE ---------------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Function which returns the sweep-wide table of the built devices, one row per device in sweep order: the device
+# function, the metadata the device function attached to its cell (see components.DeviceMetadata) and the sweep
+# parameters. metadata is an iterable of DeviceMetadata records, devices without one (e.g. not placed) are left out.
+def sweep_table(sweeps, metadata):
+
+    by_name = {record.device: record for record in metadata}
+
+    rows = []
+    for sweep in sweeps:
+        for params in sweep.grid:
+            record = by_name.get(sweep.kwargs_for(params)['name'])
+            if record is not None:
+                row = dict(sweep=sweep.device_function.__name__)
+                row.update(record._asdict())
+                row.update((name, value) for name, value in params.items() if name not in row)
+                rows.append(row)
+
+    return rows
+
+
+# Function which writes the sweep table as CSV, the columns of sweep parameters a sweep doesn't have are left empty
+def save_sweep_table(rows, filename):
+
+    fields = ['sweep'] + list(DeviceMetadata._fields)
+    fields += list(dict.fromkeys(name for row in rows for name in row if name not in fields))
+
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fields, restval='')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(dict(row, device=row['device'].replace('\n', ' '),
+                                 **{name: round(row[name], 3) for name in ('length', 'bend_length',
+                                                                           'footprint_width', 'footprint_height')}))
@@ -0,0 +1,45 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from build_profiler import PROFILE
+from components import intern_coupler_cells
+
+# ---------------------------------------------------------------------------------------------------------------------
+# PARALLEL SWEEP EXECUTOR ---------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Number of worker processes used to build the devices of a sweep. None uses one per CPU, 1 builds serially in this
+# process (useful for debugging)
+SWEEP_WORKERS = None
+
+
+# Function run in the worker processes, builds a single device
+def _build_device(job):
+
+    device_function, device_kwargs = job
+
+    # Send the timings of this worker back with the cell, the main process adds them to its own profile
+    PROFILE.reset()
+    device_cell = device_function(**device_kwargs)
+
+    return device_cell, PROFILE.records
+
+
+# Function which builds one device cell per keyword argument dictionary across a process pool.
+# The cells are returned in the same order as device_kwargs, so the layout doesn't depend on the number of workers.
+def build_devices(device_function, device_kwargs, workers=SWEEP_WORKERS):
+
+    device_kwargs = list(device_kwargs)
+
+    if workers == 1 or len(device_kwargs) < 2:
+        return [device_function(**kwargs) for kwargs in device_kwargs]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(_build_device, [(device_function, kwargs) for kwargs in device_kwargs]))
+
+    device_cells = []
+    for device_cell, profile_records in results:
+        PROFILE.merge(profile_records)
+        device_cells.append(device_cell)
+
+    # Each worker made its own grating coupler cells, share the ones of this process instead
+    return [intern_coupler_cells(device_cell) for device_cell in device_cells]
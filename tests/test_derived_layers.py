@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+from shapely.affinity import translate
+from shapely.geometry import LineString, MultiPolygon, Point, box
+from shapely.ops import unary_union
+
+from derived_layers import derive_device_layers, derive_layers, layer_reach, source_layers, vertex_count
+from parameters import DERIVED_BUFFER_RESOLUTION, DERIVED_LAYERS, GRATING_LAYER, SLAB_PROTECTION_LAYER, \
+    SUPPORT_GAP, SUS_ETCH_LAYER, WAVEGUIDE_LAYER
+
+TILE_SIZE = 40  # Far smaller than the device, so its shapes cross many tiles
+
+
+# Function which returns the source polygons of a device about 300 x 200 um: a meandering waveguide ending on a
+# grating coupler, and a ring (a polygon with a hole) next to it
+def device_polygons():
+
+    meander = LineString([(0, 0), (120, 0), (120, 60), (20, 60), (20, 120), (250, 120), (250, 10)])
+    waveguide = meander.buffer(0.25, cap_style=2, join_style=1, resolution=16)
+    ring = Point(200, 60).buffer(30, resolution=64).difference(Point(200, 60).buffer(29.5, resolution=64))
+    teeth = [box(250 + x, -10, 250.35 + x, 10) for x in np.arange(-2.5, 2.5, 0.7)]
+    taper = box(249.75, 8, 250.25, 10.5)
+
+    return {WAVEGUIDE_LAYER: [waveguide, ring, taper], GRATING_LAYER: teeth}
+
+
+# Function which evaluates the rules on the whole layout at once, without tiles
+def untiled_layers(polygons, rules=DERIVED_LAYERS):
+
+    layers = {layer: unary_union(layer_polygons) for layer, layer_polygons in polygons.items()}
+    for layer, grown, distance, cut in rules:
+        region = unary_union([layers[source].buffer(distance, DERIVED_BUFFER_RESOLUTION) for source in grown])
+        layers[layer] = region.difference(unary_union([layers[source] for source in cut]))
+
+    return layers
+
+
+@pytest.fixture(scope='module')
+def tiled():
+
+    return derive_layers(device_polygons(), tile_size=TILE_SIZE, workers=1)
+
+
+def test_layer_reach_and_sources():
+
+    assert layer_reach() == {SLAB_PROTECTION_LAYER: SUPPORT_GAP, SUS_ETCH_LAYER: SUPPORT_GAP}
+    assert source_layers() == [GRATING_LAYER, WAVEGUIDE_LAYER]
+
+
+@pytest.mark.parametrize('layer', [SLAB_PROTECTION_LAYER, SUS_ETCH_LAYER])
+def test_tiled_result_equals_the_untiled_union(tiled, layer):
+
+    expected = untiled_layers(device_polygons())[layer]
+    result = unary_union(tiled[layer])
+
+    # Only the slivers below the GDS grid are dropped
+    assert expected.area > 0
+    assert result.symmetric_difference(expected).area < 1e-6 * expected.area
+
+
+def test_tiled_pieces_can_be_written_as_they_are(tiled):
+
+    for layer, polygons in tiled.items():
+        assert polygons
+        for polygon in polygons:
+            assert polygon.is_valid
+            assert not polygon.interiors
+            assert vertex_count(polygon) <= 4000
+
+    # The pieces of a layer don't overlap each other
+    trench = tiled[SUS_ETCH_LAYER]
+    assert sum(polygon.area for polygon in trench) == pytest.approx(unary_union(trench).area, rel=1e-9)
+
+
+def test_tiled_result_does_not_depend_on_the_tile_size(tiled):
+
+    whole = derive_layers(device_polygons(), tile_size=1000, workers=1)
+
+    for layer in tiled:
+        assert unary_union(tiled[layer]).symmetric_difference(unary_union(whole[layer])).area < 1e-6
+
+
+def test_streamed_devices_give_the_same_layers():
+
+    origins = [(0, 0), (0, 260), (320, 0)]
+    layout = {layer: [translate(polygon, *origin) for origin in origins for polygon in layer_polygons]
+              for layer, layer_polygons in device_polygons().items()}
+    loads = []
+
+    # Function which returns the placed polygons of a device, counting the loads
+    def load(origin):
+        loads.append(origin)
+        return {layer: [translate(polygon, *origin) for polygon in layer_polygons]
+                for layer, layer_polygons in device_polygons().items()}
+
+    devices = []
+    for origin in origins:
+        x0, y0, x1, y1 = MultiPolygon([polygon for layer_polygons in load(origin).values()
+                                       for polygon in layer_polygons]).bounds
+        devices.append(((x0, y0, x1, y1), lambda origin=origin: load(origin)))
+    loads.clear()
+
+    streamed = derive_device_layers(devices, tile_size=TILE_SIZE, workers=1)
+    in_memory = derive_layers(layout, tile_size=TILE_SIZE, workers=1)
+
+    # Every device is loaded once, for the first row of tiles it reaches
+    assert sorted(loads) == sorted(origins)
+    for layer in in_memory:
+        assert unary_union(streamed[layer]).symmetric_difference(unary_union(in_memory[layer])).area < 1e-6
@@ -0,0 +1,133 @@
+import pytest
+from gdshelpers.geometry.chip import Cell
+from shapely.geometry import box
+
+import drc
+from drc import check_layout
+from parameters import GRATING_LAYER, WAVEGUIDE_LAYER, WG_MIN_SPACING
+
+CHIP = box(0, 0, 1000, 1000)
+
+
+# Function which returns a device cell holding the given (layer, polygon) shapes
+def device(name, *shapes):
+
+    cell = Cell(name)
+    for layer, polygon in shapes:
+        cell.add_to_layer(layer, polygon)
+
+    return cell
+
+
+# Function which returns a top cell placing the devices at the given origins
+def layout(*placed):
+
+    top_cell = Cell('top')
+    for device_cell, origin in placed:
+        top_cell.add_cell(device_cell, origin=origin)
+
+    return top_cell
+
+
+# Function which returns the violations of one rule
+def violations(report, rule):
+
+    return [violation for violation in report.violations if violation.rule == rule]
+
+
+# Function which returns a straight waveguide starting at (x, y)
+def waveguide(x, y, length=100, width=0.5):
+
+    return WAVEGUIDE_LAYER, box(x, y, x + length, y + width)
+
+
+def test_clean_layout_passes():
+
+    report = check_layout(layout((device('a', waveguide(0, 0), waveguide(0, 5)), (100, 100)),
+                                 (device('b', waveguide(0, 0)), (100, 100 + 5 + WG_MIN_SPACING + 1))), CHIP)
+
+    assert report.passed, report.report()
+    assert report.polygons == 3
+
+
+def test_min_width():
+
+    report = check_layout(layout((device('a', waveguide(0, 0, width=0.1)), (100, 100))), CHIP)
+
+    found = violations(report, 'min_width')
+    assert [violation.rule for violation in report.violations] == ['min_width']
+    assert found[0].value == pytest.approx(0.1, abs=0.01)
+    assert found[0].layer == WAVEGUIDE_LAYER
+    assert found[0].cells == 'a'
+    assert 100 <= found[0].x <= 200 and 100 <= found[0].y <= 100.1
+
+
+def test_min_width_is_reported_at_every_copy():
+
+    narrow = device('a', waveguide(0, 0, width=0.1))
+    report = check_layout(layout((narrow, (100, 100)), (narrow, (100, 300))), CHIP)
+
+    assert sorted(round(violation.y) for violation in violations(report, 'min_width')) == [100, 300]
+
+
+def test_min_spacing():
+
+    report = check_layout(layout((device('a', waveguide(0, 0), waveguide(0, 0.6)), (100, 100))), CHIP)
+
+    found = violations(report, 'min_spacing')
+    assert [violation.rule for violation in report.violations] == ['min_spacing']
+    assert found[0].value == pytest.approx(0.1)
+    assert found[0].y == pytest.approx(100.55)
+
+
+def test_device_spacing():
+
+    gap = WG_MIN_SPACING / 2
+    report = check_layout(layout((device('a', waveguide(0, 0)), (100, 100)),
+                                 (device('b', waveguide(0, 0)), (100, 100.5 + gap))), CHIP)
+
+    found = violations(report, 'device_spacing')
+    assert [violation.rule for violation in report.violations] == ['device_spacing']
+    assert found[0].value == pytest.approx(gap)
+    assert found[0].limit == WG_MIN_SPACING
+    assert found[0].cells == 'a / b'
+
+
+def test_overlap():
+
+    report = check_layout(layout((device('a', waveguide(0, 0)), (100, 100)),
+                                 (device('b', waveguide(0, 0)), (150, 100.25))), CHIP)
+
+    found = violations(report, 'overlap')
+    assert [violation.rule for violation in report.violations] == ['overlap']
+    assert found[0].cells == 'a / b'
+    assert 150 <= found[0].x <= 200
+
+
+def test_enclosure(monkeypatch):
+
+    monkeypatch.setitem(drc.DRC_ENCLOSURE, (GRATING_LAYER, WAVEGUIDE_LAYER), 1)
+    enclosed = device('a', (WAVEGUIDE_LAYER, box(0, 0, 10, 10)), (GRATING_LAYER, box(2, 2, 8, 8)))
+    exposed = device('b', (WAVEGUIDE_LAYER, box(0, 0, 10, 10)), (GRATING_LAYER, box(2, 2, 9.5, 8)))
+    report = check_layout(layout((enclosed, (100, 100)), (exposed, (300, 100))), CHIP)
+
+    found = violations(report, 'enclosure')
+    assert [violation.rule for violation in report.violations] == ['enclosure']
+    assert found[0].layer == GRATING_LAYER
+    assert found[0].cells == 'b'
+    assert found[0].value > 0
+
+
+def test_chip_boundary():
+
+    report = check_layout(layout((device('a', waveguide(0, 0)), (950, 100))), CHIP)
+
+    found = violations(report, 'chip_boundary')
+    assert [violation.rule for violation in report.violations] == ['chip_boundary']
+    assert found[0].value == pytest.approx(50 * 0.5)
+    assert found[0].x > 1000
+
+
+def test_no_chip_boundary_without_an_outline():
+
+    assert check_layout(layout((device('a', waveguide(0, 0)), (950, 100)))).passed
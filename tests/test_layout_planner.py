@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from layout_planner import plan_dies, plan_layout
+from parameters import CHIP_HEIGHT, CHIP_WIDTH, GRATING_PITCH
+
+
+# Footprints like the device sweeps give: the origin is the first grating coupler port, so most devices reach to the
+# left of and below it
+def sweep_footprints(count=60, seed=1):
+
+    random = np.random.default_rng(seed)
+    footprints = []
+    for _ in range(count):
+        width, height = random.uniform(50, 900), random.uniform(50, 700)
+        left, below = random.uniform(0, 40), random.uniform(0, height)
+        footprints.append((-left, -below, width - left, height - below))
+
+    return footprints
+
+
+def overlaps(a, b):
+
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+@pytest.fixture
+def plan():
+
+    return plan_layout(sweep_footprints())
+
+
+def test_every_device_is_placed_or_overflows(plan):
+
+    indices = sorted([p.index for p in plan.placements] + plan.overflow)
+
+    assert indices == list(range(len(sweep_footprints())))
+    assert plan.placements
+
+
+def test_placements_do_not_overlap(plan):
+
+    for n, a in enumerate(plan.placements):
+        for b in plan.placements[n + 1:]:
+            assert not overlaps(a.bounds, b.bounds), (a, b)
+
+
+def test_placements_stay_inside_the_chip(plan):
+
+    for placement in plan.placements:
+        x0, y0, x1, y1 = placement.bounds
+        assert x0 >= 0 and y0 >= 0
+        assert x1 <= CHIP_WIDTH and y1 <= CHIP_HEIGHT
+
+
+def test_bounds_are_the_footprint_at_the_origin(plan):
+
+    footprints = sweep_footprints()
+    for placement in plan.placements:
+        x0, y0, x1, y1 = footprints[placement.index]
+        x, y = placement.origin
+        assert placement.bounds == pytest.approx((x0 + x, y0 + y, x1 + x, y1 + y))
+
+
+def test_origins_are_snapped_to_the_grating_pitch(plan):
+
+    for placement in plan.placements:
+        assert placement.origin[0] % GRATING_PITCH == 0
+
+
+def test_output_order_is_deterministic():
+
+    first = plan_layout(sweep_footprints())
+    second = plan_layout(sweep_footprints())
+
+    assert first.placements == second.placements
+    assert first.overflow == second.overflow
+
+
+def test_equally_tall_devices_keep_their_sweep_order():
+
+    plan = plan_layout([(0, 0, 200, 100)] * 5)
+
+    assert [p.index for p in plan.placements] == list(range(5))
+
+
+def test_devices_larger_than_the_chip_overflow():
+
+    plan = plan_layout([(0, 0, 100, 100), (0, 0, 100, CHIP_HEIGHT + 1), (0, 0, CHIP_WIDTH + 1, 100)])
+
+    assert [p.index for p in plan.placements] == [0]
+    assert plan.overflow == [1, 2]
+
+
+def test_plan_dies_assigns_every_device_once():
+
+    footprints = sweep_footprints(count=200)
+    plans, unassigned = plan_dies(footprints)
+
+    indices = sorted([p.index for die_plan in plans for p in die_plan.placements] + unassigned)
+    assert len(plans) > 1
+    assert indices == list(range(len(footprints)))
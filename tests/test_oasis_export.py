@@ -0,0 +1,268 @@
+from struct import pack, unpack
+
+import numpy as np
+import pytest
+from gdshelpers.geometry.chip import Cell
+from shapely.geometry import LineString
+
+from oasis_export import SHORT_ARRAY, OASISStreamWriter, cell_name, g_delta, g_deltas, point_list, real, repetition, signed, string, \
+    unsigned, unsigned_array
+
+
+# Minimal reader of the OASIS encodings (SEMI P39), independent of the writer
+class Reader:
+
+    def __init__(self, data):
+
+        self.data = data
+        self.position = 0
+
+    def done(self):
+
+        return self.position == len(self.data)
+
+    def unsigned(self):
+
+        value, shift = 0, 0
+        while True:
+            byte = self.data[self.position]
+            self.position += 1
+            value |= (byte & 0x7f) << shift
+            shift += 7
+            if not byte & 0x80:
+                return value
+
+    def signed(self):
+
+        value = self.unsigned()
+        return -(value >> 1) if value & 1 else value >> 1
+
+    def real(self):
+
+        kind = self.unsigned()
+        if kind in (0, 1):
+            return self.unsigned() * (-1 if kind else 1)
+        assert kind == 7
+        self.position += 8
+        return unpack('<d', self.data[self.position - 8:self.position])[0]
+
+    def string(self):
+
+        length = self.unsigned()
+        self.position += length
+        return self.data[self.position - length:self.position].decode('ascii')
+
+    def g_delta(self):
+
+        first = self.unsigned()
+        if first & 1:   # Form 2: x in the first integer, y as a signed integer
+            dx = -(first >> 2) if first & 2 else first >> 2
+            return dx, self.signed()
+        direction, length = (first >> 1) & 7, first >> 4
+        return {0: (length, 0), 1: (0, length), 2: (-length, 0), 3: (0, -length)}[direction]
+
+    def point_list(self):
+
+        assert self.unsigned() == 4
+        points = [(0, 0)]
+        for _ in range(self.unsigned()):
+            dx, dy = self.g_delta()
+            points.append((points[-1][0] + dx, points[-1][1] + dy))
+        return points
+
+    # Function which reads a repetition and returns the offsets of every copy from the first
+    def repetition(self):
+
+        kind = self.unsigned()
+        if kind == 1:
+            columns, rows = self.unsigned() + 2, self.unsigned() + 2
+            x_space, y_space = self.unsigned(), self.unsigned()
+            return [(column * x_space, row * y_space) for column in range(columns) for row in range(rows)]
+        if kind in (2, 3):
+            count, space = self.unsigned() + 2, self.unsigned()
+            return [(n * space, 0) if kind == 2 else (0, n * space) for n in range(count)]
+        if kind in (4, 5):
+            offsets = [0]
+            for _ in range(self.unsigned() + 1):
+                offsets.append(offsets[-1] + self.unsigned())
+            return [(offset, 0) if kind == 4 else (0, offset) for offset in offsets]
+        assert kind == 10
+        offsets = [(0, 0)]
+        for _ in range(self.unsigned() + 1):
+            dx, dy = self.g_delta()
+            offsets.append((offsets[-1][0] + dx, offsets[-1][1] + dy))
+        return offsets
+
+
+@pytest.mark.parametrize('value, encoded', [(0, b'\x00'), (1, b'\x01'), (127, b'\x7f'), (128, b'\x80\x01'),
+                                            (16383, b'\xff\x7f'), (16384, b'\x80\x80\x01')])
+def test_unsigned_bytes(value, encoded):
+
+    assert unsigned(value) == encoded
+
+
+@pytest.mark.parametrize('value, encoded', [(0, b'\x00'), (1, b'\x02'), (-1, b'\x03'), (63, b'\x7e'),
+                                            (-64, b'\x81\x01')])
+def test_signed_bytes(value, encoded):
+
+    assert signed(value) == encoded
+
+
+def test_integers_round_trip():
+
+    values = [0, 1, 127, 128, 2 ** 31, 2 ** 62 + 12345] + list(np.random.default_rng(0).integers(0, 2 ** 40, 100))
+    for value in values:
+        assert Reader(unsigned(int(value))).unsigned() == value
+        assert Reader(signed(int(value))).signed() == value
+        assert Reader(signed(-int(value))).signed() == -value
+
+
+@pytest.mark.parametrize('count', [SHORT_ARRAY - 1, SHORT_ARRAY, 3 * SHORT_ARRAY])
+def test_unsigned_array_matches_unsigned(count):
+
+    values = np.random.default_rng(count).integers(0, 2 ** 35, count)
+    values[:4] = [0, 127, 128, 2 ** 35]
+
+    assert unsigned_array(values) == b''.join(unsigned(int(value)) for value in values)
+
+
+@pytest.mark.parametrize('value, encoded', [(3, b'\x00\x03'), (-3, b'\x01\x03'), (0, b'\x00\x00'),
+                                            (1000.0, b'\x00\xe8\x07'), (0.5, b'\x07' + pack('<d', 0.5))])
+def test_real_bytes(value, encoded):
+
+    assert real(value) == encoded
+
+
+def test_reals_round_trip():
+
+    for value in [0, 1, -1, 1000, 0.001, -45.5, 1e-9, np.pi]:
+        assert Reader(real(value)).real() == value
+
+
+def test_string_round_trip():
+
+    reader = Reader(string('CELL_1') + string(''))
+
+    assert reader.string() == 'CELL_1'
+    assert reader.string() == ''
+    assert reader.done()
+
+
+@pytest.mark.parametrize('delta, encoded', [((5, 0), bytes([5 << 4])), ((0, 5), bytes([5 << 4 | 1 << 1])),
+                                            ((-5, 0), bytes([5 << 4 | 2 << 1])), ((0, -5), bytes([5 << 4 | 3 << 1])),
+                                            ((3, -2), bytes([3 << 2 | 1, 2 << 1 | 1]))])
+def test_g_delta_bytes(delta, encoded):
+
+    assert g_delta(*delta) == encoded
+
+
+def test_g_deltas_round_trip():
+
+    random = np.random.default_rng(1)
+    deltas = random.integers(-10 ** 6, 10 ** 6, (3 * SHORT_ARRAY, 2))
+    deltas[::3, 0] = 0
+    deltas[1::3, 1] = 0
+    deltas[5] = (0, 0)
+
+    for count in (SHORT_ARRAY - 1, len(deltas)):
+        encoded = g_deltas(deltas[:count])
+        assert encoded == b''.join(g_delta(dx, dy) for dx, dy in deltas[:count].tolist())
+        reader = Reader(encoded)
+        assert [reader.g_delta() for _ in range(count)] == [tuple(delta) for delta in deltas[:count].tolist()]
+        assert reader.done()
+
+
+@pytest.mark.parametrize('count', [4, 3 * SHORT_ARRAY])
+def test_point_list_round_trip(count):
+
+    angles = np.linspace(0, 2 * np.pi, count, endpoint=False)
+    points = np.round(np.column_stack((np.cos(angles), np.sin(angles))) * 10 ** 5).astype(np.int64)
+    reader = Reader(point_list(points))
+
+    assert reader.point_list() == [tuple(point) for point in (points - points[0]).tolist()]
+    assert reader.done()
+
+
+@pytest.mark.parametrize('positions', [
+    [(0, 0), (127, 0), (254, 0)],                               # Uniform row
+    [(5, 0), (5, 20), (5, 40), (5, 60)],                        # Uniform column
+    [(x, y) for x in (0, 127, 254) for y in (-10, 30)],         # Uniform lattice
+    [(0, 7), (3, 7), (100, 7)],                                 # Irregular row
+    [(1, 0), (1, 3), (1, 100)],                                 # Irregular column
+    [(0, 0), (10, 5), (-20, 40), (7, -3)],                      # Arbitrary
+])
+def test_repetition_round_trip(positions):
+
+    first, encoded = repetition(positions + positions[:1])  # Duplicates are placed once
+    reader = Reader(encoded)
+    offsets = reader.repetition()
+
+    assert reader.done()
+    assert sorted((first[0] + dx, first[1] + dy) for dx, dy in offsets) == sorted(positions)
+
+
+def test_single_position_has_no_repetition():
+
+    assert repetition([(3, 4), (3, 4)]) == ((3, 4), None)
+
+
+def test_cell_names_are_printable_and_unique():
+
+    names = ['RT_ZL_Ring\nRadius_70.0\nGap_0.25', 'RT_ZL_Ring Radius_70.0 Gap_0.25', 'RT_ZL_Ring_Radius_70.0_Gap_0.25',
+             'µm', '', 'top']
+    oasis_names = [cell_name(name) for name in names]
+
+    assert all(name and all('!' <= char <= '~' for char in name) for name in oasis_names)
+    assert len(set(oasis_names)) == len(names)
+    assert cell_name('RT_ZL_Ring_Radius_70.0_Gap_0.25') == 'RT_ZL_Ring_Radius_70.0_Gap_0.25'
+    assert cell_name('top') == 'top'
+
+
+def test_cell_records_round_trip(tmp_path):
+
+    cell = Cell('Label cell')
+    path = LineString([(0, 0), (10, 0), (10, 5.5)])
+    path.width = 0.5
+    cell.add_to_layer((3, 1), path)
+    cell.text_records = [((5, 0), 'Radius_70.0', (1.5, -2.0), 10, 0), ((5, 0), 'Gap_0.25', (1.5, -14.0), 10, 0)]
+
+    oasis = OASISStreamWriter(str(tmp_path / 'cell.oas'), compression_level=0)
+    try:
+        reader = Reader(oasis.encode(cell))
+    finally:
+        oasis.abort()
+
+    assert reader.unsigned() == 14 and reader.string() == cell_name('Label cell')
+
+    # PATH: layer, datatype, half width, flush ends, points relative to the first one, first point, no repetition
+    assert reader.unsigned() == 22 and reader.data[reader.position] == 0xfb
+    reader.position += 1
+    assert (reader.unsigned(), reader.unsigned(), reader.unsigned(), reader.unsigned()) == (3, 1, 250, 0b0101)
+    assert reader.point_list() == [(0, 0), (10000, 0), (10000, 5500)]
+    assert (reader.signed(), reader.signed()) == (0, 0)
+
+    # TEXT: string, layer, datatype, position, no repetition
+    texts = []
+    for _ in cell.text_records:
+        assert reader.unsigned() == 19 and reader.data[reader.position] == 0x5b
+        reader.position += 1
+        texts.append((reader.string(), reader.unsigned(), reader.unsigned(), reader.signed(), reader.signed()))
+
+    assert texts == [('Radius_70.0', 5, 0, 1500, -2000), ('Gap_0.25', 5, 0, 1500, -14000)]
+    assert reader.done()
+
+
+def test_fragments_are_kept_per_compression_level(tmp_path):
+
+    cell = Cell('device')
+    cell.add_to_layer(1, LineString([(0, 0), (10, 0)]))
+    cell.cache_key = 'device'
+
+    fragment_files = []
+    for compression_level in (0, 6):
+        oasis = OASISStreamWriter(str(tmp_path / 'cell.oas'), fragment_path=str(tmp_path),
+                                  compression_level=compression_level)
+        fragment_files.append(oasis.fragment_file(cell))
+        oasis.abort()
+
+    assert fragment_files[0] != fragment_files[1]
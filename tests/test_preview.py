@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+from gdshelpers.geometry.chip import Cell
+from shapely.affinity import affine_transform
+from shapely.geometry import Point, Polygon, box
+from shapely.ops import unary_union
+
+from parameters import WAVEGUIDE_LAYER
+from preview import fill_mask, flatten_edges
+
+HEIGHT, WIDTH = 24, 32
+
+
+# Function which returns the edges of the polygons of a layer of a cell, flattened like LayoutPreview does
+def layer_edges(cell, layer=WAVEGUIDE_LAYER):
+
+    parts = flatten_edges(cell)[layer]
+
+    return np.concatenate([starts for starts, ends in parts]), np.concatenate([ends for starts, ends in parts])
+
+
+# Function which returns a cell holding the polygons on one layer
+def polygon_cell(*polygons, name='polygons'):
+
+    cell = Cell(name)
+    for polygon in polygons:
+        cell.add_to_layer(WAVEGUIDE_LAYER, polygon)
+
+    return cell
+
+
+# Function which returns the expected mask: the pixels whose centre is inside the geometry
+def expected_mask(geometry, height=HEIGHT, width=WIDTH):
+
+    return np.array([[geometry.contains(Point(column + 0.5, row + 0.5)) for column in range(width)]
+                     for row in range(height)])
+
+
+def test_square():
+
+    square = box(3.2, 4.1, 17.7, 12.9)
+    mask = fill_mask(*layer_edges(polygon_cell(square)), HEIGHT, WIDTH)
+
+    assert mask.sum() == 15 * 9   # Pixel centres 3.5 to 17.5 and 4.5 to 12.5
+    assert np.array_equal(mask, expected_mask(square))
+
+
+def test_polygon_crossing_the_window_edges():
+
+    polygon = Polygon([(-10.3, -5.2), (40.4, 3.3), (20.1, 30.6)])
+    mask = fill_mask(*layer_edges(polygon_cell(polygon)), HEIGHT, WIDTH)
+
+    assert np.array_equal(mask, expected_mask(polygon))
+
+
+def test_polygon_with_a_hole_leaves_the_hole_empty():
+
+    ring = Polygon([(2.3, 2.2), (29.6, 2.2), (29.6, 21.7), (2.3, 21.7)], [[(8.1, 6.4), (20.2, 6.4), (14.3, 17.8)]])
+    mask = fill_mask(*layer_edges(polygon_cell(ring)), HEIGHT, WIDTH)
+
+    assert not mask[10, 14]
+    assert mask[3, 3]
+    assert np.array_equal(mask, expected_mask(ring))
+
+
+def test_overlapping_polygons_stay_filled():
+
+    polygons = [box(2.2, 2.3, 16.6, 16.7), box(9.1, 9.2, 25.4, 20.6), Polygon([(4.2, 18.3), (30.7, 1.4), (30.7, 22.8)])]
+    mask = fill_mask(*layer_edges(polygon_cell(*polygons)), HEIGHT, WIDTH)
+
+    assert mask[12, 12]   # Inside all three
+    assert np.array_equal(mask, expected_mask(unary_union(polygons)))
+
+
+@pytest.mark.parametrize('angle', [0, np.pi / 2])
+def test_mirrored_reference(angle):
+
+    triangle = Polygon([(1.2, 1.3), (12.4, 2.1), (3.3, 9.6)])
+    ring = Polygon([(0.4, -8.7), (9.6, -8.7), (9.6, -1.6), (0.4, -1.6)], [[(2.1, -6.8), (7.7, -6.8), (4.9, -3.3)]])
+    device = polygon_cell(triangle, ring, name='device')
+
+    # A mirrored copy overlapping a plain one, the overlap only stays filled if the mirrored rings keep their winding
+    top_cell = Cell('top')
+    top_cell.add_cell(device, origin=(14.35, 11.65), angle=angle)
+    top_cell.cells[-1]['x_reflection'] = True
+    top_cell.add_cell(device, origin=(10.15, 12.25))
+    mask = fill_mask(*layer_edges(top_cell), HEIGHT, WIDTH)
+
+    # Mirrored in x (y -> -y), then rotated and moved to the origin
+    cos, sin = np.cos(angle), np.sin(angle)
+    mirrored = unary_union([affine_transform(polygon, [cos, sin, sin, -cos, 14.35, 11.65])
+                            for polygon in (triangle, ring)])
+    plain = unary_union([affine_transform(polygon, [1, 0, 0, 1, 10.15, 12.25]) for polygon in (triangle, ring)])
+    assert mirrored.intersection(plain).area > 10
+    assert np.array_equal(mask, expected_mask(mirrored.union(plain)))
+
+
+def test_no_edges_in_the_window():
+
+    mask = fill_mask(*layer_edges(polygon_cell(box(100.2, 100.3, 110.4, 110.6))), HEIGHT, WIDTH)
+
+    assert mask.shape == (HEIGHT, WIDTH)
+    assert not mask.any()
@@ -0,0 +1,157 @@
+import hashlib
+import itertools
+from contextlib import contextmanager
+
+import numpy as np
+from shapely.geometry import LineString, Polygon
+
+from parameters import *
+
+# ---------------------------------------------------------------------------------------------------------------------
+# VERTEX BUDGET -------------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Bends, rings and spirals are sampled far finer than the GDS grid needs, a 26 loop spiral alone has ~100k vertices.
+# While a cell is fractured for the GDS file inside budgeted_fracturing (Cell.save and the streaming writers both call
+# Cell.get_fractured_layer_dict), the polygons of every layer with a CURVE_MAX_DEVIATION are simplified to within that
+# deviation first, then every polygon is fractured to at most MAX_POLYGON_VERTICES of its layer (the max_points of the
+# export by default), never more than the GDSII limit GDS_MAX_VERTICES.
+#
+# Only the curved runs between corners are simplified, the corners themselves (vertices turning by more than
+# CURVE_CORNER_ANGLE) are kept exactly, so pieces which abut along a straight cut (e.g. of the numpy spiral) still abut.
+
+
+class VertexCounts:
+
+    def __init__(self):
+
+        self.layers = {}    # layer: [polygons generated, vertices generated, polygons written, vertices written,
+                            #         largest polygon written]
+
+    def reset(self):
+
+        self.layers = {}
+
+    def add(self, layer, polygons_in, vertices_in, polygons_out, vertices_out, largest):
+
+        counts = self.layers.setdefault(layer, [0, 0, 0, 0, 0])
+        counts[0] += polygons_in
+        counts[1] += vertices_in
+        counts[2] += polygons_out
+        counts[3] += vertices_out
+        counts[4] = max(counts[4], largest)
+
+    # Function which returns the vertex counts per layer as text
+    def report(self):
+
+        lines = ['{0:<10} {1:>9} {2:>12} {3:>9} {4:>12} {5:>7} {6:>8}'.format(
+            'Layer', 'Polygons', 'Vertices', 'Written', 'Vertices', 'Saved', 'Largest')]
+        for layer, (polygons_in, vertices_in, polygons_out, vertices_out, largest) in sorted(self.layers.items()):
+            lines.append('{0:<10} {1:>9} {2:>12} {3:>9} {4:>12} {5:>6.1f}% {6:>8}'.format(
+                str(layer), polygons_in, vertices_in, polygons_out, vertices_out,
+                100 * (1 - vertices_out / vertices_in) if vertices_in else 0, largest))
+
+        return '\n'.join(lines)
+
+
+# Vertex counts of the cells fractured in this process (cells copied from the fragment cache aren't fractured again)
+VERTEX_COUNTS = VertexCounts()
+
+
+# Function which returns a short hash of the vertex budget, the streaming GDS writer keys its cached records on it
+def vertex_budget_key():
+
+    budget = (sorted(CURVE_MAX_DEVIATION.items()), sorted(MAX_POLYGON_VERTICES.items()), GDS_MAX_VERTICES,
+              CURVE_CORNER_ANGLE)
+
+    return hashlib.sha1(repr(budget).encode()).hexdigest()[:8]
+
+
+# Function which simplifies a closed ring of points (the last point repeating the first) to within tolerance, keeping
+# the corners. Returns the simplified points without the repeated last point.
+def simplify_ring(coords, tolerance, corner_angle=CURVE_CORNER_ANGLE):
+
+    points = np.asarray(coords)[:-1]
+    edges = np.diff(np.vstack((points[-1:], points, points[:1])), axis=0)
+    directions = np.arctan2(edges[:, 1], edges[:, 0])
+    turning = np.abs(np.angle(np.exp(1j * np.diff(directions))))
+
+    # Start at a corner, so every run between two corners is one slice of the ring
+    corners = np.flatnonzero(turning > corner_angle)
+    start = corners[0] if len(corners) else 0
+    points = np.roll(points, -start, axis=0)
+    corners = np.append(corners - start, len(points)) if len(corners) else np.array([0, len(points)])
+    ring = np.vstack((points, points[:1]))
+
+    runs = []
+    for run_start, run_stop in zip(corners[:-1], corners[1:]):
+        run = ring[run_start:run_stop + 1]
+        if len(run) > 2:
+            run = np.asarray(LineString(run).simplify(tolerance, preserve_topology=False).coords)
+        runs.append(run[:-1])
+
+    return np.vstack(runs)
+
+
+# Function which simplifies the exterior and interiors of a polygon to within tolerance. Returns the polygon unchanged
+# if the simplified one isn't valid.
+def simplify_polygon(polygon, tolerance):
+
+    exterior = simplify_ring(polygon.exterior.coords, tolerance)
+    if len(exterior) < 3:
+        return polygon
+
+    simplified = Polygon(exterior, [simplify_ring(interior.coords, tolerance) for interior in polygon.interiors])
+
+    return simplified if simplified.is_valid else polygon
+
+
+# Replacement for Cell.get_fractured_layer_dict which applies the vertex budget, see above
+def budgeted_fractured_layer_dict(cell, max_points=4000, max_line_points=4000):
+
+    from gdshelpers.geometry.shapely_adapter import _number_of_points, fracture_intelligently, geometric_union, \
+        shapely_collection_to_basic_objs
+
+    fractured_layer_dict = {}
+    for layer, geometries in cell.layer_dict.items():
+        deviation = CURVE_MAX_DEVIATION.get(layer)
+        layer_max_points = min(MAX_POLYGON_VERTICES.get(layer, max_points), GDS_MAX_VERTICES)
+
+        basic_objects = []
+        for geometry in geometries:
+            geometry = geometry.get_shapely_object() if hasattr(geometry, 'get_shapely_object') else geometry
+            if type(geometry) in [list, tuple]:
+                geometry = geometric_union(geometry)
+            basic_objects.extend(geo for geo in shapely_collection_to_basic_objs(geometry) if not geo.is_empty)
+
+        # gdshelpers stores the vertex count with the object, fracturing doesn't count the vertices again
+        generated = basic_objects
+        vertices_in = [_number_of_points(geo) for geo in generated]
+        if deviation:
+            basic_objects = [simplify_polygon(geo, deviation / 1000) if isinstance(geo, Polygon) else geo
+                             for geo in generated]
+
+        fractured = list(itertools.chain(*[fracture_intelligently(geo, layer_max_points, max_line_points)
+                                            for geo in basic_objects]))
+        vertices_out = [_number_of_points(geo) for geo in fractured]
+        VERTEX_COUNTS.add(layer, len(generated), sum(vertices_in), len(fractured), sum(vertices_out),
+                          max(vertices_out, default=0))
+
+        fractured_layer_dict[layer] = fractured
+
+    return fractured_layer_dict
+
+
+# Context manager which makes every cell fractured for the GDS file inside it (Cell.save, the streaming GDS and OASIS
+# writers) keep to the vertex budget, the gdshelpers Cell.get_fractured_layer_dict is restored when it exits
+@contextmanager
+def budgeted_fracturing():
+
+    from gdshelpers.geometry.chip import Cell
+
+    original = Cell.get_fractured_layer_dict
+    Cell.get_fractured_layer_dict = budgeted_fractured_layer_dict
+    try:
+        yield
+    finally:
+        Cell.get_fractured_layer_dict = original